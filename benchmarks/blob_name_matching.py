@@ -0,0 +1,75 @@
+"""Blob name matching benchmark.
+
+Matches a large synthetic listing against a few file regexes, in the main
+process and on process pools of increasing sizes, checking they all match the
+same blobs. On a single core host, the pools fall back to the main process.
+The speedup is only enforced on hosts with enough cores:
+
+    python benchmarks/blob_name_matching.py [blobs]
+"""
+import os
+import sys
+import time
+
+from datacatalog_fileset_enricher.gcs_blob_name_matcher import BlobNameMatcher
+
+BLOBS = 2000000
+PAGE_SIZE = 1000
+FILE_REGEXES = [r'logs/.*/2020-0[1-6]-.*\.log', r'data/[^/]*/part-.*\.parquet', r'.*\.csv']
+FILE_TYPES = ['log', 'parquet', 'csv', 'json']
+MIN_CORES = 4
+MIN_SPEEDUP = 2
+
+
+class Blob:
+    __slots__ = ['name']
+
+    def __init__(self, name):
+        self.name = name
+
+
+def make_blobs_pages(size):
+    blobs = []
+    for i in range(size):
+        file_type = FILE_TYPES[i % len(FILE_TYPES)]
+        folder = 'logs/app' if file_type == 'log' else f'data/table_{i % 100}'
+        blobs.append(Blob(f'{folder}/2020-{i % 12 + 1:02d}-{i % 28 + 1:02d}-part-{i}.{file_type}'))
+    return [blobs[i:i + PAGE_SIZE] for i in range(0, size, PAGE_SIZE)]
+
+
+def measure(processes, blobs_pages):
+    name_matcher = BlobNameMatcher(processes)
+    matched = 0
+    started_at = time.perf_counter()
+    for _, matches in name_matcher.match_blobs_pages(FILE_REGEXES, blobs_pages):
+        matched += sum(len(blob_indexes) for blob_indexes in matches)
+    elapsed = time.perf_counter() - started_at
+    name_matcher.close()
+    return matched, elapsed
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else BLOBS
+    blobs_pages = make_blobs_pages(size)
+    cores = os.cpu_count() or 1
+
+    elapsed_by_processes = {}
+    expected_matched = None
+    for processes in sorted({1, 2, min(cores, 8)}):
+        matched, elapsed = measure(processes, blobs_pages)
+        print(f'{processes} processes: {size / elapsed:12.0f} names/s ({matched} matches)')
+        if expected_matched is not None and matched != expected_matched:
+            sys.exit(f'{processes} processes matched {matched} blobs,'
+                     f' expected {expected_matched}')
+        expected_matched = matched
+        elapsed_by_processes[processes] = elapsed
+
+    most_processes = max(elapsed_by_processes)
+    speedup = elapsed_by_processes[1] / elapsed_by_processes[most_processes]
+    print(f'Speedup with {most_processes} processes: {speedup:.1f}x')
+    if cores >= MIN_CORES and speedup < MIN_SPEEDUP:
+        sys.exit(f'Expected a speedup of at least {MIN_SPEEDUP}x')
+
+
+if __name__ == '__main__':
+    main()
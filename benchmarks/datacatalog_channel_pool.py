@@ -0,0 +1,94 @@
+"""DataCatalog channel pool load test.
+
+Runs a local fake gRPC DataCatalog server, which answers ListTags after a fixed
+latency and accepts a limited number of concurrent streams per connection, as
+the production frontends do. Many threads then call list_tags through
+DataCatalogClientPools of increasing sizes, showing the throughput scaling with
+the number of channels:
+
+    python benchmarks/datacatalog_channel_pool.py [calls]
+"""
+import sys
+import threading
+import time
+
+from concurrent import futures
+
+import grpc
+
+from google.cloud.datacatalog_v1.proto import datacatalog_pb2, datacatalog_pb2_grpc
+
+from datacatalog_fileset_enricher.datacatalog_client_pool import DataCatalogClientPool
+
+CALLS = 2000
+CLIENT_THREADS = 64
+POOL_SIZES = [1, 2, 4, 8]
+RPC_LATENCY_SECONDS = 0.02
+MAX_CONCURRENT_STREAMS_PER_CONNECTION = 8
+MIN_SPEEDUP = 2
+
+
+class FakeDataCatalogServicer(datacatalog_pb2_grpc.DataCatalogServicer):
+
+    def ListTags(self, request, context):
+        time.sleep(RPC_LATENCY_SECONDS)
+        return datacatalog_pb2.ListTagsResponse()
+
+
+def start_server():
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=CLIENT_THREADS * 2),
+                         options=[('grpc.max_concurrent_streams',
+                                   MAX_CONCURRENT_STREAMS_PER_CONNECTION)])
+    datacatalog_pb2_grpc.add_DataCatalogServicer_to_server(FakeDataCatalogServicer(), server)
+    port = server.add_insecure_port('localhost:0')
+    server.start()
+    return server, port
+
+
+def measure_calls_per_second(port, pool_size, calls):
+    pool = DataCatalogClientPool(pool_size, address=f'localhost:{port}', insecure=True)
+    # Warm up, so every channel is connected before measuring.
+    for _ in range(pool_size):
+        list(pool.get_client().list_tags('entry'))
+
+    remaining_calls = iter(range(calls))
+    lock = threading.Lock()
+
+    def call_list_tags():
+        while True:
+            with lock:
+                if next(remaining_calls, None) is None:
+                    return
+            list(pool.get_client().list_tags('entry'))
+
+    threads = [threading.Thread(target=call_list_tags) for _ in range(CLIENT_THREADS)]
+    started_at = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started_at
+
+    pool.close()
+    return calls / elapsed
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else CALLS
+    server, port = start_server()
+    try:
+        calls_per_second = {}
+        for pool_size in POOL_SIZES:
+            calls_per_second[pool_size] = measure_calls_per_second(port, pool_size, calls)
+            print(f'{pool_size} channels: {calls_per_second[pool_size]:8.1f} calls/s')
+    finally:
+        server.stop(None)
+
+    speedup = calls_per_second[POOL_SIZES[-1]] / calls_per_second[POOL_SIZES[0]]
+    print(f'Speedup with {POOL_SIZES[-1]} channels: {speedup:.1f}x')
+    if speedup < MIN_SPEEDUP:
+        sys.exit(f'Expected a speedup of at least {MIN_SPEEDUP}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""GCS matchGlob listing benchmark.
+
+Runs a local fake of the GCS JSON API objects listing, which filters objects
+with matchGlob server side, and lists a sparse file pattern over a large
+bucket with and without the matchGlob translated from its file regex, checking
+both find the same objects while the glob cuts the payload and round trips:
+
+    python benchmarks/gcs_match_glob.py [objects]
+"""
+import json
+import os
+import re
+import sys
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from google.auth.credentials import AnonymousCredentials
+
+from datacatalog_fileset_enricher.gcs_storage_client_helper import StorageClientHelper
+from datacatalog_fileset_enricher.gcs_storage_filter import StorageFilter
+
+OBJECTS = 100000
+PAGE_SIZE = 1000
+BUCKET = 'my_bucket'
+FILE_TYPES = ['csv', 'json', 'parquet', 'txt', 'log', 'tmp', 'gz', 'orc', 'xml', 'avro']
+FILE_PATTERN = f'gs://{BUCKET}/data/*/part-*.avro'
+MIN_PAYLOAD_REDUCTION = 5
+
+
+class FakeStorageServer(ThreadingHTTPServer):
+
+    def __init__(self, object_names):
+        super().__init__(('localhost', 0), FakeStorageHandler)
+        self.object_names = object_names
+        self.requests = 0
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+
+
+class FakeStorageHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {name: values[0] for name, values in parse_qs(url.query).items()}
+        if url.path == f'/storage/v1/b/{BUCKET}':
+            self.__send_json({'kind': 'storage#bucket', 'name': BUCKET})
+        elif url.path == f'/storage/v1/b/{BUCKET}/o':
+            self.__send_json(self.__list_objects(params))
+        else:
+            self.send_error(404)
+
+    def __list_objects(self, params):
+        prefix = params.get('prefix', '')
+        glob_regex = glob_to_regex(params['matchGlob']) if 'matchGlob' in params else None
+        start = int(params.get('pageToken', 0))
+
+        names = []
+        position = start
+        object_names = self.server.object_names
+        while position < len(object_names) and len(names) < PAGE_SIZE:
+            name = object_names[position]
+            if name.startswith(prefix) and (not glob_regex or glob_regex.match(name)):
+                names.append(name)
+            position += 1
+
+        response = {
+            'kind': 'storage#objects',
+            'items': [make_object(name) for name in names],
+        }
+        if position < len(object_names):
+            response['nextPageToken'] = str(position)
+        return response
+
+    def __send_json(self, body):
+        payload = json.dumps(body).encode()
+        with self.server.lock:
+            self.server.requests += 1
+            self.server.bytes_sent += len(payload)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def glob_to_regex(glob):
+    regex_parts = []
+    for part in re.split(r'(\*\*|\*|\?)', glob):
+        regex_parts.append({'**': '.*', '*': '[^/]*', '?': '[^/]'}.get(part, re.escape(part)))
+    return re.compile(f'^{"".join(regex_parts)}$')
+
+
+def make_object(name):
+    return {
+        'kind': 'storage#object',
+        'name': name,
+        'bucket': BUCKET,
+        'size': '1024',
+        'timeCreated': '2020-01-01T00:00:00.000Z',
+        'updated': '2020-01-02T00:00:00.000Z',
+        'mediaLink': f'https://storage.googleapis.com/{BUCKET}/{name}',
+    }
+
+
+def make_object_names(size):
+    return sorted(f'data/table_{i % 50}/part-{i}.{FILE_TYPES[i % len(FILE_TYPES)]}'
+                  for i in range(size))
+
+
+def list_matching_names(storage_helper, file_regex, match_glob):
+    prefix = StorageFilter.get_literal_prefix(file_regex)
+    files_regex = re.compile(f'^{file_regex}$')
+    return [
+        blob.name for blob in storage_helper.list_blobs(BUCKET, prefix, match_glob)
+        if files_regex.match(blob.name)
+    ]
+
+
+def measure(server, file_regex, match_glob):
+    server.requests = server.bytes_sent = 0
+    storage_helper = StorageClientHelper('test_project', AnonymousCredentials())
+    names = list_matching_names(storage_helper, file_regex, match_glob)
+    return names, server.requests, server.bytes_sent
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else OBJECTS
+    server = FakeStorageServer(make_object_names(size))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ['STORAGE_EMULATOR_HOST'] = f'http://localhost:{server.server_address[1]}'
+
+    try:
+        file_regex = StorageFilter.parse_gcs_file_patterns([FILE_PATTERN])[0]['file_regex']
+        match_glob = StorageFilter.convert_regex_to_match_glob(file_regex)
+        print(f'{FILE_PATTERN}: file regex {file_regex}, matchGlob {match_glob}')
+
+        names, requests, bytes_sent = measure(server, file_regex, None)
+        print(f'Client side matching: {len(names)} matches, {requests} requests,'
+              f' {bytes_sent / 1e6:.1f} MB')
+        glob_names, glob_requests, glob_bytes_sent = measure(server, file_regex, match_glob)
+        print(f'Server side matchGlob: {len(glob_names)} matches, {glob_requests} requests,'
+              f' {glob_bytes_sent / 1e6:.1f} MB')
+    finally:
+        server.shutdown()
+
+    if glob_names != names:
+        sys.exit('Listing with matchGlob found different objects')
+    reduction = bytes_sent / glob_bytes_sent
+    print(f'Payload reduction: {reduction:.1f}x')
+    if reduction < MIN_PAYLOAD_REDUCTION:
+        sys.exit(f'Expected a payload reduction of at least {MIN_PAYLOAD_REDUCTION}x')
+
+
+if __name__ == '__main__':
+    main()
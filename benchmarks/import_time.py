@@ -0,0 +1,51 @@
+"""Import time benchmark, based on `python -X importtime`.
+
+Each module is imported in a fresh interpreter a few times and the best
+cumulative import time is compared against its budget, so startup
+regressions fail the run:
+
+    python benchmarks/import_time.py
+"""
+import re
+import subprocess
+import sys
+
+# Cumulative import time budgets, in milliseconds.
+IMPORT_TIME_BUDGETS = {
+    'datacatalog_fileset_enricher': 20,
+    'datacatalog_fileset_enricher.datacatalog_fileset_enricher_cli': 50,
+}
+RUNS = 5
+
+_IMPORT_TIME_LINE_REGEX = r'^import time:\s+(\d+) \|\s+(\d+) \|(\s+)(\S+)$'
+
+
+def measure_import_time(module):
+    """Returns the cumulative import time in milliseconds of each imported module."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            stderr=subprocess.PIPE,
+                            universal_newlines=True,
+                            check=True)
+
+    import_times = {}
+    for line in result.stderr.splitlines():
+        re_match = re.match(_IMPORT_TIME_LINE_REGEX, line)
+        if re_match:
+            _, cumulative_us, _, imported_module = re_match.groups()
+            import_times[imported_module] = int(cumulative_us) / 1000
+    return import_times
+
+
+def main():
+    over_budget = False
+    for module, budget in IMPORT_TIME_BUDGETS.items():
+        best_time = min(measure_import_time(module)[module] for _ in range(RUNS))
+        status = 'OK' if best_time <= budget else 'OVER BUDGET'
+        over_budget = over_budget or best_time > budget
+        print(f'{module}: {best_time:.1f} ms (budget: {budget} ms) {status}')
+
+    return 1 if over_budget else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
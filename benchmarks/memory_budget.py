@@ -0,0 +1,90 @@
+"""Memory budget benchmark.
+
+Lists a synthetic bucket from a local fake of the GCS JSON API and builds the
+Fileset statistics of all its objects with each stats backend, tracing the
+peak memory of the listing and stats phases as the --memory-profile mode does.
+Fails when the peak memory per million matched objects exceeds its budget:
+
+    python benchmarks/memory_budget.py [objects]
+"""
+import io
+import os
+import sys
+import threading
+
+from datetime import datetime, timezone
+
+from google.auth.credentials import AnonymousCredentials
+
+from datacatalog_fileset_enricher.gcs_storage_filter import StorageFilter
+from datacatalog_fileset_enricher.gcs_storage_scan_planner import StorageScanPlanner
+from datacatalog_fileset_enricher.gcs_storage_stats_backend import release_dataframe
+from datacatalog_fileset_enricher.gcs_storage_stats_summarizer import GCStorageStatsSummarizer
+from datacatalog_fileset_enricher.memory_profiler import MemoryProfiler
+from gcs_match_glob import BUCKET, FakeStorageServer, make_object_names
+
+OBJECTS = 50000
+FILE_PATTERN = f'gs://{BUCKET}/data/*'
+# Peak MB per million matched objects, without and with a memory ceiling.
+# The listed blobs dominate the peak until they are converted.
+BUDGETS_MB_PER_MILLION = {
+    ('python', None): 4000,
+    ('pandas', None): 4000,
+    ('python', 10000): 1500,
+    ('pandas', 10000): 1500,
+}
+
+
+def profile_fileset(memory_profiler, stats_backend, max_rows_in_memory):
+    storage_filter = StorageFilter('test_project', stats_backend, max_rows_in_memory,
+                                   AnonymousCredentials())
+    scan_planner = StorageScanPlanner(storage_filter, max_rows_in_memory)
+    parsed_gcs_patterns = storage_filter.parse_gcs_file_patterns([FILE_PATTERN])
+
+    with memory_profiler.profile(f'{stats_backend}, max rows in memory:'
+                                 f' {max_rows_in_memory}') as memory_profile:
+        with memory_profile.phase('listing'):
+            dataframe, filtered_buckets_stats = \
+                scan_planner.create_filtered_data_for_entries([parsed_gcs_patterns])[0]
+        memory_profile.matched_objects = len(dataframe)
+
+        with memory_profile.phase('stats'):
+            GCStorageStatsSummarizer.create_stats_from_dataframe(dataframe, [FILE_PATTERN],
+                                                                 filtered_buckets_stats,
+                                                                 datetime.now(timezone.utc),
+                                                                 None)
+            release_dataframe(dataframe)
+
+    return memory_profile
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else OBJECTS
+    server = FakeStorageServer(make_object_names(size))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ['STORAGE_EMULATOR_HOST'] = f'http://localhost:{server.server_address[1]}'
+
+    memory_profiler = MemoryProfiler()
+    memory_profiler.start()
+    over_budget = []
+    try:
+        for (stats_backend, max_rows_in_memory), budget in BUDGETS_MB_PER_MILLION.items():
+            memory_profile = profile_fileset(memory_profiler, stats_backend, max_rows_in_memory)
+            peak_mb_per_million = memory_profile.peak / 2**20 * 1e6 / \
+                memory_profile.matched_objects
+            if peak_mb_per_million > budget:
+                over_budget.append(f'{memory_profile.name}: {peak_mb_per_million:.0f} MB per'
+                                   f' million objects, budget {budget} MB')
+    finally:
+        memory_profiler.stop()
+        server.shutdown()
+
+    report = io.StringIO()
+    memory_profiler.write_report(report)
+    print(report.getvalue(), end='')
+    if over_budget:
+        sys.exit('\n'.join(over_budget))
+
+
+if __name__ == '__main__':
+    main()
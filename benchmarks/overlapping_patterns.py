@@ -0,0 +1,99 @@
+"""Overlapping file patterns benchmark.
+
+Runs the local fake of the GCS JSON API from gcs_match_glob.py, and gets the
+files information of a Fileset whose file patterns heavily overlap, both
+listing each pattern on its own and appending the results, as done before,
+and scanning all patterns together. Checks every object is counted once by
+the scan, while it takes a fraction of the requests and rows:
+
+    python benchmarks/overlapping_patterns.py [objects]
+"""
+import os
+import re
+import sys
+import threading
+import time
+
+from google.auth.credentials import AnonymousCredentials
+
+from datacatalog_fileset_enricher.gcs_storage_filter import StorageFilter
+from datacatalog_fileset_enricher.gcs_storage_scan_planner import StorageScanPlanner
+from gcs_match_glob import BUCKET, FakeStorageServer, make_object_names
+
+OBJECTS = 50000
+FILE_PATTERNS = [
+    f'gs://{BUCKET}/data/*',
+    f'gs://{BUCKET}/data/table_1*',
+    f'gs://{BUCKET}/data/table_1*/*.csv',
+    f'gs://{BUCKET}/data/table_2*',
+    f'gs://{BUCKET}/data/*.json',
+    f'gs://{BUCKET}/data/*/part-1*',
+]
+MIN_REQUESTS_REDUCTION = 1.5
+
+
+def count_distinct_matches(object_names, parsed_gcs_patterns):
+    file_regexes = [
+        re.compile(f'^{parsed_gcs_pattern["file_regex"]}$')
+        for parsed_gcs_pattern in parsed_gcs_patterns
+    ]
+    return sum(1 for name in object_names if any(regex.match(name) for regex in file_regexes))
+
+
+def scan_per_pattern(storage_filter, parsed_gcs_patterns):
+    rows = 0
+    scan_planner = StorageScanPlanner(storage_filter)
+    for parsed_gcs_pattern in parsed_gcs_patterns:
+        # Each pattern gets its bucket again, as done before.
+        storage_filter.clear_cache()
+        dataframe, _ = scan_planner.create_filtered_data_for_entries([[parsed_gcs_pattern]])[0]
+        rows += len(dataframe) if dataframe is not None else 0
+    return rows
+
+
+def scan_together(storage_filter, parsed_gcs_patterns):
+    dataframe, _ = StorageScanPlanner(storage_filter).create_filtered_data_for_entries(
+        [parsed_gcs_patterns])[0]
+    return len(dataframe) if dataframe is not None else 0
+
+
+def measure(server, scan, parsed_gcs_patterns):
+    server.requests = server.bytes_sent = 0
+    storage_filter = StorageFilter('test_project', None, None, AnonymousCredentials())
+    start = time.perf_counter()
+    rows = scan(storage_filter, parsed_gcs_patterns)
+    return rows, server.requests, time.perf_counter() - start
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else OBJECTS
+    object_names = make_object_names(size)
+    server = FakeStorageServer(object_names)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ['STORAGE_EMULATOR_HOST'] = f'http://localhost:{server.server_address[1]}'
+
+    try:
+        parsed_gcs_patterns = StorageFilter.parse_gcs_file_patterns(FILE_PATTERNS)
+        distinct_matches = count_distinct_matches(object_names, parsed_gcs_patterns)
+        print(f'{len(FILE_PATTERNS)} overlapping file patterns over {size} objects:'
+              f' {distinct_matches} distinct matches')
+
+        rows, requests, elapsed = measure(server, scan_per_pattern, parsed_gcs_patterns)
+        print(f'Per pattern: {rows} rows, {requests} requests, {elapsed:.2f}s')
+        scan_rows, scan_requests, scan_elapsed = measure(server, scan_together,
+                                                         parsed_gcs_patterns)
+        print(f'Scanned together: {scan_rows} rows, {scan_requests} requests,'
+              f' {scan_elapsed:.2f}s')
+    finally:
+        server.shutdown()
+
+    if scan_rows != distinct_matches:
+        sys.exit(f'Expected {distinct_matches} rows, each object counted once')
+    reduction = requests / scan_requests
+    print(f'Requests reduction: {reduction:.1f}x, rows reduction: {rows / scan_rows:.1f}x')
+    if reduction < MIN_REQUESTS_REDUCTION:
+        sys.exit(f'Expected a requests reduction of at least {MIN_REQUESTS_REDUCTION}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Stats backends benchmark.
+
+Builds the files data and the Fileset statistics with each stats backend,
+for a small and a large synthetic fileset, and checks they produce the same
+stats. Backends whose optional dependency is not installed are skipped. Fails
+when the arrow backend isn't MIN_ARROW_SPEEDUP times faster than the pandas
+one on the large fileset:
+
+    python benchmarks/stats_backends.py [large_fileset_size]
+"""
+import sys
+import time
+
+from datetime import datetime, timedelta, timezone
+
+from datacatalog_fileset_enricher.gcs_storage_stats_backend import STATS_BACKENDS
+from datacatalog_fileset_enricher.gcs_storage_stats_summarizer import GCStorageStatsSummarizer
+
+SMALL_FILESET_SIZE = 1000
+LARGE_FILESET_SIZE = 1000000
+FILE_TYPES = ['csv', 'parquet', 'json', 'avro', 'txt']
+MIN_ARROW_SPEEDUP = 1.5
+
+
+def make_rows(size):
+    first_day = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    rows = []
+    for i in range(size):
+        file_name = f'folder_{i % 100}/file_{i}.{FILE_TYPES[i % len(FILE_TYPES)]}'
+        time_created = first_day + timedelta(minutes=i, milliseconds=i % 1000)
+        time_updated = time_created + timedelta(hours=i % 48)
+        # Timestamps are RFC 3339 strings, as returned by the GCS JSON API.
+        rows.append([
+            file_name, f'https://storage.googleapis.com/my_bucket/{file_name}', i % 50000 + 1,
+            to_rfc3339(time_created),
+            to_rfc3339(time_updated)
+        ])
+    return rows
+
+
+def to_rfc3339(timestamp):
+    return timestamp.strftime('%Y-%m-%dT%H:%M:%S.') + f'{timestamp.microsecond // 1000:03d}Z'
+
+
+def run_backend(backend, rows, execution_time):
+    started_at = time.perf_counter()
+    dataframe = backend.create_dataframe(rows)
+    created_at = time.perf_counter()
+    stats = GCStorageStatsSummarizer.create_stats_from_dataframe(
+        dataframe, ['gs://my_bucket/*'], [{
+            'bucket_name': 'my_bucket',
+            'files': len(rows)
+        }], execution_time, None)
+    return stats, created_at - started_at, time.perf_counter() - created_at
+
+
+def main(argv):
+    large_fileset_size = int(argv[0]) if argv else LARGE_FILESET_SIZE
+    execution_time = datetime.now(timezone.utc)
+
+    backends = {}
+    for name, backend in STATS_BACKENDS.items():
+        try:
+            # Also pays the import of the backend dependency before timing it.
+            backend.create_dataframe(make_rows(1))
+            backends[name] = backend
+        except ImportError:
+            print(f'{name:>8} | skipped, its dependency is not installed')
+
+    for size in [SMALL_FILESET_SIZE, large_fileset_size]:
+        rows = make_rows(size)
+        all_stats = []
+        total_times = {}
+        for name, backend in backends.items():
+            stats, create_time, summarize_time = run_backend(backend, rows, execution_time)
+            all_stats.append(stats)
+            total_times[name] = create_time + summarize_time
+            print(f'{name:>8} | {size:>9} files | create: {create_time * 1000:9.1f} ms'
+                  f' | summarize: {summarize_time * 1000:9.1f} ms')
+
+        if any(stats != all_stats[0] for stats in all_stats):
+            print('Stats backends produced different stats')
+            return 1
+
+    if 'arrow' in total_times and 'pandas' in total_times:
+        speedup = total_times['pandas'] / total_times['arrow']
+        print(f'arrow is {speedup:.1f}x faster than pandas on {large_fileset_size} files')
+        if speedup < MIN_ARROW_SPEEDUP:
+            print(f'Expected a speedup of at least {MIN_ARROW_SPEEDUP}x')
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,77 @@
+"""Timestamp parsing benchmark.
+
+Compares parsing the `timeCreated` and `updated` RFC 3339 strings one object
+at a time, as the `Blob.time_created` and `Blob.updated` properties do, with
+the bulk parsing into int64 epoch columns done by the stats backends.
+Times are reported per million objects:
+
+    python benchmarks/timestamp_parsing.py [objects]
+"""
+import sys
+import time
+
+from datetime import datetime, timedelta, timezone
+
+from google.cloud._helpers import _rfc3339_nanos_to_datetime
+
+from datacatalog_fileset_enricher.gcs_storage_stats_backend import \
+    PandasStatsBackend, PythonStatsBackend, datetime_to_epoch_us, parse_timestamps_to_epoch_us
+
+OBJECTS = 200000
+
+
+def make_timestamps(size):
+    first_day = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    timestamps = []
+    for i in range(size):
+        timestamp = first_day + timedelta(seconds=i * 7, milliseconds=i % 1000)
+        timestamps.append(
+            timestamp.strftime('%Y-%m-%dT%H:%M:%S.') + f'{timestamp.microsecond // 1000:03d}Z')
+    return timestamps
+
+
+def per_object_parsing(time_created, time_updated):
+    return [(_rfc3339_nanos_to_datetime(created), _rfc3339_nanos_to_datetime(updated))
+            for created, updated in zip(time_created, time_updated)]
+
+
+def python_bulk_parsing(time_created, time_updated):
+    return parse_timestamps_to_epoch_us(time_created), parse_timestamps_to_epoch_us(time_updated)
+
+
+def pandas_bulk_parsing(time_created, time_updated):
+    rows = [[None, None, 0, created, updated]
+            for created, updated in zip(time_created, time_updated)]
+    return PandasStatsBackend.create_dataframe(rows)
+
+
+def main(argv):
+    objects = int(argv[0]) if argv else OBJECTS
+    # Each object has two timestamps: timeCreated and updated.
+    time_created = make_timestamps(objects)
+    time_updated = list(reversed(time_created))
+    scale = 1000000 / objects
+
+    for name, parser in [('per object datetime', per_object_parsing),
+                         ('bulk python epoch', python_bulk_parsing),
+                         ('bulk pandas epoch', pandas_bulk_parsing)]:
+        started_at = time.perf_counter()
+        parser(time_created, time_updated)
+        elapsed = time.perf_counter() - started_at
+        print(f'{name:>20}: {elapsed * scale:6.2f} s per million objects')
+
+    columns = PythonStatsBackend.create_dataframe([[None, None, 0, timestamp, timestamp]
+                                                   for timestamp in time_created[:1000]])
+    expected = [
+        datetime_to_epoch_us(created)
+        for created, _ in per_object_parsing(time_created[:1000], time_updated[:1000])
+    ]
+    if list(columns.time_created) != expected:
+        print('Bulk parsing produced different timestamps')
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -16,15 +16,18 @@ setup(
     },
     include_package_data=True,
     install_requires=(
-        'pandas',
         'google-cloud-storage',
         'google-cloud-datacatalog>=1,<2',
     ),
+    extras_require={
+        'arrow': ['pyarrow'],
+        'pandas': ['pandas'],
+    },
     setup_requires=(
         'flake8',
         'pytest-runner',
     ),
-    python_requires='>=3.6',
+    python_requires='>=3.7',
     tests_require=(
         'pytest-cov'
     ),
@@ -34,7 +37,6 @@ setup(
         'Development Status :: 3 - Alpha',
         'Natural Language :: English',
         'Programming Language :: Python',
-        'Programming Language :: Python :: 3.6',
         'Programming Language :: Python :: 3.7',
     ],
     url='https://github.com/mesmacosta/datacatalog-fileset-enricher',
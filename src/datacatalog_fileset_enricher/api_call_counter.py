@@ -0,0 +1,153 @@
+import contextlib
+import contextvars
+import logging
+import threading
+
+from collections import Counter
+"""
+ The API Call Counter accounts for the Cloud Storage and DataCatalog calls made
+ by a run, as they are what the API quotas are charged for.
+
+ For each API method, such as `storage.list_blobs` or `datacatalog.get_entry`,
+ it counts:
+
+  `calls`: times the method was called, including resumed listings.
+  `pages`: pages returned by the listing and search methods.
+  `bytes`: bytes of the HTTP requests and responses made to Cloud Storage,
+           and of the protobuf messages sent to and received from DataCatalog.
+
+ Calls are counted for the whole run, and for the Entry being enriched when
+ they are made. The Entry is held in a context variable, so it's inherited by
+ the threads started with a copy of the caller context. Calls made for several
+ Entries at once, such as the bucket listings shared by all the Entries of a
+ run, are only counted for the run.
+"""
+
+_current_entry = contextvars.ContextVar('api_call_counter_entry', default=None)
+
+
+class ApiCallCounter:
+    __FIELDS = ['calls', 'pages', 'bytes']
+
+    def __init__(self):
+        self.__totals = {}
+        self.__totals_by_entry = {}
+        self.__lock = threading.Lock()
+        self.__thread_local = threading.local()
+
+    @property
+    def totals(self):
+        """Returns the calls, pages and bytes of each method, for the whole run."""
+        with self.__lock:
+            return self.__copy(self.__totals)
+
+    @property
+    def entries(self):
+        with self.__lock:
+            return list(self.__totals_by_entry)
+
+    def get_entry_totals(self, entry):
+        """Returns the calls, pages and bytes of each method, made for the given Entry."""
+        with self.__lock:
+            return self.__copy(self.__totals_by_entry.get(entry, {}))
+
+    @contextlib.contextmanager
+    def entry(self, name):
+        """Counts the calls made within the block for the Entry with the given name."""
+        token = _current_entry.set(name)
+        try:
+            yield
+        finally:
+            _current_entry.reset(token)
+
+    @contextlib.contextmanager
+    def track(self, method):
+        """Counts the HTTP bytes transferred by this thread within the block for method."""
+        previous_method = getattr(self.__thread_local, 'method', None)
+        self.__thread_local.method = method
+        try:
+            yield
+        finally:
+            self.__thread_local.method = previous_method
+
+    def record(self, method, calls=1, pages=0, byte_count=0):
+        entry = _current_entry.get()
+        with self.__lock:
+            self.__add(self.__totals, method, calls, pages, byte_count)
+            if entry is not None:
+                self.__add(self.__totals_by_entry.setdefault(entry, {}), method, calls, pages,
+                           byte_count)
+
+    def count_http_response(self, response, *args, **kwargs):
+        """requests response hook, counting the bytes for the method tracked by the thread."""
+        method = getattr(self.__thread_local, 'method', None)
+        if method:
+            request_body = response.request.body if response.request else None
+            self.record(method, 0, 0, len(response.content) + len(request_body or b''))
+
+    def log_summary(self):
+        for method, method_totals in sorted(self.totals.items()):
+            logging.info(f'[API: {method}] calls: {method_totals["calls"]},'
+                         f' pages: {method_totals["pages"]},'
+                         f' MB: {method_totals["bytes"] / 2**20:.2f}')
+
+    def assert_within_budget(self, budgets, entry=None):
+        """
+        Raises an AssertionError when a method was called more times than its
+        budget, for the whole run or for the given Entry. Budgets map methods
+        to their maximum number of calls.
+        """
+        totals = self.get_entry_totals(entry) if entry else self.totals
+        exceeded_budgets = [
+            f'{method}: {totals[method]["calls"]} calls, budget {budget}'
+            for method, budget in budgets.items()
+            if method in totals and totals[method]['calls'] > budget
+        ]
+        if exceeded_budgets:
+            scope = f'entry: {entry}' if entry else 'the run'
+            raise AssertionError(f'API call budget exceeded for {scope}: ' +
+                                 ', '.join(exceeded_budgets))
+
+    def write_report(self, report_file, top=None):
+        """Writes the calls by method, and the Entries ranked by their calls, most first."""
+        report_file.write(f'{"Calls":>10} {"Pages":>10} {"MB":>10}  Method\n')
+        for method, method_totals in sorted(self.totals.items()):
+            report_file.write(self.__format_totals(method_totals) + f'  {method}\n')
+
+        totals_by_entry = {entry: self.get_entry_totals(entry) for entry in self.entries}
+        if not totals_by_entry:
+            return
+
+        report_file.write(f'\n{"Calls":>10} {"Pages":>10} {"MB":>10}  Entry\n')
+        entries = sorted(totals_by_entry.items(),
+                         key=lambda entry_totals: -self.__sum(entry_totals[1])['calls'])
+        for entry, entry_totals in entries[:top]:
+            calls_by_method = ', '.join(f'{method}: {method_totals["calls"]}'
+                                        for method, method_totals in sorted(entry_totals.items()))
+            report_file.write(self.__format_totals(self.__sum(entry_totals)) +
+                              f'  {entry} ({calls_by_method})\n')
+
+    @classmethod
+    def __add(cls, totals, method, calls, pages, byte_count):
+        method_totals = totals.setdefault(method, Counter())
+        method_totals['calls'] += calls
+        method_totals['pages'] += pages
+        method_totals['bytes'] += byte_count
+
+    @classmethod
+    def __copy(cls, totals):
+        return {
+            method: {field: method_totals[field] for field in cls.__FIELDS}
+            for method, method_totals in totals.items()
+        }
+
+    @classmethod
+    def __sum(cls, totals):
+        return {
+            field: sum(method_totals[field] for method_totals in totals.values())
+            for field in cls.__FIELDS
+        }
+
+    @classmethod
+    def __format_totals(cls, totals):
+        return f'{totals["calls"]:10d} {totals["pages"]:10d} {totals["bytes"] / 2**20:10.2f}'
@@ -0,0 +1,111 @@
+import contextvars
+import logging
+import queue
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+class BoundedExecutor:
+    """
+    ThreadPoolExecutor that blocks on submit when too many tasks are pending,
+    so work can be streamed from large iterators without queueing all of it.
+    """
+
+    def __init__(self, max_workers, max_pending=None):
+        self.__executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.__pending_slots = threading.BoundedSemaphore(max_pending or max_workers * 2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+
+    def submit(self, function, *args, **kwargs):
+        self.__pending_slots.acquire()
+        try:
+            future = self.__executor.submit(function, *args, **kwargs)
+        except:  # noqa: E722
+            self.__pending_slots.release()
+            raise
+        future.add_done_callback(lambda _: self.__pending_slots.release())
+        return future
+
+    def shutdown(self, wait=True):
+        self.__executor.shutdown(wait=wait)
+
+
+_END_OF_ITERATION = object()
+
+
+def prefetch(iterable, depth=1):
+    """
+    Iterates the iterable on a background thread, up to depth items ahead of
+    the consumer, so producing the next items overlaps with consuming the
+    current one. Errors raised by the iterable are raised to the consumer.
+    """
+    items = queue.Queue(maxsize=depth)
+    stopped = threading.Event()
+
+    def put(item, error=None):
+        # The consumer may stop iterating at any time, so the producer never blocks for good.
+        while not stopped.is_set():
+            try:
+                items.put((item, error), timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+            put(_END_OF_ITERATION)
+        except BaseException as error:
+            put(_END_OF_ITERATION, error)
+
+    # The producer runs in the caller context, so context variables,
+    # such as the Entry API calls are counted for, are kept.
+    threading.Thread(target=contextvars.copy_context().run, args=(produce, ),
+                     daemon=True).start()
+    try:
+        while True:
+            item, error = items.get()
+            if error:
+                raise error
+            if item is _END_OF_ITERATION:
+                return
+            yield item
+    finally:
+        stopped.set()
+
+
+class ProgressTracker:
+    """Thread-safe counter that logs progress and throughput."""
+
+    def __init__(self, description, log_every=100):
+        self.__description = description
+        self.__log_every = log_every
+        self.__count = 0
+        self.__lock = threading.Lock()
+        self.__started_at = time.monotonic()
+
+    @property
+    def count(self):
+        return self.__count
+
+    def increment(self):
+        with self.__lock:
+            self.__count += 1
+            count = self.__count
+        if count % self.__log_every == 0:
+            self.log_progress()
+
+    def log_progress(self):
+        elapsed = max(time.monotonic() - self.__started_at, 1e-9)
+        logging.info(f'{self.__description}: {self.__count}'
+                     f' [{self.__count / elapsed:.1f}/s, {elapsed:.1f}s elapsed]')
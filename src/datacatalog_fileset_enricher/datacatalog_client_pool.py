@@ -0,0 +1,72 @@
+import threading
+
+
+class DataCatalogClientPool:
+    """
+    Round robin pool of DataCatalog clients, each one over its own gRPC channel,
+    so concurrent calls are spread across several HTTP/2 connections instead of
+    being limited by the concurrent streams of a single one.
+    """
+    __DEFAULT_ADDRESS = 'datacatalog.googleapis.com:443'
+    __SCOPES = ['https://www.googleapis.com/auth/cloud-platform']
+
+    def __init__(self, size=1, credentials=None, address=None, insecure=False):
+        self.__size = max(size, 1)
+        self.__credentials = credentials
+        self.__address = address or self.__DEFAULT_ADDRESS
+        self.__insecure = insecure
+
+        self.__clients = None
+        self.__next_client = 0
+        self.__lock = threading.Lock()
+
+    @property
+    def size(self):
+        return self.__size
+
+    def get_client(self):
+        with self.__lock:
+            # The channels are opened on first use.
+            if self.__clients is None:
+                self.__clients = self.__create_clients()
+            client = self.__clients[self.__next_client]
+            self.__next_client = (self.__next_client + 1) % self.__size
+        return client
+
+    def close(self):
+        with self.__lock:
+            for client in self.__clients or []:
+                client.transport.channel.close()
+            self.__clients = None
+
+    def __create_clients(self):
+        credentials = self.__credentials
+        if not credentials and not self.__insecure:
+            import google.auth
+            # The credentials are loaded once and shared by all channels.
+            credentials, _ = google.auth.default(scopes=self.__SCOPES)
+
+        return [self.__create_client(credentials) for _ in range(self.__size)]
+
+    def __create_client(self, credentials):
+        from google.cloud import datacatalog_v1
+        from google.cloud.datacatalog_v1.gapic.transports.data_catalog_grpc_transport import \
+            DataCatalogGrpcTransport
+
+        options = [
+            ('grpc.max_send_message_length', -1),
+            ('grpc.max_receive_message_length', -1),
+            # Channels created with the same arguments share their connections by default,
+            # a local subchannel pool gives each channel its own one.
+            ('grpc.use_local_subchannel_pool', 1),
+        ]
+        if self.__insecure:
+            import grpc
+            channel = grpc.insecure_channel(self.__address, options=options)
+        else:
+            channel = DataCatalogGrpcTransport.create_channel(self.__address,
+                                                              credentials=credentials,
+                                                              options=options)
+
+        return datacatalog_v1.DataCatalogClient(
+            transport=DataCatalogGrpcTransport(channel=channel, address=self.__address))
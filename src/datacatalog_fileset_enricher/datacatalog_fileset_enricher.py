@@ -1,12 +1,17 @@
+import contextlib
 import logging
 
-import pandas as pd
+from datetime import datetime, timezone
 
 from google.api_core.exceptions import AlreadyExists
 
+from .api_call_counter import ApiCallCounter
 from .datacatalog_helper import DataCatalogHelper
 from .gcs_storage_filter import StorageFilter
+from .gcs_storage_scan_planner import StorageScanPlanner
+from .gcs_storage_stats_backend import release_dataframe
 from .gcs_storage_stats_summarizer import GCStorageStatsSummarizer
+from .memory_profiler import EntryMemoryProfile, profile_phase
 """
  The Fileset Enhancer relies on the file_pattern created on the Entry.
 
@@ -20,6 +25,14 @@ from .gcs_storage_stats_summarizer import GCStorageStatsSummarizer
   `gs://another_bucket/a.txt`: matches `gs://another_bucket/a.txt`
   `gs://*/a.txt`: matches all buckets and all files named a.txt
   `gs://*name/a.txt`: matches all buckets that ends with name and all files named a.txt
+
+ When all Fileset Entries are enriched, their file patterns are planned
+ together, so each bucket is listed once for all the Entries referencing it.
+ While memory is profiled, Entries are enriched one at a time instead, so the
+ memory of each listing is attributed to its Entry.
+
+ The Cloud Storage and DataCatalog calls are counted by an API Call Counter,
+ by Entry when they are made for a single one, and summarized after each run.
 """
 
 
@@ -28,11 +41,34 @@ class DatacatalogFilesetEnricher:
     __LOCATION = 'us-central1'
     __FILE_PATTERN_REGEX = r'^gs:[\/][\/]([a-zA-Z-_\d*]+)[\/](.*)$'
 
-    def __init__(self, project_id):
-        self.__storage_filter = StorageFilter(project_id)
-        self.__dacatalog_helper = DataCatalogHelper(project_id)
+    def __init__(self,
+                 project_id,
+                 stats_backend=None,
+                 max_rows_in_memory=None,
+                 credentials=None,
+                 datacatalog_client_pool=None,
+                 tag_digest_store=None,
+                 segment_wildcards=False,
+                 name_matcher=None,
+                 memory_profiler=None,
+                 prefetch_pages=1,
+                 page_size=None,
+                 api_call_counter=None):
+        self.__api_calls = api_call_counter or ApiCallCounter()
+        self.__storage_filter = StorageFilter(project_id, stats_backend, max_rows_in_memory,
+                                              credentials, name_matcher, prefetch_pages,
+                                              page_size, self.__api_calls)
+        self.__scan_planner = StorageScanPlanner(self.__storage_filter, max_rows_in_memory)
+        self.__dacatalog_helper = DataCatalogHelper(project_id, datacatalog_client_pool,
+                                                    tag_digest_store, self.__api_calls)
+        self.__segment_wildcards = segment_wildcards
+        self.__memory_profiler = memory_profiler
         self.__project_id = project_id
 
+    @property
+    def api_call_counter(self):
+        return self.__api_calls
+
     def create_template(self, location):
         logging.info('===> Create Template started')
 
@@ -46,19 +82,19 @@ class DatacatalogFilesetEnricher:
 
         logging.info('==== DONE ==================================================')
 
-    def clean_up_all(self):
+    def clean_up_all(self, dry_run=False, workers=None):
         logging.info('===> Clean up started')
 
-        self.__dacatalog_helper.delete_tag_template()
+        self.__dacatalog_helper.delete_tag_template(dry_run)
         logging.info('Template and Tags deleted...')
 
-        self.__dacatalog_helper.delete_entries_and_entry_groups()
+        self.__dacatalog_helper.delete_entries_and_entry_groups(workers, dry_run)
         logging.info('==== DONE ==================================================')
 
-    def clean_up_fileset_template_and_tags(self):
+    def clean_up_fileset_template_and_tags(self, dry_run=False):
         logging.info('===> Clean up started')
 
-        self.__dacatalog_helper.delete_tag_template()
+        self.__dacatalog_helper.delete_tag_template(dry_run)
         logging.info('Template and Tags deleted...')
 
     def run(self,
@@ -66,24 +102,111 @@ class DatacatalogFilesetEnricher:
             entry_id=None,
             tag_fields=None,
             bucket_prefix=None,
-            tag_template_name=None):
+            tag_template_name=None,
+            scheduler=None):
         # If the entry_group_id and entry_id are provided we enrich just this entry,
         # otherwise we retrieve the Fileset Entries using search
         if entry_group_id and entry_id:
             self.enrich_datacatalog_fileset_entry(self.__LOCATION, entry_group_id, entry_id,
                                                   tag_fields, bucket_prefix, tag_template_name)
+        elif scheduler:
+            entries = self.get_fileset_entries()
+            self.enrich_scheduled_datacatalog_fileset_entries(entries, scheduler, tag_fields,
+                                                              bucket_prefix, tag_template_name)
         else:
-            logging.info(f'===> Retrieving manually created Fileset Entries'
-                         f' project: {self.__project_id}')
-            logging.info('')
-            entries = self.__dacatalog_helper.get_manually_created_fileset_entries()
+            entries = self.get_fileset_entries()
+            self.enrich_datacatalog_fileset_entries(entries, tag_fields, bucket_prefix,
+                                                    tag_template_name)
 
-            logging.info(f'{len(entries)} Entries will be processed...')
-            logging.info('')
+        logging.info('===> API calls made by the run')
+        self.__api_calls.log_summary()
+        logging.info('==== DONE ==================================================')
+
+    def get_fileset_entries(self):
+        logging.info(f'===> Retrieving manually created Fileset Entries'
+                     f' project: {self.__project_id}')
+        logging.info('')
+        entries = self.__dacatalog_helper.get_manually_created_fileset_entries()
 
+        logging.info(f'{len(entries)} Entries will be processed...')
+        logging.info('')
+        return entries
+
+    def get_last_enrichments(self, entries, tag_template_name=None):
+        return self.__dacatalog_helper.get_last_enrichments(entries, tag_template_name)
+
+    def clear_cache(self):
+        self.__storage_filter.clear_cache()
+
+    def enrich_scheduled_datacatalog_fileset_entries(self,
+                                                     entries,
+                                                     scheduler,
+                                                     tag_fields=None,
+                                                     bucket_prefix=None,
+                                                     tag_template_name=None):
+        logging.info('===> Get the last enrichment of each Entry from DataCatalog...')
+        last_enrichments = self.get_last_enrichments(entries, tag_template_name)
+        logging.info('==== DONE ==================================================')
+
+        # Entries are enriched one at a time, oldest Tag first, so the run can stop
+        # at the scheduler deadline.
+        for entry in scheduler.schedule(entries, last_enrichments):
+            try:
+                self.enrich_datacatalog_fileset_entry(*entry, tag_fields, bucket_prefix,
+                                                      tag_template_name)
+            except:  # noqa: E722
+                logging.exception(f'Exception enriching entry: {entry}')
+
+    def enrich_datacatalog_fileset_entries(self,
+                                           entries,
+                                           tag_fields=None,
+                                           bucket_prefix=None,
+                                           tag_template_name=None):
+        if self.__memory_profiler:
+            # Memory is traced process wide, so each Entry is listed on its own for its
+            # listing peak to be attributed to it, even if its buckets are listed again.
             for location, entry_group_id, entry_id in entries:
                 self.enrich_datacatalog_fileset_entry(location, entry_group_id, entry_id,
-                                                      tag_fields, bucket_prefix, tag_template_name)
+                                                      tag_fields, bucket_prefix,
+                                                      tag_template_name)
+            return
+
+        logging.info('')
+        logging.info(f'===> Enrich {len(entries)} Fileset Entries metadata with tags')
+        logging.info('')
+        logging.info('===> Get Entries from DataCatalog...')
+        fileset_entries = []
+        for location, entry_group_id, entry_id in entries:
+            with self.__api_calls.entry(self.__get_entry_name(location, entry_group_id,
+                                                              entry_id)):
+                fileset_entries.append(
+                    self.__dacatalog_helper.get_entry(location, entry_group_id, entry_id))
+
+        logging.info('==== DONE ==================================================')
+        logging.info('')
+
+        # The file patterns of all Entries are scanned together, listing each bucket once.
+        parsed_gcs_patterns_by_entry = [
+            self.__storage_filter.parse_gcs_file_patterns(
+                list(entry.gcs_fileset_spec.file_patterns), self.__segment_wildcards)
+            for entry in fileset_entries
+        ]
+
+        execution_time = datetime.now(timezone.utc)
+        # Each Entry is tagged once the last bucket it references is scanned, so the files
+        # information of all Entries is never held at once.
+        for entry_index, dataframe, filtered_buckets_stats in \
+                self.__scan_planner.iterate_filtered_data_for_entries(
+                    parsed_gcs_patterns_by_entry, bucket_prefix):
+            entry = fileset_entries[entry_index]
+            logging.info('')
+            logging.info(f'[ENTRY: {entry.name}]')
+            with self.__api_calls.entry(entry.name):
+                self.__create_tag_from_filtered_data(entry, dataframe, filtered_buckets_stats,
+                                                     execution_time, tag_fields, bucket_prefix,
+                                                     tag_template_name)
+            # Released before the next buckets are scanned.
+            del dataframe
 
     def enrich_datacatalog_fileset_entry(self,
                                          location,
@@ -98,62 +221,68 @@ class DatacatalogFilesetEnricher:
         logging.info(f'[ENTRY: {entry_id}]')
         logging.info('===> Enrich Fileset Entry metadata with tags')
         logging.info('')
-        logging.info('===> Get Entry from DataCatalog...')
-        entry = self.__dacatalog_helper.get_entry(location, entry_group_id, entry_id)
-        file_patterns = list(entry.gcs_fileset_spec.file_patterns)
 
-        logging.info('==== DONE ==================================================')
-        logging.info('')
+        with self.__profile_memory(f'{location}/{entry_group_id}/{entry_id}') as memory_profile, \
+                self.__api_calls.entry(self.__get_entry_name(location, entry_group_id, entry_id)):
+            logging.info('===> Get Entry from DataCatalog...')
+            entry = self.__dacatalog_helper.get_entry(location, entry_group_id, entry_id)
+            file_patterns = list(entry.gcs_fileset_spec.file_patterns)
 
-        # Split the file pattern into bucket_name and file_regex.
-        parsed_gcs_patterns = self.__storage_filter.parse_gcs_file_patterns(file_patterns)
+            logging.info('==== DONE ==================================================')
+            logging.info('')
 
-        execution_time = pd.Timestamp.utcnow()
-        dataframe, filtered_buckets_stats = self.__create_dataframe_for_parsed_gcs_patterns(
-            parsed_gcs_patterns, bucket_prefix)
+            # Split the file pattern into bucket_name and file_regex.
+            parsed_gcs_patterns = self.__storage_filter.parse_gcs_file_patterns(
+                file_patterns, self.__segment_wildcards)
+
+            execution_time = datetime.now(timezone.utc)
+            with memory_profile.phase('listing'):
+                dataframe, filtered_buckets_stats = \
+                    self.__create_dataframe_for_parsed_gcs_patterns(parsed_gcs_patterns,
+                                                                    bucket_prefix)
+            memory_profile.matched_objects = self.__count_objects(dataframe)
+
+            self.__create_tag_from_filtered_data(entry, dataframe, filtered_buckets_stats,
+                                                 execution_time, tag_fields, bucket_prefix,
+                                                 tag_template_name)
+
+    def __create_tag_from_filtered_data(self, entry, dataframe, filtered_buckets_stats,
+                                        execution_time, tag_fields, bucket_prefix,
+                                        tag_template_name):
+        file_patterns = list(entry.gcs_fileset_spec.file_patterns)
 
         logging.info('===> Generate Fileset statistics...')
-        stats = GCStorageStatsSummarizer.create_stats_from_dataframe(dataframe, file_patterns,
-                                                                     filtered_buckets_stats,
-                                                                     execution_time, bucket_prefix)
+        with profile_phase('stats'):
+            stats = GCStorageStatsSummarizer.create_stats_from_dataframe(
+                dataframe, file_patterns, filtered_buckets_stats, execution_time, bucket_prefix)
+            # Files information spilled to disk is no longer needed.
+            release_dataframe(dataframe)
 
         logging.info('==== DONE ==================================================')
         logging.info('')
 
         logging.info('===> Create Tags on DataCatalog from Fileset statistics...')
-        self.__dacatalog_helper.create_tag_from_stats(entry, stats, tag_fields, tag_template_name)
+        with profile_phase('tag'):
+            self.__dacatalog_helper.create_tag_from_stats(entry, stats, tag_fields,
+                                                          tag_template_name)
         logging.info('==== DONE ==================================================')
         logging.info('')
 
+    def __profile_memory(self, name):
+        if self.__memory_profiler:
+            return self.__memory_profiler.profile(name)
+        return contextlib.nullcontext(EntryMemoryProfile(name))
+
+    def __get_entry_name(self, location, entry_group_id, entry_id):
+        return f'projects/{self.__project_id}/locations/{location}' \
+               f'/entryGroups/{entry_group_id}/entries/{entry_id}'
+
+    @classmethod
+    def __count_objects(cls, dataframe):
+        return len(dataframe) if dataframe is not None else 0
+
     def __create_dataframe_for_parsed_gcs_patterns(self, parsed_gcs_patterns, bucket_prefix):
-        dataframe = None
-        filtered_buckets_stats = []
-        for parsed_gcs_pattern in parsed_gcs_patterns:
-
-            bucket_name = parsed_gcs_pattern['bucket_name']
-
-            # If we have a wildcard on the bucket_name,
-            # we have to retrieve all buckets from the project
-            if '*' in bucket_name:
-                aux_dataframe, inner_filtered_buckets_stats = self.__storage_filter. \
-                    create_filtered_data_for_multiple_buckets(bucket_name, parsed_gcs_pattern[
-                        "file_regex"], bucket_prefix)
-                if dataframe is not None:
-                    dataframe = dataframe.append(aux_dataframe)
-                else:
-                    dataframe = aux_dataframe
-                # We are dealing with a list of buckets so we extend it
-                filtered_buckets_stats.extend(inner_filtered_buckets_stats)
-
-            else:
-                aux_dataframe, inner_filtered_buckets_stats = self.__storage_filter. \
-                    create_filtered_data_for_single_bucket(bucket_name,
-                                                           parsed_gcs_pattern["file_regex"])
-                if dataframe is not None:
-                    dataframe = dataframe.append(aux_dataframe)
-                else:
-                    dataframe = aux_dataframe
-                # We are dealing with a list of buckets so we extend it
-                filtered_buckets_stats.extend(inner_filtered_buckets_stats)
-
-        return dataframe, filtered_buckets_stats
+        # The file patterns are scanned together, listing each bucket once,
+        # so objects matched by overlapping patterns are only counted once.
+        return self.__scan_planner.create_filtered_data_for_entries([parsed_gcs_patterns],
+                                                                    bucket_prefix)[0]
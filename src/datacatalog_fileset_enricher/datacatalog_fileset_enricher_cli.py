@@ -1,10 +1,17 @@
 import argparse
 import logging
+import re
+import sys
 
-from .datacatalog_fileset_enricher import DatacatalogFilesetEnricher
+# The enricher modules import pandas and the Google Cloud client libraries,
+# so they are only imported by the subcommands that need them, keeping
+# the CLI startup fast.
 
 
 class DatacatalogFilesetEnricherCLI:
+    __ENTRY_NAME_PATTERN = r'^projects/([^/]+)/locations/([^/]+)/entryGroups/([^/]+)' \
+                           r'/entries/([^/]+)$'
+    __SHORT_ENTRY_NAME_PATTERN = r'^([^/]+)/([^/]+)/([^/]+)$'
 
     @classmethod
     def run(cls, argv):
@@ -20,7 +27,14 @@ class DatacatalogFilesetEnricherCLI:
         parser = argparse.ArgumentParser(description=__doc__,
                                          formatter_class=argparse.RawDescriptionHelpFormatter)
 
-        parser.add_argument('--project-id', help='Project id', required=True)
+        project_ids = parser.add_mutually_exclusive_group(required=True)
+        project_ids.add_argument('--project-id', help='Project id')
+        project_ids.add_argument('--project-ids',
+                                 help='Project ids split by comma, to enrich the Filesets'
+                                 ' of several projects in a single run')
+        project_ids.add_argument('--project-ids-file',
+                                 help='File with the project ids, one per line, to enrich the'
+                                 ' Filesets of several projects in a single run')
 
         parser.set_defaults(func=lambda *inner_args: logging.info('Must use a subcommand'))
 
@@ -37,32 +51,396 @@ class DatacatalogFilesetEnricherCLI:
 
         enrich_filesets.add_argument('--entry-group-id', help='Entry Group ID')
         enrich_filesets.add_argument('--entry-id', help='Entry ID')
+        enrich_filesets.add_argument('--entries-file',
+                                     help='File with the Entries to enrich, one per line, or -'
+                                     ' to read them from stdin. Each Entry is either its full'
+                                     ' name, projects/p/locations/l/entryGroups/g/entries/e, or'
+                                     ' location/entry_group_id/entry_id for Entries of'
+                                     ' --project-id')
         enrich_filesets.add_argument('--tag-fields',
                                      help='Specify the fields you want on the generated Tags,'
                                      ' split by comma, use the list available in the docs')
         enrich_filesets.add_argument('--bucket-prefix',
                                      help='Specify a bucket prefix if you want to avoid scanning'
                                      ' too many GCS buckets')
+        cls.__add_stats_backend_argument(enrich_filesets)
+        cls.__add_max_rows_in_memory_argument(enrich_filesets)
+        cls.__add_datacatalog_channels_argument(enrich_filesets)
+        cls.__add_tag_digest_store_arguments(enrich_filesets)
+        cls.__add_segment_wildcards_argument(enrich_filesets)
+        cls.__add_matching_processes_argument(enrich_filesets)
+        cls.__add_listing_pages_arguments(enrich_filesets)
+        enrich_filesets.add_argument('--memory-profile',
+                                     help='Trace the memory allocated while enriching each Entry'
+                                     ' and write a report of the heaviest Entries to this file,'
+                                     ' with their peak memory by phase. Slows down the run')
+        enrich_filesets.add_argument('--api-calls-report',
+                                     help='Write the Cloud Storage and DataCatalog calls, pages'
+                                     ' and bytes of the run to this file, by API method and'
+                                     ' by Entry')
+        enrich_filesets.add_argument('--time-budget',
+                                     help='Seconds after which no more Entries are enriched.'
+                                     ' Entries are enriched oldest Tag first, so the ones left'
+                                     ' go first on the next run',
+                                     type=int)
+        enrich_filesets.add_argument('--size-cost',
+                                     help='Defer the Entries not expected to finish within the'
+                                     ' time budget, estimated from the files counted by their'
+                                     ' last Tag, in favour of smaller ones',
+                                     action='store_true')
+        enrich_filesets.add_argument('--workers',
+                                     help='Maximum number of Entries enriched concurrently,'
+                                     ' when enriching several projects',
+                                     type=int,
+                                     default=8)
+        enrich_filesets.add_argument('--workers-per-project',
+                                     help='Maximum number of Entries of the same project'
+                                     ' enriched concurrently, when enriching several projects',
+                                     type=int,
+                                     default=2)
         enrich_filesets.set_defaults(func=cls.__enrich_fileset)
 
+        run_service = subparsers.add_parser(
+            'run-service',
+            help='Run a long-running service that enriches Entries enqueued over HTTP')
+        run_service.add_argument('--host', help='Host to listen on', default='localhost')
+        run_service.add_argument('--port', help='Port to listen on', type=int, default=8080)
+        run_service.add_argument('--workers',
+                                 help='Maximum number of Entries enriched concurrently',
+                                 type=int,
+                                 default=4)
+        run_service.add_argument('--sweep-interval',
+                                 help='Seconds between full sweeps of the Fileset Entries,'
+                                 ' no sweeps are run if not provided',
+                                 type=int)
+        run_service.add_argument('--tag-template-name', help='Name of the Fileset Enrich template')
+        run_service.add_argument('--tag-fields',
+                                 help='Specify the fields you want on the generated Tags,'
+                                 ' split by comma, use the list available in the docs')
+        run_service.add_argument('--bucket-prefix',
+                                 help='Specify a bucket prefix if you want to avoid scanning'
+                                 ' too many GCS buckets')
+        cls.__add_stats_backend_argument(run_service)
+        cls.__add_max_rows_in_memory_argument(run_service)
+        cls.__add_datacatalog_channels_argument(run_service)
+        cls.__add_tag_digest_store_arguments(run_service)
+        cls.__add_segment_wildcards_argument(run_service)
+        cls.__add_matching_processes_argument(run_service)
+        cls.__add_listing_pages_arguments(run_service)
+        run_service.set_defaults(func=cls.__run_service, single_project=True)
+
         clean_up_tags = subparsers.add_parser(
             'clean-up-templates-and-tags',
             help='Clean up the Fileset Enhancer Template and Tags From the Fileset Entries')
+        cls.__add_dry_run_argument(clean_up_tags)
+        cls.__add_tag_digest_store_arguments(clean_up_tags, with_max_staleness=False)
         clean_up_tags.set_defaults(func=cls.__clean_up_fileset_template_and_tags)
 
+        clean_up_all = subparsers.add_parser(
+            'clean-up-all',
+            help='Clean up the Fileset Enhancer Template and Tags, and the manually created'
+            ' Fileset Entries and Entry Groups')
+        clean_up_all.add_argument('--workers',
+                                  help='Maximum number of concurrent delete requests',
+                                  type=int,
+                                  default=8)
+        cls.__add_dry_run_argument(clean_up_all)
+        cls.__add_tag_digest_store_arguments(clean_up_all, with_max_staleness=False)
+        clean_up_all.set_defaults(func=cls.__clean_up_all)
+
         args = parser.parse_args(argv)
+        cls.__resolve_project_ids(parser, args)
+        if getattr(args, 'entries_file', None):
+            cls.__resolve_entries(parser, args)
+        if getattr(args, 'size_cost', False) and not args.time_budget:
+            parser.error('--size-cost requires --time-budget')
         args.func(args)
 
+    @classmethod
+    def __resolve_project_ids(cls, parser, args):
+        if args.project_ids:
+            project_ids = args.project_ids.split(',')
+        elif args.project_ids_file:
+            with open(args.project_ids_file) as project_ids_file:
+                project_ids = project_ids_file.read().splitlines()
+        else:
+            project_ids = [args.project_id]
+
+        args.project_ids = [project_id.strip() for project_id in project_ids if project_id.strip()]
+        if not args.project_ids:
+            parser.error('at least one project id is required')
+        if len(args.project_ids) > 1:
+            if getattr(args, 'single_project', False):
+                parser.error('this subcommand supports a single project, use --project-id')
+            if getattr(args, 'memory_profile', None):
+                parser.error('--memory-profile supports a single project, use --project-id')
+            if getattr(args, 'size_cost', False):
+                parser.error('--size-cost supports a single project, use --project-id')
+            if getattr(args, 'entry_group_id', None) or getattr(args, 'entry_id', None):
+                parser.error('--entry-group-id and --entry-id require a single project')
+        args.project_id = args.project_ids[0]
+
+    @classmethod
+    def __resolve_entries(cls, parser, args):
+        if args.entry_group_id or args.entry_id:
+            parser.error('--entries-file can not be used with --entry-group-id and --entry-id')
+        if args.memory_profile:
+            parser.error('--memory-profile can not be used with --entries-file')
+        if args.size_cost:
+            parser.error('--size-cost can not be used with --entries-file')
+
+        if args.entries_file == '-':
+            lines = sys.stdin.read().splitlines()
+        else:
+            with open(args.entries_file) as entries_file:
+                lines = entries_file.read().splitlines()
+
+        # Repeated Entries are enriched once.
+        entries_by_project = {}
+        for line in lines:
+            entry_name = line.strip()
+            if not entry_name or entry_name.startswith('#'):
+                continue
+
+            re_match = re.match(cls.__ENTRY_NAME_PATTERN, entry_name)
+            if re_match:
+                project_id, *entry = re_match.groups()
+            else:
+                re_match = re.match(cls.__SHORT_ENTRY_NAME_PATTERN, entry_name)
+                if not re_match:
+                    parser.error(f'invalid Entry name in --entries-file: {entry_name}')
+                project_id, entry = args.project_id, re_match.groups()
+            entries_by_project.setdefault(project_id, {})[tuple(entry)] = None
+
+        if not entries_by_project:
+            parser.error('no Entries found in --entries-file')
+        args.entries_by_project = {
+            project_id: list(entries)
+            for project_id, entries in entries_by_project.items()
+        }
+        args.project_ids = list(entries_by_project)
+
     @classmethod
     def __enrich_fileset(cls, args):
-        tag_fields = None
-        if args.tag_fields:
-            tag_fields = args.tag_fields.split(',')
+        # Listed Entries are enriched by a pool of workers sharing the clients,
+        # as several projects are.
+        if len(args.project_ids) > 1 or getattr(args, 'entries_by_project', None):
+            cls.__enrich_multi_project_filesets(args)
+            return
+
+        from .datacatalog_fileset_enricher import DatacatalogFilesetEnricher
+        from .gcs_blob_name_matcher import BlobNameMatcher
+
+        datacatalog_client_pool = None
+        if args.datacatalog_channels:
+            from .datacatalog_client_pool import DataCatalogClientPool
+            datacatalog_client_pool = DataCatalogClientPool(args.datacatalog_channels)
+
+        memory_profiler = None
+        if args.memory_profile:
+            from .memory_profiler import MemoryProfiler
+            memory_profiler = MemoryProfiler()
+            memory_profiler.start()
+
+        api_call_counter = cls.__create_api_call_counter(args)
+        name_matcher = BlobNameMatcher(args.matching_processes)
+        tag_digest_store = cls.__open_tag_digest_store(args)
+        enricher = DatacatalogFilesetEnricher(args.project_id, args.stats_backend,
+                                              args.max_rows_in_memory, None,
+                                              datacatalog_client_pool, tag_digest_store,
+                                              args.segment_wildcards, name_matcher,
+                                              memory_profiler, args.prefetch_pages,
+                                              args.page_size, api_call_counter)
+        try:
+            enricher.run(args.entry_group_id, args.entry_id, cls.__parse_tag_fields(args),
+                         args.bucket_prefix, args.tag_template_name,
+                         cls.__create_scheduler(args))
+        finally:
+            name_matcher.close()
+            cls.__close_tag_digest_store(tag_digest_store)
+            if memory_profiler:
+                memory_profiler.stop()
+                with open(args.memory_profile, 'w') as report_file:
+                    memory_profiler.write_report(report_file)
+                logging.info(f'Memory profile written to: {args.memory_profile}')
+            cls.__write_api_calls_report(args, api_call_counter)
+
+    @classmethod
+    def __enrich_multi_project_filesets(cls, args):
+        from .datacatalog_fileset_enricher_multi_project import MultiProjectFilesetEnricher
+
+        api_call_counter = cls.__create_api_call_counter(args)
+        tag_digest_store = cls.__open_tag_digest_store(args)
+        enricher = MultiProjectFilesetEnricher(args.project_ids, args.workers,
+                                               args.workers_per_project, args.stats_backend,
+                                               args.max_rows_in_memory,
+                                               args.datacatalog_channels or 1, tag_digest_store,
+                                               args.segment_wildcards,
+                                               args.matching_processes, args.prefetch_pages,
+                                               args.page_size, api_call_counter)
+        try:
+            enricher.run(cls.__parse_tag_fields(args), args.bucket_prefix,
+                         args.tag_template_name, cls.__create_scheduler(args),
+                         getattr(args, 'entries_by_project', None))
+        finally:
+            cls.__close_tag_digest_store(tag_digest_store)
+            cls.__write_api_calls_report(args, api_call_counter)
+
+    @classmethod
+    def __create_api_call_counter(cls, args):
+        if not args.api_calls_report:
+            return None
+
+        from .api_call_counter import ApiCallCounter
+        return ApiCallCounter()
+
+    @classmethod
+    def __write_api_calls_report(cls, args, api_call_counter):
+        if not api_call_counter:
+            return
+
+        with open(args.api_calls_report, 'w') as report_file:
+            api_call_counter.write_report(report_file)
+        logging.info(f'API calls report written to: {args.api_calls_report}')
+
+    @classmethod
+    def __create_scheduler(cls, args):
+        if not args.time_budget:
+            return None
+
+        from .enrichment_scheduler import EnrichmentScheduler
+        return EnrichmentScheduler(args.time_budget, args.size_cost)
+
+    @classmethod
+    def __run_service(cls, args):
+        from .datacatalog_fileset_enricher_service import DatacatalogFilesetEnricherService
 
-        DatacatalogFilesetEnricher(args.project_id).run(args.entry_group_id, args.entry_id,
-                                                        tag_fields, args.bucket_prefix,
-                                                        args.tag_template_name)
+        tag_digest_store = cls.__open_tag_digest_store(args)
+        service = DatacatalogFilesetEnricherService(args.project_id, args.workers,
+                                                    args.sweep_interval,
+                                                    cls.__parse_tag_fields(args),
+                                                    args.bucket_prefix, args.tag_template_name,
+                                                    args.stats_backend,
+                                                    args.max_rows_in_memory,
+                                                    args.datacatalog_channels,
+                                                    tag_digest_store, args.segment_wildcards,
+                                                    args.matching_processes,
+                                                    args.prefetch_pages, args.page_size)
+        try:
+            service.serve(args.host, args.port)
+        except KeyboardInterrupt:
+            logging.info('Fileset Enricher Service stopped')
+        finally:
+            service.shutdown()
+            cls.__close_tag_digest_store(tag_digest_store)
+
+    @classmethod
+    def __add_stats_backend_argument(cls, parser):
+        parser.add_argument('--stats-backend',
+                            help='Backend used to compute the Fileset statistics,'
+                            ' defaults to pandas when it is installed',
+                            choices=['arrow', 'pandas', 'python'])
+
+    @classmethod
+    def __add_max_rows_in_memory_argument(cls, parser):
+        parser.add_argument('--max-rows-in-memory',
+                            help='Maximum number of files information held in memory for a'
+                            ' Fileset, past it they are spilled to a temporary file on disk',
+                            type=int)
+
+    @classmethod
+    def __add_datacatalog_channels_argument(cls, parser):
+        parser.add_argument('--datacatalog-channels',
+                            help='Number of gRPC channels the DataCatalog calls are spread over,'
+                            ' useful when Entries are enriched concurrently',
+                            type=int)
+
+    @classmethod
+    def __add_tag_digest_store_arguments(cls, parser, with_max_staleness=True):
+        parser.add_argument('--tag-digest-store',
+                            help='Local file with the digests of the Tags written, used to skip'
+                            ' reading and writing the Tags of Filesets whose stats did not change')
+        if with_max_staleness:
+            parser.add_argument('--tag-digest-max-staleness',
+                                help='Seconds after which the Tags are synchronized again,'
+                                ' even if their digests did not change',
+                                type=int)
+
+    @classmethod
+    def __add_segment_wildcards_argument(cls, parser):
+        parser.add_argument('--segment-wildcards',
+                            help='Match * within a single directory and ** across directories,'
+                            ' as documented for Fileset file patterns, so only the matching'
+                            ' directories are listed. By default, * also matches across'
+                            ' directories',
+                            action='store_true')
+
+    @classmethod
+    def __add_matching_processes_argument(cls, parser):
+        parser.add_argument('--matching-processes',
+                            help='Number of processes matching the listed object names against'
+                            ' the file patterns, for very large listings. By default, they are'
+                            ' matched by the main process',
+                            type=int)
+
+    @classmethod
+    def __add_listing_pages_arguments(cls, parser):
+        parser.add_argument('--prefetch-pages',
+                            help='Number of Cloud Storage listing pages requested in the'
+                            ' background while the current one is processed, 0 disables it',
+                            type=int,
+                            default=1)
+        parser.add_argument('--page-size',
+                            help='Maximum number of objects in each Cloud Storage listing page,'
+                            ' defaults to the API maximum',
+                            type=int)
+
+    @classmethod
+    def __open_tag_digest_store(cls, args):
+        if not args.tag_digest_store:
+            return None
+
+        from .tag_digest_store import TagDigestStore
+        return TagDigestStore(args.tag_digest_store,
+                              getattr(args, 'tag_digest_max_staleness', None))
+
+    @classmethod
+    def __close_tag_digest_store(cls, tag_digest_store):
+        if tag_digest_store:
+            tag_digest_store.close()
+
+    @classmethod
+    def __clear_tag_digest_store(cls, args):
+        # The deleted Tags must be written again on the next run.
+        if args.tag_digest_store and not args.dry_run:
+            tag_digest_store = cls.__open_tag_digest_store(args)
+            tag_digest_store.clear()
+            tag_digest_store.close()
+
+    @classmethod
+    def __add_dry_run_argument(cls, parser):
+        parser.add_argument('--dry-run',
+                            help='Only log what would be deleted',
+                            action='store_true')
+
+    @classmethod
+    def __parse_tag_fields(cls, args):
+        if args.tag_fields:
+            return args.tag_fields.split(',')
 
     @classmethod
     def __clean_up_fileset_template_and_tags(cls, args):
-        DatacatalogFilesetEnricher(args.project_id).clean_up_fileset_template_and_tags()
+        from .datacatalog_fileset_enricher import DatacatalogFilesetEnricher
+
+        for project_id in args.project_ids:
+            DatacatalogFilesetEnricher(project_id).clean_up_fileset_template_and_tags(
+                args.dry_run)
+        cls.__clear_tag_digest_store(args)
+
+    @classmethod
+    def __clean_up_all(cls, args):
+        from .datacatalog_fileset_enricher import DatacatalogFilesetEnricher
+
+        for project_id in args.project_ids:
+            DatacatalogFilesetEnricher(project_id).clean_up_all(args.dry_run, args.workers)
+        cls.__clear_tag_digest_store(args)
@@ -0,0 +1,201 @@
+import logging
+import threading
+
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .api_call_counter import ApiCallCounter
+from .datacatalog_client_pool import DataCatalogClientPool
+from .datacatalog_fileset_enricher import DatacatalogFilesetEnricher
+from .enrichment_scheduler import EnrichmentScheduler
+from .gcs_blob_name_matcher import BlobNameMatcher
+"""
+ The Multi Project Fileset Enricher enriches the manually created Fileset
+ Entries of several projects in a single run.
+
+ The credentials and a pool of `datacatalog_channels` DataCatalog clients are
+ created once and shared by all projects, as well as the pool of
+ `matching_processes` processes matching the listed blob names. Entries are discovered for every
+ project and scheduled on a single worker pool, taking turns between projects,
+ with at most `workers` Entries being enriched at a time, and at most
+ `workers_per_project` of the same project. Entries are only handed to the pool
+ when a worker is free, so none wait in its queue.
+
+ The Entries to enrich may also be given by project, instead of being
+ discovered, to enrich a list of Entries in a single run.
+
+ With a scheduler, the Entries of each project are enriched oldest Tag first,
+ and no Entry is started once the scheduler deadline passes.
+
+ The API calls of all projects are counted together, and summarized after
+ the run.
+"""
+
+
+class MultiProjectFilesetEnricher:
+    __SCOPES = ['https://www.googleapis.com/auth/cloud-platform']
+
+    def __init__(self,
+                 project_ids,
+                 workers=8,
+                 workers_per_project=2,
+                 stats_backend=None,
+                 max_rows_in_memory=None,
+                 datacatalog_channels=1,
+                 tag_digest_store=None,
+                 segment_wildcards=False,
+                 matching_processes=None,
+                 prefetch_pages=1,
+                 page_size=None,
+                 api_call_counter=None):
+
+        # Repeated project ids are enriched once.
+        self.__project_ids = list(dict.fromkeys(project_ids))
+        self.__workers = workers
+        self.__workers_per_project = workers_per_project
+        self.__stats_backend = stats_backend
+        self.__max_rows_in_memory = max_rows_in_memory
+        self.__datacatalog_channels = datacatalog_channels
+        self.__tag_digest_store = tag_digest_store
+        self.__segment_wildcards = segment_wildcards
+        self.__matching_processes = matching_processes
+        self.__prefetch_pages = prefetch_pages
+        self.__page_size = page_size
+        self.__api_calls = api_call_counter or ApiCallCounter()
+
+    def run(self,
+            tag_fields=None,
+            bucket_prefix=None,
+            tag_template_name=None,
+            scheduler=None,
+            entries_by_project=None):
+        logging.info(f'===> Enrich Fileset Entries from {len(self.__project_ids)} projects')
+        # The matching processes, if any, are shared by the projects and shut down at the end.
+        name_matcher = BlobNameMatcher(self.__matching_processes)
+        enrichers = self.__create_enrichers(name_matcher)
+
+        with name_matcher, ThreadPoolExecutor(max_workers=self.__workers) as executor:
+            if entries_by_project is None:
+                entries_by_project = dict(
+                    zip(enrichers.keys(),
+                        executor.map(self.__get_fileset_entries, enrichers.items())))
+            else:
+                entries_by_project = {
+                    project_id: list(dict.fromkeys(entries_by_project.get(project_id, [])))
+                    for project_id in enrichers
+                }
+            if scheduler:
+                entries_by_project = {
+                    project_id: self.__order_by_staleness(enrichers[project_id], entries,
+                                                          tag_template_name)
+                    for project_id, entries in entries_by_project.items()
+                }
+            results = self.__enrich_entries(executor, enrichers, entries_by_project,
+                                            (tag_fields, bucket_prefix, tag_template_name),
+                                            scheduler)
+
+        for project_id, project_results in results.items():
+            logging.info(f'[PROJECT: {project_id}]'
+                         f' Entries enriched: {project_results["enriched"]},'
+                         f' failed: {project_results["failed"]}')
+        self.__api_calls.log_summary()
+        logging.info('==== DONE ==================================================')
+        return results
+
+    def __create_enrichers(self, name_matcher):
+        import google.auth
+
+        # Loading the credentials and opening the DataCatalog channels are paid once.
+        credentials, _ = google.auth.default(scopes=self.__SCOPES)
+        datacatalog_client_pool = DataCatalogClientPool(self.__datacatalog_channels, credentials)
+
+        return {
+            project_id: DatacatalogFilesetEnricher(project_id, self.__stats_backend,
+                                                   self.__max_rows_in_memory, credentials,
+                                                   datacatalog_client_pool,
+                                                   self.__tag_digest_store,
+                                                   self.__segment_wildcards, name_matcher,
+                                                   None, self.__prefetch_pages,
+                                                   self.__page_size, self.__api_calls)
+            for project_id in self.__project_ids
+        }
+
+    @classmethod
+    def __get_fileset_entries(cls, project_enricher):
+        project_id, enricher = project_enricher
+        try:
+            return enricher.get_fileset_entries()
+        except:  # noqa: E722
+            logging.exception(f'Exception retrieving Fileset Entries from project: {project_id}')
+            return []
+
+    @classmethod
+    def __order_by_staleness(cls, enricher, entries, tag_template_name):
+        try:
+            last_enrichments = enricher.get_last_enrichments(entries, tag_template_name)
+        except:  # noqa: E722
+            logging.exception('Exception reading the last enrichments, keeping the search order')
+            return entries
+        return [
+            entry for entry, _ in EnrichmentScheduler.order_by_staleness(entries, last_enrichments)
+        ]
+
+    def __enrich_entries(self, executor, enrichers, entries_by_project, enrich_args,
+                         scheduler=None):
+        pending_entries = {
+            project_id: deque(entries)
+            for project_id, entries in entries_by_project.items()
+        }
+        in_flight = Counter()
+        results = {project_id: Counter(enriched=0, failed=0) for project_id in enrichers}
+        condition = threading.Condition()
+
+        def enrich_entry(project_id, entry):
+            outcome = None
+            # The deadline may pass before the worker picks the Entry up.
+            if scheduler and scheduler.is_expired():
+                logging.info(f'Time budget spent, entry: {entry} from project: {project_id}'
+                             f' is left for the next run')
+            else:
+                try:
+                    enrichers[project_id].enrich_datacatalog_fileset_entry(*entry, *enrich_args)
+                    outcome = 'enriched'
+                except:  # noqa: E722
+                    logging.exception(f'Exception enriching entry: {entry}'
+                                      f' from project: {project_id}')
+                    outcome = 'failed'
+
+            with condition:
+                in_flight[project_id] -= 1
+                if outcome:
+                    results[project_id][outcome] += 1
+                condition.notify()
+
+        with condition:
+            while any(pending_entries.values()):
+                if scheduler and scheduler.is_expired():
+                    logging.info(f'Time budget spent,'
+                                 f' {sum(map(len, pending_entries.values()))} Entries'
+                                 f' are left for the next run')
+                    break
+
+                submitted = False
+                # Projects take turns, and the ones at their concurrency limit are skipped,
+                # so a project with many Entries doesn't starve the others.
+                for project_id, entries in pending_entries.items():
+                    if sum(in_flight.values()) >= self.__workers:
+                        break
+                    if entries and in_flight[project_id] < self.__workers_per_project:
+                        in_flight[project_id] += 1
+                        executor.submit(enrich_entry, project_id, entries.popleft())
+                        submitted = True
+                if not submitted:
+                    condition.wait(scheduler.time_left if scheduler else None)
+
+            while sum(in_flight.values()) > 0:
+                condition.wait()
+
+        return {
+            project_id: dict(project_results)
+            for project_id, project_results in results.items()
+        }
@@ -0,0 +1,178 @@
+import json
+import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from .datacatalog_client_pool import DataCatalogClientPool
+from .datacatalog_fileset_enricher import DatacatalogFilesetEnricher
+from .gcs_blob_name_matcher import BlobNameMatcher
+"""
+ The Fileset Enricher Service keeps a single DatacatalogFilesetEnricher alive,
+ so the GCS and DataCatalog clients and the Tag Template lookups are reused
+ across enrichments. The buckets are cached for a single request or sweep, so
+ buckets created or made accessible since the previous ones are found.
+
+ Entries are enqueued through a local HTTP endpoint:
+
+  `POST /entries` with a JSON body such as
+    {"location": "us-central1", "entry_group_id": "my_group", "entry_id": "my_entry"}
+  `GET /health`: returns the number of pending entries
+
+ Optionally, a full sweep of the manually created Fileset Entries runs every
+ `sweep_interval` seconds.
+"""
+
+
+class DatacatalogFilesetEnricherService:
+    # Default location.
+    __LOCATION = 'us-central1'
+
+    def __init__(self,
+                 project_id,
+                 workers=4,
+                 sweep_interval=None,
+                 tag_fields=None,
+                 bucket_prefix=None,
+                 tag_template_name=None,
+                 stats_backend=None,
+                 max_rows_in_memory=None,
+                 datacatalog_channels=None,
+                 tag_digest_store=None,
+                 segment_wildcards=False,
+                 matching_processes=None,
+                 prefetch_pages=1,
+                 page_size=None):
+
+        # Concurrent workers spread their DataCatalog calls over a pool of channels.
+        datacatalog_client_pool = DataCatalogClientPool(datacatalog_channels) \
+            if datacatalog_channels else None
+        self.__name_matcher = BlobNameMatcher(matching_processes)
+        self.__enricher = DatacatalogFilesetEnricher(project_id, stats_backend,
+                                                     max_rows_in_memory, None,
+                                                     datacatalog_client_pool, tag_digest_store,
+                                                     segment_wildcards,
+                                                     self.__name_matcher, None,
+                                                     prefetch_pages, page_size)
+        self.__executor = ThreadPoolExecutor(max_workers=workers)
+        self.__sweep_interval = sweep_interval
+        self.__tag_fields = tag_fields
+        self.__bucket_prefix = bucket_prefix
+        self.__tag_template_name = tag_template_name
+
+        self.__pending_entries = set()
+        self.__pending_entries_lock = threading.Lock()
+        self.__stopped = threading.Event()
+        self.__http_server = None
+
+    @property
+    def pending_entries(self):
+        with self.__pending_entries_lock:
+            return len(self.__pending_entries)
+
+    def enqueue_entry(self, entry_group_id, entry_id, location=None):
+        # Each request is a new enrichment run, so it doesn't rely on the buckets
+        # looked up before it.
+        self.__enricher.clear_cache()
+        return self.__enqueue_entry(entry_group_id, entry_id, location)
+
+    def sweep(self):
+        logging.info('===> Fileset Entries sweep started')
+        # Bucket listings are refreshed once per sweep.
+        self.__enricher.clear_cache()
+        for location, entry_group_id, entry_id in self.__enricher.get_fileset_entries():
+            self.__enqueue_entry(entry_group_id, entry_id, location)
+
+    def __enqueue_entry(self, entry_group_id, entry_id, location=None):
+        entry_key = (location or self.__LOCATION, entry_group_id, entry_id)
+
+        # The same Entry is never enqueued twice while it's waiting to be processed.
+        with self.__pending_entries_lock:
+            if entry_key in self.__pending_entries:
+                return False
+            self.__pending_entries.add(entry_key)
+
+        return self.__executor.submit(self.__enrich_entry, entry_key)
+
+    def serve(self, host='localhost', port=8080):
+        self.__http_server = HTTPServer((host, port), self.__create_request_handler())
+
+        if self.__sweep_interval:
+            threading.Thread(target=self.__run_scheduler, daemon=True).start()
+
+        logging.info(f'===> Fileset Enricher Service listening on {host}:{port}')
+        try:
+            self.__http_server.serve_forever()
+        finally:
+            self.__http_server.server_close()
+
+    def shutdown(self, wait=True):
+        self.__stopped.set()
+        if self.__http_server:
+            self.__http_server.shutdown()
+        self.__executor.shutdown(wait=wait)
+        self.__name_matcher.close()
+
+    def __run_scheduler(self):
+        while not self.__stopped.is_set():
+            try:
+                self.sweep()
+            except:  # noqa: E722
+                logging.exception('Exception on Fileset Entries sweep')
+            self.__stopped.wait(self.__sweep_interval)
+
+    def __enrich_entry(self, entry_key):
+        location, entry_group_id, entry_id = entry_key
+
+        with self.__pending_entries_lock:
+            self.__pending_entries.discard(entry_key)
+
+        try:
+            self.__enricher.enrich_datacatalog_fileset_entry(location, entry_group_id, entry_id,
+                                                             self.__tag_fields,
+                                                             self.__bucket_prefix,
+                                                             self.__tag_template_name)
+        except:  # noqa: E722
+            logging.exception(f'Exception enriching entry: {entry_key}')
+
+    def __create_request_handler(self):
+        service = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path != '/health':
+                    self.__send_json(404, {'error': 'not found'})
+                    return
+                self.__send_json(200, {'pending_entries': service.pending_entries})
+
+            def do_POST(self):
+                if self.path != '/entries':
+                    self.__send_json(404, {'error': 'not found'})
+                    return
+
+                try:
+                    length = int(self.headers.get('Content-Length', 0))
+                    body = json.loads(self.rfile.read(length) or b'{}')
+                    entry_group_id = body['entry_group_id']
+                    entry_id = body['entry_id']
+                except (ValueError, KeyError, TypeError):
+                    self.__send_json(400, {'error': 'entry_group_id and entry_id are required'})
+                    return
+
+                enqueued = service.enqueue_entry(entry_group_id, entry_id, body.get('location'))
+                self.__send_json(202, {'enqueued': bool(enqueued)})
+
+            def log_message(self, message_format, *args):
+                logging.debug(message_format % args)
+
+            def __send_json(self, status, content):
+                payload = json.dumps(content).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return RequestHandler
@@ -1,9 +1,18 @@
 """Helper to call datacatalog_v1beta1 api methods."""
+import hashlib
 import logging
 import re
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
 
 from google.api_core import exceptions
+from google.api_core import retry
 from google.cloud import datacatalog_v1
+from google.protobuf import message
+
+from .api_call_counter import ApiCallCounter
+from .bounded_executor import BoundedExecutor, ProgressTracker
 
 
 class DataCatalogHelper:
@@ -22,10 +31,38 @@ class DataCatalogHelper:
         '(type=FILESET not name:crawler AND projectId=$project_id)'
     __LOCATION = 'us-central1'
     __TAG_TEMPLATE = 'fileset_enricher_findings'
-
-    def __init__(self, project_id):
-        self.__datacatalog = datacatalog_v1.DataCatalogClient()
+    __CLEAN_UP_WORKERS = 8
+    __READ_TAGS_WORKERS = 8
+    # Quota and availability errors are retried with exponential backoff.
+    __THROTTLE_RETRY = retry.Retry(predicate=retry.if_exception_type(
+        exceptions.ResourceExhausted, exceptions.ServiceUnavailable, exceptions.DeadlineExceeded,
+        exceptions.Aborted),
+                                   initial=1.0,
+                                   maximum=60.0,
+                                   multiplier=2.0,
+                                   deadline=600.0)
+
+    def __init__(self, project_id, client_pool=None, digest_store=None, api_call_counter=None):
+        self.__client = None
+        # A pool may be shared by several helpers, so they reuse its channels.
+        self.__client_pool = client_pool
+        self.__digest_store = digest_store
         self.__project_id = project_id
+        # Tag Templates already verified by this helper, so long-running processes
+        # don't look them up again for every entry.
+        self.__loaded_tag_templates = set()
+        self.__api_calls = api_call_counter or ApiCallCounter()
+
+    @property
+    def __datacatalog(self):
+        if self.__client_pool:
+            return self.__client_pool.get_client()
+
+        # The client is created on first use, which avoids loading credentials
+        # and opening channels for code paths that never call the API.
+        if not self.__client:
+            self.__client = datacatalog_v1.DataCatalogClient()
+        return self.__client
 
     def create_fileset_enricher_tag_template(self, tag_template_name):
         tag_template = datacatalog_v1.types.TagTemplate()
@@ -109,22 +146,27 @@ class DataCatalogHelper:
         project_id, location_id, tag_template_id = \
             self.extract_resources_from_template(tag_template_name)
 
-        return self.__datacatalog.create_tag_template(
+        self.__count_call('create_tag_template', tag_template)
+        created_tag_template = self.__datacatalog.create_tag_template(
             parent=datacatalog_v1.DataCatalogClient.location_path(project_id, location_id),
             tag_template_id=tag_template_id,
             tag_template=tag_template)
+        self.__count_response('create_tag_template', created_tag_template)
+        return created_tag_template
 
     def create_tag_from_stats(self, entry, stats, tag_fields=None, tag_template_name=None):
         logging.info('Load the Tag Template')
 
         resolved_tag_template_name = self.get_tag_template_name(tag_template_name)
 
-        try:
-            self.get_fileset_enricher_tag_template(resolved_tag_template_name)
-        except exceptions.AlreadyExists:
-            logging.warning(f'Tag Template {resolved_tag_template_name} already exists.')
-        except exceptions.PermissionDenied:
-            self.create_fileset_enricher_tag_template(resolved_tag_template_name)
+        if resolved_tag_template_name not in self.__loaded_tag_templates:
+            try:
+                self.get_fileset_enricher_tag_template(resolved_tag_template_name)
+            except exceptions.AlreadyExists:
+                logging.warning(f'Tag Template {resolved_tag_template_name} already exists.')
+            except exceptions.PermissionDenied:
+                self.create_fileset_enricher_tag_template(resolved_tag_template_name)
+            self.__loaded_tag_templates.add(resolved_tag_template_name)
 
         tag = datacatalog_v1.types.Tag()
         tag.template = resolved_tag_template_name
@@ -169,7 +211,22 @@ class DataCatalogHelper:
                     # so we capture KeyError errors.
                     pass
 
-        self.synchronize_entry_tags(entry, [tag])
+        # Tags with the same stats as the last ones written are skipped,
+        # without reading the current Tags.
+        digest = self.__compute_tag_digest(tag)
+        if self.__digest_store and self.__digest_store.is_up_to_date(entry.name, tag.template,
+                                                                     digest):
+            logging.info('Tag is up to date, according to the digest store')
+        else:
+            self.synchronize_entry_tags(entry, [tag])
+            if self.__digest_store:
+                self.__digest_store.save(entry.name, tag.template, digest)
+
+        # A skipped Tag keeps its previous execution_time, so the enrichment is recorded
+        # locally for the scheduler either way.
+        if self.__digest_store:
+            files = tag.fields['files'].double_value if 'files' in tag.fields else None
+            self.__digest_store.save_enrichment(entry.name, tag.template, files)
 
     def get_tag_template_name(self, tag_template_name=None, location=None):
         if tag_template_name:
@@ -184,47 +241,81 @@ class DataCatalogHelper:
                 self.__project_id, resolved_location, DataCatalogHelper.__TAG_TEMPLATE)
         return resolved_tag_template_name
 
-    def delete_entries_and_entry_groups(self):
+    def delete_entries_and_entry_groups(self, workers=None, dry_run=False):
         scope = datacatalog_v1.types.SearchCatalogRequest.Scope()
         scope.include_project_ids.extend([self.__project_id])
 
         query = DataCatalogHelper.__MANUALLY_CREATED_FILESET_ENTRIES_SEARCH_QUERY.replace(
             '$project_id', self.__project_id)
 
-        search_results = [
-            result for result in self.__datacatalog.search_catalog(
-                scope=scope, query=query, order_by='relevance', page_size=1000)
-        ]
+        # Search results are streamed page by page to the workers.
+        self.__count_call('search_catalog')
+        search_results = self.__datacatalog.search_catalog(scope=scope,
+                                                           query=query,
+                                                           order_by='relevance',
+                                                           page_size=1000)
         datacatalog_entry_name_pattern = '(?P<entry_group_name>.+?)/entries/(.+?)'
 
-        entry_group_names = []
-        for result in search_results:
+        entry_group_names = set()
+        entry_group_names_lock = threading.Lock()
+        entries_progress = ProgressTracker('Entries found' if dry_run else 'Entries deleted')
+
+        def delete_entry(entry_name):
             try:
-                if '@' not in result.relative_resource_name:
-                    self.__datacatalog.delete_entry(result.relative_resource_name)
-                    logging.info(f'Entry deleted: {result.relative_resource_name}')
-                    entry_group_name = re.match(
-                        pattern=datacatalog_entry_name_pattern,
-                        string=result.relative_resource_name).group('entry_group_name')
-                    entry_group_names.append(entry_group_name)
+                if not dry_run:
+                    self.__count_call('delete_entry')
+                    self.__datacatalog.delete_entry(entry_name, retry=self.__THROTTLE_RETRY)
+                    logging.info(f'Entry deleted: {entry_name}')
+                entry_group_name = re.match(pattern=datacatalog_entry_name_pattern,
+                                            string=entry_name).group('entry_group_name')
+                with entry_group_names_lock:
+                    entry_group_names.add(entry_group_name)
+                entries_progress.increment()
             except:  # noqa: E722
                 logging.exception('Exception deleting entry')
 
-        # Delete any pre-existing Entry Groups.
-        for entry_group_name in set(entry_group_names):
+        with BoundedExecutor(workers or self.__CLEAN_UP_WORKERS) as executor:
+            for result in search_results:
+                self.__count_response('search_catalog', result)
+                if '@' not in result.relative_resource_name:
+                    executor.submit(delete_entry, result.relative_resource_name)
+        self.__count_response('search_catalog', pages=self.__count_pages(search_results))
+        entries_progress.log_progress()
+
+        # Delete any pre-existing Entry Groups, once all of their Entries were deleted.
+        entry_groups_progress = ProgressTracker(
+            'Entry Groups found' if dry_run else 'Entry Groups deleted')
+
+        def delete_entry_group(entry_group_name):
             try:
-                if '@' not in entry_group_name:
-                    self.__datacatalog.delete_entry_group(entry_group_name)
+                if not dry_run:
+                    self.__count_call('delete_entry_group')
+                    self.__datacatalog.delete_entry_group(entry_group_name,
+                                                          retry=self.__THROTTLE_RETRY)
                     logging.info(f'Entry Group deleted: {entry_group_name}')
+                entry_groups_progress.increment()
             except:  # noqa: E722
                 logging.exception('Exception deleting entry Group')
 
-    def delete_tag_template(self):
+        with BoundedExecutor(workers or self.__CLEAN_UP_WORKERS) as executor:
+            for entry_group_name in entry_group_names:
+                if '@' not in entry_group_name:
+                    executor.submit(delete_entry_group, entry_group_name)
+        entry_groups_progress.log_progress()
+
+        return entries_progress.count, entry_groups_progress.count
+
+    def delete_tag_template(self, dry_run=False):
         name = datacatalog_v1.DataCatalogClient.tag_template_path(self.__project_id,
                                                                   DataCatalogHelper.__LOCATION,
                                                                   DataCatalogHelper.__TAG_TEMPLATE)
+        if dry_run:
+            logging.info(f'Tag Template and its Tags would be deleted: {name}')
+            return
+
         try:
-            self.__datacatalog.delete_tag_template(name, force=True)
+            self.__count_call('delete_tag_template')
+            self.__datacatalog.delete_tag_template(name, force=True, retry=self.__THROTTLE_RETRY)
         except:  # noqa: E722
             logging.exception('Exception deleting Tag Template')
 
@@ -233,6 +324,7 @@ class DataCatalogHelper:
                                                          DataCatalogHelper.__LOCATION,
                                                          entry_group_id, entry_id,
                                                          DataCatalogHelper.__TAG_TEMPLATE)
+        self.__count_call('delete_tag')
         self.__datacatalog.delete_tag(name)
 
     @classmethod
@@ -248,10 +340,50 @@ class DataCatalogHelper:
     def get_entry(self, location, entry_group_id, entry_id):
         name = datacatalog_v1.DataCatalogClient.entry_path(self.__project_id, location,
                                                            entry_group_id, entry_id)
-        return self.__datacatalog.get_entry(name)
+        self.__count_call('get_entry')
+        entry = self.__datacatalog.get_entry(name)
+        self.__count_response('get_entry', entry)
+        return entry
+
+    def get_last_enrichments(self, entries, tag_template_name=None):
+        """
+        Returns the (execution_time, files) of the Tag last written to each
+        (location, entry_group_id, entry_id) Entry, in the same order, or None
+        for the Entries without a Tag. files is None when the Tag doesn't have it.
+        The enrichments recorded by the digest store are used when available,
+        and only the Tags of the other Entries are read.
+        """
+        resolved_tag_template_name = self.get_tag_template_name(tag_template_name)
+        names = [
+            datacatalog_v1.DataCatalogClient.entry_path(self.__project_id, *entry)
+            for entry in entries
+        ]
+        recorded_enrichments = self.__digest_store.get_last_enrichments(
+            names, resolved_tag_template_name) if self.__digest_store else {}
+
+        def get_last_enrichment(name):
+            if name in recorded_enrichments:
+                return recorded_enrichments[name]
+            try:
+                tags = self.__list_tags(name, retry=self.__THROTTLE_RETRY)
+                for tag in tags:
+                    if tag.template == resolved_tag_template_name \
+                            and 'execution_time' in tag.fields:
+                        files = tag.fields['files'].double_value if 'files' in tag.fields \
+                            else None
+                        return tag.fields['execution_time'].timestamp_value.ToDatetime(), files
+            except:  # noqa: E722
+                logging.exception(f'Exception reading the Tags of entry: {name}')
+            return None
+
+        with ThreadPoolExecutor(max_workers=self.__READ_TAGS_WORKERS) as executor:
+            return list(executor.map(get_last_enrichment, names))
 
     def get_fileset_enricher_tag_template(self, tag_template_name):
-        return self.__datacatalog.get_tag_template(tag_template_name)
+        self.__count_call('get_tag_template')
+        tag_template = self.__datacatalog.get_tag_template(tag_template_name)
+        self.__count_response('get_tag_template', tag_template)
+        return tag_template
 
     # Currently we don't have a list method, so we are using search which is not exhaustive,
     # and might not return some entries.
@@ -262,6 +394,7 @@ class DataCatalogHelper:
         query = DataCatalogHelper.__MANUALLY_CREATED_FILESET_ENTRIES_SEARCH_QUERY.replace(
             '$project_id', self.__project_id)
 
+        self.__count_call('search_catalog')
         search_results = self.__datacatalog.search_catalog(scope=scope,
                                                            query=query,
                                                            order_by='relevance',
@@ -269,11 +402,13 @@ class DataCatalogHelper:
 
         fileset_entries = []
         for result in search_results:
+            self.__count_response('search_catalog', result)
             re_match = re.match(pattern=DataCatalogHelper.__ENTRY_NAME_PATTERN,
                                 string=result.relative_resource_name)
             if re_match:
                 location, entry_group_id, entry_id, = re_match.groups()
                 fileset_entries.append((location, entry_group_id, entry_id))
+        self.__count_response('search_catalog', pages=self.__count_pages(search_results))
 
         return fileset_entries
 
@@ -281,7 +416,7 @@ class DataCatalogHelper:
         if not updated_tags or len(updated_tags) == 0:
             return
 
-        current_tags = self.__datacatalog.list_tags(parent=entry.name)
+        current_tags = self.__list_tags(entry.name)
 
         for updated_tag in updated_tags:
             tag_to_create = updated_tag
@@ -290,37 +425,84 @@ class DataCatalogHelper:
                 logging.info(f'Tag loaded: {current_tag.name}')
                 if updated_tag.template == current_tag.template:
                     tag_to_create = None
-                    if not self.__tags_fields_are_equal(updated_tag, current_tag):
+                    changed_field_ids = self.__get_changed_field_ids(updated_tag, current_tag)
+                    if changed_field_ids:
                         updated_tag.name = current_tag.name
                         tag_to_update = updated_tag
 
             if tag_to_create:
+                self.__count_call('create_tag', tag_to_create)
                 tag = self.__datacatalog.create_tag(parent=entry.name, tag=tag_to_create)
+                self.__count_response('create_tag', tag)
                 logging.info(f'Tag created: {tag.name}')
             elif tag_to_update:
-                self.__datacatalog.update_tag(tag=tag_to_update, update_mask=None)
-                logging.info(f'Tag updated: {tag_to_update.name}')
+                self.__update_tag(tag_to_update, changed_field_ids)
             else:
                 logging.info('Tag is up to date')
 
+    def __update_tag(self, tag, changed_field_ids):
+        # The whole Tag is sent, as Data Catalog only accepts masking all of its fields,
+        # which replaces them.
+        self.__count_call('update_tag', tag)
+        self.__datacatalog.update_tag(tag=tag, update_mask=None)
+        logging.info(f'Tag updated: {tag.name}, changed fields: {", ".join(changed_field_ids)}')
+
+    def __list_tags(self, parent, **kwargs):
+        self.__count_call('list_tags')
+        results = self.__datacatalog.list_tags(parent=parent, **kwargs)
+        tags = list(results)
+        self.__count_response('list_tags', *tags, pages=self.__count_pages(results))
+        return tags
+
+    def __count_call(self, method, *request_messages):
+        # Calls are counted before being made, as failed calls are charged as well.
+        self.__api_calls.record(f'datacatalog.{method}', 1, 0,
+                                self.__get_byte_size(request_messages))
+
+    def __count_response(self, method, *response_messages, pages=0):
+        self.__api_calls.record(f'datacatalog.{method}', 0, pages,
+                                self.__get_byte_size(response_messages))
+
+    @classmethod
+    def __get_byte_size(cls, messages):
+        return sum(
+            message_.ByteSize() for message_ in messages if isinstance(message_, message.Message))
+
+    @classmethod
+    def __count_pages(cls, results):
+        # The client iterators keep the number of pages requested.
+        return getattr(results, 'page_number', 1)
+
+    @classmethod
+    def __compute_tag_digest(cls, tag):
+        # The execution time changes on every run, so it's not part of the digest.
+        tag_digest = hashlib.sha256(tag.template.encode())
+        for field_id in sorted(tag.fields):
+            if field_id != 'execution_time':
+                tag_digest.update(field_id.encode())
+                tag_digest.update(tag.fields[field_id].SerializeToString(deterministic=True))
+        return tag_digest.hexdigest()
+
+    @classmethod
+    def __get_changed_field_ids(cls, updated_tag, current_tag):
+        return [
+            field_id for field_id in sorted(updated_tag.fields)
+            if field_id not in current_tag.fields
+            or not cls.__tag_fields_are_equal(updated_tag.fields[field_id],
+                                              current_tag.fields[field_id])
+        ]
+
     @classmethod
-    def __tags_fields_are_equal(cls, tag_1, tag_2):
-        for field_id in tag_1.fields:
-            tag_1_field = tag_1.fields[field_id]
-            tag_2_field = tag_2.fields[field_id]
-
-            values_are_equal = tag_1_field.bool_value == tag_2_field.bool_value
-            values_are_equal = values_are_equal and tag_1_field.double_value == \
-                tag_2_field.double_value
-
-            values_are_equal = values_are_equal and tag_1_field.string_value == \
-                tag_2_field.string_value
-            values_are_equal = values_are_equal and tag_1_field.timestamp_value.seconds == \
-                tag_2_field.timestamp_value.seconds
-            values_are_equal = values_are_equal and tag_1_field.enum_value.display_name == \
-                tag_2_field.enum_value.display_name
-
-            if not values_are_equal:
-                return False
-
-        return True
+    def __tag_fields_are_equal(cls, tag_1_field, tag_2_field):
+        values_are_equal = tag_1_field.bool_value == tag_2_field.bool_value
+        values_are_equal = values_are_equal and tag_1_field.double_value == \
+            tag_2_field.double_value
+
+        values_are_equal = values_are_equal and tag_1_field.string_value == \
+            tag_2_field.string_value
+        values_are_equal = values_are_equal and tag_1_field.timestamp_value.seconds == \
+            tag_2_field.timestamp_value.seconds
+        values_are_equal = values_are_equal and tag_1_field.enum_value.display_name == \
+            tag_2_field.enum_value.display_name
+
+        return values_are_equal
@@ -0,0 +1,92 @@
+import logging
+import time
+from datetime import datetime
+"""
+ The Enrichment Scheduler hands out the Fileset Entries of a run oldest Tag
+ first, so runs that can't enrich every Entry don't always leave the same ones
+ stale. Entries never enriched come first, followed by the Entries whose last
+ Tag has the oldest `execution_time`. With a Tag digest store, the last
+ enrichment it recorded is used instead, as Tags skipped because they didn't
+ change keep their previous `execution_time`.
+
+ With a time budget, no Entry is started once it's spent, and the Entries left
+ go first on the next run, so every Entry is refreshed within a bounded
+ number of runs. An Entry being enriched when the budget runs out is finished.
+
+ With size costs, the files counted by the last Tag of each Entry are used to
+ estimate how long it takes, from the time per file of the Entries already
+ enriched in the run. Entries not expected to finish before the deadline are
+ deferred in favour of smaller ones. The first Entry of a run is never
+ deferred, so deferred Entries are enriched by the next runs.
+"""
+
+
+class EnrichmentScheduler:
+    __NEVER_ENRICHED = datetime.min
+
+    def __init__(self, time_budget=None, size_cost=False):
+        # The budget is spent from the scheduler creation, including the Entries discovery.
+        self.__deadline = time.monotonic() + time_budget if time_budget else None
+        self.__size_cost = size_cost
+        self.__enriched_seconds = 0.0
+        self.__enriched_files = 0
+
+    @property
+    def time_left(self):
+        if self.__deadline is None:
+            return None
+        return max(self.__deadline - time.monotonic(), 0)
+
+    def is_expired(self):
+        return self.__deadline is not None and time.monotonic() >= self.__deadline
+
+    @classmethod
+    def order_by_staleness(cls, entries, last_enrichments):
+        """
+        Returns (entry, files) pairs, oldest last enrichment first. Each last
+        enrichment is an (execution_time, files) pair, or None for Entries
+        never enriched.
+        """
+        scheduled_entries = [(entry, last_enrichment or (cls.__NEVER_ENRICHED, None))
+                             for entry, last_enrichment in zip(entries, last_enrichments)]
+        # Sorting is stable, so Entries enriched at the same time keep their order.
+        scheduled_entries.sort(key=lambda scheduled_entry: scheduled_entry[1][0])
+        return [(entry, files) for entry, (_, files) in scheduled_entries]
+
+    def schedule(self, entries, last_enrichments):
+        """
+        Yields the Entries oldest last enrichment first, while there's time
+        left. Each Entry must be enriched before the next one is requested,
+        so its duration is measured.
+        """
+        scheduled_entries = self.order_by_staleness(entries, last_enrichments)
+        deferred_entries = 0
+        started_entries = 0
+        for position, (entry, files) in enumerate(scheduled_entries):
+            if self.is_expired():
+                logging.info(f'Time budget spent, {len(scheduled_entries) - position} Entries'
+                             f' are left for the next run')
+                break
+
+            if started_entries and self.__exceeds_time_left(files):
+                deferred_entries += 1
+                continue
+
+            started_at = time.monotonic()
+            yield entry
+            started_entries += 1
+            if files is not None:
+                self.__enriched_seconds += time.monotonic() - started_at
+                self.__enriched_files += files
+
+        if deferred_entries:
+            logging.info(f'{deferred_entries} Entries were deferred, as they were not expected'
+                         f' to finish before the deadline')
+
+    def __exceeds_time_left(self, files):
+        if not self.__size_cost or self.__deadline is None or files is None \
+                or not self.__enriched_files:
+            return False
+
+        estimated_seconds = files * self.__enriched_seconds / self.__enriched_files
+        return estimated_seconds > self.time_left
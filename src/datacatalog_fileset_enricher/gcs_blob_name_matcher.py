@@ -0,0 +1,101 @@
+import functools
+import logging
+import os
+import re
+import threading
+
+from collections import deque
+
+
+class BlobNameMatcher:
+    """
+    Matches listed blobs against file regexes. With several processes, batches
+    of blob names are matched on a process pool while the next pages are being
+    listed, so filtering very large listings isn't bound to a single core. On
+    a single core host, the pool would only add overhead, so the names are
+    matched by the main process instead.
+    """
+    __BATCH_SIZE = 5000
+
+    def __init__(self, processes=None):
+        if processes and processes > 1 and (os.cpu_count() or 1) < 2:
+            logging.warning(f'{processes} matching processes requested on a single core,'
+                            f' the blob names are matched by the main process')
+            processes = None
+        self.__processes = processes if processes and processes > 1 else None
+        self.__executor = None
+        self.__lock = threading.Lock()
+
+    @property
+    def processes(self):
+        return self.__processes or 1
+
+    def match_blobs_pages(self, file_regexes, blobs_pages):
+        """
+        Yields a (blobs, matches) pair for each batch of blobs, where matches
+        holds the indexes of the blobs matched by each file regex.
+        """
+        if not self.__processes:
+            for blobs in blobs_pages:
+                yield blobs, match_names(file_regexes, [blob.name for blob in blobs])
+            return
+
+        executor = self.__get_executor()
+        pending_batches = deque()
+        for blobs in self.__iterate_batches(blobs_pages):
+            pending_batches.append(
+                (blobs, executor.submit(match_names, file_regexes, [blob.name for blob in blobs])))
+            # Only a couple of batches per process are matched ahead,
+            # so the listed blobs are not all held in memory.
+            if len(pending_batches) >= self.__processes * 2:
+                blobs, matches = pending_batches.popleft()
+                yield blobs, matches.result()
+
+        while pending_batches:
+            blobs, matches = pending_batches.popleft()
+            yield blobs, matches.result()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        with self.__lock:
+            if self.__executor:
+                self.__executor.shutdown()
+            self.__executor = None
+
+    def __get_executor(self):
+        with self.__lock:
+            # The processes are started on first use.
+            if not self.__executor:
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+
+                # Forking a process holding gRPC and HTTP clients is unsafe,
+                # so the workers are spawned instead.
+                self.__executor = ProcessPoolExecutor(
+                    max_workers=self.__processes, mp_context=multiprocessing.get_context('spawn'))
+            return self.__executor
+
+    @classmethod
+    def __iterate_batches(cls, blobs_pages):
+        for blobs in blobs_pages:
+            for i in range(0, len(blobs), cls.__BATCH_SIZE):
+                yield blobs[i:i + cls.__BATCH_SIZE]
+
+
+def match_names(file_regexes, names):
+    """Returns, for each file regex, the indexes of the names fully matching it."""
+    matches = []
+    for file_regex in file_regexes:
+        match = compile_file_regex(file_regex).match
+        matches.append([index for index, name in enumerate(names) if match(name)])
+    return matches
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_file_regex(file_regex):
+    return re.compile(f'^{file_regex}$')
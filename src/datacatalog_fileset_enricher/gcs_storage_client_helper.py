@@ -1,42 +1,231 @@
+import contextvars
 import logging
+import threading
+import time
 
-from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 
-from google.cloud import storage
 from google.api_core import exceptions
+from google.api_core import retry
+
+from .api_call_counter import ApiCallCounter
+from .bounded_executor import prefetch
 
 
 class StorageClientHelper:
+    # Maximum number of calls accepted by a single GCS JSON API batch request.
+    __BATCH_SIZE = 100
+    # Consecutive transient errors a listing is resumed after, waiting twice as long each time.
+    __LISTING_RETRIES = 5
+    __LISTING_RETRY_INITIAL_DELAY = 2.0
+    __BUCKET_WORKERS = 8
 
-    def __init__(self, project_id):
-        self.__storage_cloud_client = storage.Client(project=project_id)
+    def __init__(self,
+                 project_id,
+                 credentials=None,
+                 prefetch_pages=1,
+                 page_size=None,
+                 api_call_counter=None):
+        self.__client = None
+        self.__client_lock = threading.Lock()
         self.__project_id = project_id
+        self.__credentials = credentials
+        self.__prefetch_pages = prefetch_pages
+        self.__page_size = page_size
+        self.__api_calls = api_call_counter or ApiCallCounter()
+        self.__buckets_by_prefix = {}
+        # Buckets that don't exist, or can't be accessed, are cached as None,
+        # so they are not requested again either.
+        self.__buckets_by_name = {}
 
-    def get_bucket(self, name):
-        try:
-            return self.__storage_cloud_client.get_bucket(name)
-        except (exceptions.Forbidden, exceptions.NotFound):
-            logging.info(f'Bucket: {name} does not exist')
-            return None
+    @property
+    def __storage_cloud_client(self):
+        # The client is created on first use, since importing the storage library
+        # and loading the credentials are expensive. It's shared by every thread,
+        # including the short-lived listing ones, as it tracks batches per thread.
+        with self.__client_lock:
+            if not self.__client:
+                from google.cloud import storage
+                client = storage.Client(project=self.__project_id,
+                                        credentials=self.__credentials)
+                # The client only returns the parsed responses, so their size is taken
+                # from its HTTP session.
+                hooks = getattr(getattr(client, '_http', None), 'hooks', None)
+                if hooks is not None:
+                    hooks['response'].append(self.__api_calls.count_http_response)
+                self.__client = client
+        return self.__client
+
+    def get_buckets(self, names):
+        """
+        Returns a dict mapping each name to its bucket, or to None when it does
+        not exist. The buckets not cached yet are requested concurrently.
+        """
+        # The cache may be cleared concurrently, by a new run, so the one in use
+        # when the call started is kept.
+        buckets_by_name = self.__buckets_by_name
+        missing_names = [name for name in dict.fromkeys(names) if name not in buckets_by_name]
+        if missing_names:
+            with ThreadPoolExecutor(
+                    max_workers=min(self.__BUCKET_WORKERS, len(missing_names))) as executor:
+                # The calls are counted for the caller Entry, if any.
+                contexts = [contextvars.copy_context() for _ in missing_names]
+                buckets_by_name.update(
+                    zip(missing_names,
+                        executor.map(lambda context, name: context.run(self.__get_bucket, name),
+                                     contexts, missing_names)))
+
+        return {name: buckets_by_name[name] for name in names}
+
+    def get_blobs(self, bucket, names):
+        # A single object is a plain metadata GET, which already returns None
+        # when the object does not exist.
+        if len(names) == 1:
+            self.__api_calls.record('storage.get_blob')
+            with self.__api_calls.track('storage.get_blob'):
+                blob = bucket.get_blob(names[0])
+            return [blob] if blob else []
+
+        blobs = [bucket.blob(name) for name in names]
+        for i in range(0, len(blobs), self.__BATCH_SIZE):
+            self.__api_calls.record('storage.batch_get_blobs')
+            try:
+                # The blobs are reloaded through the client of their bucket, which may not
+                # be this helper's one, so the batch is opened on that client.
+                # Its batches are tracked per thread, so concurrent ones don't mix up.
+                with self.__api_calls.track('storage.batch_get_blobs'), \
+                        bucket.client.batch():
+                    for blob in blobs[i:i + self.__BATCH_SIZE]:
+                        blob.reload()
+            except (exceptions.Forbidden, exceptions.NotFound):
+                # The batch raises once every response has been applied, so the
+                # objects that do exist, and can be read, are already loaded.
+                logging.info(f'Some objects were not found, or are not readable,'
+                             f' in bucket: {bucket.name}')
+
+        return [blob for blob in blobs if self.__blob_was_loaded(blob)]
+
+    def clear_cache(self):
+        self.__buckets_by_prefix = {}
+        self.__buckets_by_name = {}
 
     def list_buckets(self, prefix=None):
-        return self.__list_buckets(self.__project_id, prefix)
+        resolved_prefix = prefix or ''
 
-    def list_blobs(self, bucket, prefix=None):
-        results_iterator = self.__storage_cloud_client.list_blobs(bucket, prefix=prefix)
+        # A listing already made with a shorter prefix covers this one,
+        # so it is filtered locally instead of calling the API again.
+        for cached_prefix, buckets in list(self.__buckets_by_prefix.items()):
+            if resolved_prefix.startswith(cached_prefix):
+                return [bucket for bucket in buckets if bucket.name.startswith(resolved_prefix)]
 
+        buckets = self.__list_buckets(self.__project_id, prefix)
+        self.__buckets_by_prefix[resolved_prefix] = buckets
+        # The listed buckets are known to exist, so they are not requested again.
+        self.__buckets_by_name.update((bucket.name, bucket) for bucket in buckets)
+        return buckets
+
+    def list_blobs(self, bucket, prefix=None, match_glob=None):
         results = []
-        for page in results_iterator.pages:
+        for page in self.iterate_blobs_pages(bucket, prefix, match_glob):
             results.extend(page)
 
         return results
 
-    @lru_cache(maxsize=1024)
+    def list_prefixes(self, bucket, prefix=None):
+        """Lists the "directories" right under the given prefix, such as a/b/ for a/."""
+        self.__api_calls.record('storage.list_prefixes')
+        results_iterator = self.__storage_cloud_client.list_blobs(bucket,
+                                                                  prefix=prefix,
+                                                                  delimiter='/')
+        prefixes = []
+        with self.__api_calls.track('storage.list_prefixes'):
+            for page in results_iterator.pages:
+                self.__api_calls.record('storage.list_prefixes', 0, 1)
+                prefixes.extend(page.prefixes)
+
+        return sorted(prefixes)
+
+    def iterate_blobs_pages(self, bucket, prefix=None, match_glob=None):
+        """
+        Yields the blobs page by page, so they don't need to be held in memory at once.
+        When match_glob is provided, only the matching blobs are returned by the API.
+
+        The next prefetch_pages pages are requested in the background while the current
+        one is consumed, so the network latency overlaps with processing the blobs.
+        """
+        blobs_pages = self.__iterate_resumable_blobs_pages(bucket, prefix, match_glob)
+        if self.__prefetch_pages:
+            blobs_pages = prefetch(blobs_pages, self.__prefetch_pages)
+        yield from blobs_pages
+
+    def __iterate_resumable_blobs_pages(self, bucket, prefix, match_glob):
+        """
+        After a transient error, the listing is resumed from the page token of the
+        last page returned, so the pages already consumed are neither listed nor
+        returned again.
+        """
+        page_token = None
+        failed_attempts = 0
+        while True:
+            self.__api_calls.record('storage.list_blobs')
+            results_iterator = self.__storage_cloud_client.list_blobs(bucket,
+                                                                      prefix=prefix,
+                                                                      page_size=self.__page_size,
+                                                                      page_token=page_token)
+            if match_glob:
+                # Not every client version takes a match_glob argument,
+                # so the query parameter is set on the iterator instead.
+                results_iterator.extra_params['matchGlob'] = match_glob
+
+            pages = iter(results_iterator.pages)
+            while True:
+                try:
+                    with self.__api_calls.track('storage.list_blobs'):
+                        blobs = list(next(pages))
+                except StopIteration:
+                    return
+                except Exception as error:
+                    if not retry.if_transient_error(error) \
+                            or failed_attempts >= self.__LISTING_RETRIES:
+                        raise
+                    delay = self.__LISTING_RETRY_INITIAL_DELAY * 2**failed_attempts
+                    failed_attempts += 1
+                    logging.warning(f'Listing of bucket: {getattr(bucket, "name", bucket)}'
+                                    f' failed with: {error}, resuming it in {delay}s'
+                                    f' (attempt {failed_attempts}/{self.__LISTING_RETRIES})')
+                    time.sleep(delay)
+                    break
+
+                self.__api_calls.record('storage.list_blobs', 0, 1)
+                page_token = results_iterator.next_page_token
+                failed_attempts = 0
+                yield blobs
+
+    def __get_bucket(self, name):
+        self.__api_calls.record('storage.get_bucket')
+        try:
+            with self.__api_calls.track('storage.get_bucket'):
+                return self.__storage_cloud_client.get_bucket(name)
+        except (exceptions.Forbidden, exceptions.NotFound):
+            logging.info(f'Bucket: {name} does not exist')
+            return None
+
     def __list_buckets(self, project_id, prefix=None):
+        self.__api_calls.record('storage.list_buckets')
         results_iterator = self.__storage_cloud_client.list_buckets(prefix=prefix,
                                                                     project=project_id)
         results = []
-        for page in results_iterator.pages:
-            results.extend(page)
+        with self.__api_calls.track('storage.list_buckets'):
+            for page in results_iterator.pages:
+                self.__api_calls.record('storage.list_buckets', 0, 1)
+                results.extend(page)
 
         return results
+
+    @classmethod
+    def __blob_was_loaded(cls, blob):
+        try:
+            return blob.generation is not None
+        except KeyError:
+            # Batched calls that failed leave an unresolved future behind.
+            return False
@@ -1,88 +1,243 @@
+import heapq
 import logging
 import re
 
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 
+from .gcs_blob_name_matcher import BlobNameMatcher
 from .gcs_storage_client_helper import StorageClientHelper
+from .gcs_storage_stats_backend import append_dataframes, get_stats_backend
+from .memory_profiler import profile_phase
 
 
 class StorageFilter:
     __FILE_PATTERN_REGEX = r'^gs:[\/][\/]([a-zA-Z-_\d*]+)[\/](.*)$'
+    __SEGMENT_WILDCARD = '[^/]*'
+    __GLOB_LITERAL_REGEX = r'[\w/\-=,@:~ ]'
+    __REGEX_METACHARACTERS = '*[]?()|+{}^$\\'
+    __BLOBS_CHUNK_SIZE = 10000
+    __LISTING_WORKERS = 8
 
-    def __init__(self, project_id):
-        self.__storage_helper = StorageClientHelper(project_id)
+    def __init__(self,
+                 project_id,
+                 stats_backend=None,
+                 max_rows_in_memory=None,
+                 credentials=None,
+                 name_matcher=None,
+                 prefetch_pages=1,
+                 page_size=None,
+                 api_call_counter=None):
+        self.__storage_helper = StorageClientHelper(project_id, credentials, prefetch_pages,
+                                                    page_size, api_call_counter)
+        self.__name_matcher = name_matcher or BlobNameMatcher()
         self.__project_id = project_id
+        self.__stats_backend = get_stats_backend(stats_backend)
+        self.__max_rows_in_memory = max_rows_in_memory
 
-    def create_filtered_data_for_multiple_buckets(self,
-                                                  bucket_pattern,
-                                                  file_regex,
-                                                  bucket_prefix=None):
-        logging.info('===> Get all Buckets from Cloud Storage...')
-        buckets = self.__storage_helper.list_buckets(bucket_prefix)
+    def clear_cache(self):
+        self.__storage_helper.clear_cache()
+
+    def list_buckets_for_bucket_pattern(self, bucket_pattern, bucket_prefix=None):
+        list_prefix = self.merge_bucket_prefixes(self.get_literal_prefix(bucket_pattern),
+                                                 bucket_prefix)
+        if list_prefix is None:
+            logging.warning(f'Bucket pattern: {bucket_pattern} can not match buckets with'
+                            f' prefix: {bucket_prefix}')
+            return []
+
+        logging.info(f'===> Get all Buckets with prefix: {list_prefix} from Cloud Storage...')
+        buckets = self.__storage_helper.list_buckets(list_prefix or None)
         logging.info('==== DONE ==================================================')
         logging.info('')
 
-        dataframe = None
-        filtered_buckets_stats = []
-        filtered_buckets = self.filter_buckets_for_bucket_pattern(buckets, bucket_pattern)
-        for bucket in filtered_buckets:
-            bucket_name = bucket.name
-            logging.info(f'[BUCKET: {bucket_name}')
-            logging.info('Get Files information from Cloud Storage...')
-            blobs = self.filter_blobs_from_bucket(bucket, file_regex)
-            filtered_buckets_stats.append({'bucket_name': bucket_name, 'files': len(blobs)})
+        return self.filter_buckets_for_bucket_pattern(buckets, bucket_pattern)
+
+    def get_buckets(self, bucket_names):
+        return self.__storage_helper.get_buckets(bucket_names)
+
+    def create_filtered_data_for_file_regex_groups(self, bucket, file_regex_groups):
+        """
+        Lists the bucket once for several groups of file regexes, routing each
+        blob to every group with a file regex matching it. A blob matched by
+        overlapping file regexes of the same group is only routed to it once.
+        Returns a (dataframe, files) pair for each group, in the same order.
+        """
+        return self.__create_dataframes_from_bucket(bucket, file_regex_groups)
+
+    def __create_dataframes_from_bucket(self, bucket, file_regex_groups):
+        dataframes = [None] * len(file_regex_groups)
+        files = [0] * len(file_regex_groups)
+        # With a memory ceiling, the blobs are listed page by page and converted in chunks,
+        # so they are never held in memory at once.
+        chunk_size = self.__max_rows_in_memory and min(self.__max_rows_in_memory,
+                                                       self.__BLOBS_CHUNK_SIZE)
+        for index, blobs in self.__route_blobs_chunks_from_bucket(bucket, file_regex_groups,
+                                                                  chunk_size):
             if len(blobs) > 0:
-                aux_dataframe = self.create_dataframe_from_blobs(blobs)
-                if dataframe is not None:
-                    dataframe = dataframe.append(aux_dataframe)
-                else:
-                    dataframe = aux_dataframe
+                files[index] += len(blobs)
+                with profile_phase('dataframe'):
+                    dataframes[index] = append_dataframes(dataframes[index],
+                                                          self.create_dataframe_from_blobs(blobs),
+                                                          self.__max_rows_in_memory)
+        return list(zip(dataframes, files))
 
-        return dataframe, filtered_buckets_stats
+    def __route_blobs_chunks_from_bucket(self, bucket, file_regex_groups, chunk_size=None):
+        """Yields (file regex group index, blobs) chunks."""
+        # Each distinct file regex is matched once, whatever the groups sharing it.
+        regex_indexes = {}
+        for file_regex_group in file_regex_groups:
+            for file_regex in file_regex_group:
+                regex_indexes.setdefault(file_regex, len(regex_indexes))
+        file_regexes = list(regex_indexes)
+        regex_indexes_by_group = [
+            sorted({regex_indexes[file_regex] for file_regex in file_regex_group})
+            for file_regex_group in file_regex_groups
+        ]
 
-    def create_filtered_data_for_single_bucket(self, bucket_name, file_regex):
-        logging.info(f'===> Get the Bucket: {bucket_name} from Cloud Storage...')
-        bucket = self.__storage_helper.get_bucket(bucket_name)
+        # Fully literal object names are fetched directly,
+        # so we don't need to list the whole bucket to find them.
+        if all(self.is_literal_regex(file_regex) for file_regex in file_regexes):
+            blobs = self.__storage_helper.get_blobs(bucket, file_regexes)
+            found_names = {blob.name for blob in blobs}
+            for file_regex in file_regexes:
+                if file_regex not in found_names:
+                    logging.warning(f'File not found for bucket: {bucket},'
+                                    f' with file_pattern: {file_regex}')
+            for index, file_regex_group in enumerate(file_regex_groups):
+                yield index, [blob for blob in blobs if blob.name in file_regex_group]
+            return
 
-        logging.info('==== DONE ==================================================')
-        logging.info('')
-        filtered_buckets_stats = []
-
-        if bucket:
-            logging.info('Get Files information from Cloud Storage...')
-            blobs = self.filter_blobs_from_bucket(bucket, file_regex)
-            filtered_buckets_stats.append({'bucket_name': bucket_name, 'files': len(blobs)})
-            return self.create_dataframe_from_blobs(blobs), filtered_buckets_stats
-        else:
-            filtered_buckets_stats.append({
-                'bucket_name': bucket_name,
-                'files': 0,
-                'bucket_not_found': True
-            })
-            return None, filtered_buckets_stats
-
-    def filter_blobs_from_bucket(self, bucket, file_regex):
-        filtered_blobs = []
-        blobs = self.__storage_helper.list_blobs(bucket)
-        for blob in blobs:
-            file_name = blob.name
-            re_match = re.match(f'^{file_regex}$', file_name)
-            if re_match:
-                filtered_blobs.append(blob)
+        blobs_pages = self.__list_blobs_pages(bucket, file_regexes, chunk_size)
 
-        if len(filtered_blobs) == 0:
-            logging.warning(f'Zero files found for bucket: {bucket},'
-                            f' with file_pattern: {file_regex}')
+        filtered_blobs = [[] for _ in file_regex_groups]
+        files = [0] * len(file_regex_groups)
+        for blobs, matches in self.__name_matcher.match_blobs_pages(file_regexes, blobs_pages):
+            for index, regex_indexes in enumerate(regex_indexes_by_group):
+                for blob_index in self.__merge_blob_indexes(
+                        [matches[regex_index] for regex_index in regex_indexes]):
+                    filtered_blobs[index].append(blobs[blob_index])
+                    if chunk_size and len(filtered_blobs[index]) >= chunk_size:
+                        files[index] += len(filtered_blobs[index])
+                        yield index, filtered_blobs[index]
+                        filtered_blobs[index] = []
 
-        return filtered_blobs
+        for index, file_regex_group in enumerate(file_regex_groups):
+            files[index] += len(filtered_blobs[index])
+            if files[index] == 0:
+                logging.warning(f'Zero files found for bucket: {bucket},'
+                                f' with file_pattern: {", ".join(file_regex_group)}')
+
+            yield index, filtered_blobs[index]
 
     @classmethod
-    def create_dataframe_from_blobs(cls, blobs):
-        dataframe = pd.DataFrame(
-            [[blob.name, blob.public_url, blob.size, blob.time_created, blob.updated]
-             for blob in blobs],
-            columns=['name', 'public_url', 'size', 'time_created', 'time_updated'])
-        return dataframe
+    def __merge_blob_indexes(cls, blob_indexes_lists):
+        """
+        Merges the sorted blob indexes matched by each file regex of a group, so a
+        blob matched by several of them is only taken once. The listed prefixes are
+        disjoint, so a blob is never listed twice, and deduplicating the indexes
+        within each page is enough.
+        """
+        if len(blob_indexes_lists) == 1:
+            return blob_indexes_lists[0]
+
+        merged_indexes = []
+        for blob_index in heapq.merge(*blob_indexes_lists):
+            if not merged_indexes or merged_indexes[-1] != blob_index:
+                merged_indexes.append(blob_index)
+        return merged_indexes
+
+    def __list_blobs_pages(self, bucket, file_regexes, chunk_size=None):
+        prefixes = self.__find_bucket_listing_prefixes(bucket, file_regexes)
+        # Non matching blobs are filtered out by the API when the file regex can be
+        # translated into a glob, so they are neither transferred nor matched here.
+        match_glob = self.convert_regex_to_match_glob(file_regexes[0]) \
+            if len(file_regexes) == 1 else None
+
+        # Pages are matched as they arrive, while the next ones are being fetched,
+        # and they are never all held in memory.
+        if chunk_size or len(prefixes) == 1:
+            return (blobs_page for prefix in prefixes
+                    for blobs_page in self.__storage_helper.iterate_blobs_pages(
+                        bucket, prefix or None, match_glob))
+
+        with ThreadPoolExecutor(max_workers=self.__LISTING_WORKERS) as executor:
+            return list(
+                executor.map(
+                    lambda prefix: self.__storage_helper.list_blobs(bucket, prefix, match_glob),
+                    prefixes))
+
+    def __find_bucket_listing_prefixes(self, bucket, file_regexes):
+        prefixes = sorted({
+            prefix
+            for file_regex in file_regexes
+            for prefix in self.find_listing_prefixes(bucket, file_regex)
+        })
+
+        # Prefixes covered by a shorter one are dropped, so no blob is listed twice.
+        # Once sorted, a prefix comes right before the ones it covers.
+        disjoint_prefixes = []
+        for prefix in prefixes:
+            if not disjoint_prefixes or not prefix.startswith(disjoint_prefixes[-1]):
+                disjoint_prefixes.append(prefix)
+        return disjoint_prefixes
+
+    def find_listing_prefixes(self, bucket, file_regex):
+        """
+        Returns the prefixes to be listed to find the files matching file_regex.
+
+        Directory segments that can't match a slash are expanded level by level,
+        listing the "directories" of each prefix in parallel, so only the
+        matching subtrees are listed.
+        """
+        # Alternatives of the whole regex don't share a prefix, so the bucket is listed whole.
+        if self.__has_top_level_alternative(file_regex):
+            return ['']
+
+        segments = self.__split_directory_segments(file_regex)
+        prefixes = ['']
+        segment_index = 0
+        while segment_index < len(segments) - 1 and len(prefixes) > 0:
+            segment = segments[segment_index]
+            if self.is_literal_regex(segment):
+                prefixes = [f'{prefix}{segment}/' for prefix in prefixes]
+            # A segment that may match a slash, such as a wildcard crossing directories,
+            # can match any subtree, so only the literal prefix is listed from there.
+            elif self.__can_match_slash(segment):
+                break
+            else:
+                prefixes = self.__expand_directory_prefixes(bucket, prefixes, segment)
+            segment_index += 1
+
+        remaining_regex = '/'.join(segments[segment_index:])
+        literal_prefix = self.get_literal_prefix(remaining_regex)
+        return [f'{prefix}{literal_prefix}' for prefix in prefixes]
+
+    def __expand_directory_prefixes(self, bucket, prefixes, segment):
+        segment_regex = re.compile(f'^{segment}/$')
+        with ThreadPoolExecutor(max_workers=self.__LISTING_WORKERS) as executor:
+            directories_by_prefix = list(
+                executor.map(lambda prefix: self.__storage_helper.list_prefixes(bucket, prefix),
+                             prefixes))
+
+        return [
+            directory for prefix, directories in zip(prefixes, directories_by_prefix)
+            for directory in directories if segment_regex.match(directory[len(prefix):])
+        ]
+
+    def create_dataframe_from_blobs(self, blobs):
+        # The raw RFC 3339 timestamps are kept, so the stats backend parses them in bulk
+        # instead of each blob property parsing its own datetime.
+        return self.__stats_backend.create_dataframe(
+            [[blob.name, blob.public_url, blob.size,
+              self.__get_raw_property(blob, 'timeCreated', 'time_created'),
+              self.__get_raw_property(blob, 'updated', 'updated')] for blob in blobs])
+
+    @classmethod
+    def __get_raw_property(cls, blob, property_name, attribute_name):
+        properties = getattr(blob, '_properties', None)
+        if isinstance(properties, dict) and property_name in properties:
+            return properties[property_name]
+        return getattr(blob, attribute_name)
 
     @classmethod
     def filter_buckets_for_bucket_pattern(cls, buckets, bucket_pattern):
@@ -95,11 +250,185 @@ class StorageFilter:
         return filtered_buckets
 
     @classmethod
-    def convert_str_to_usable_regex(cls, plain_str):
+    def get_literal_prefix(cls, regex):
+        """
+        Returns the leading part of regex every matching name starts with. It stops
+        at the first regex metacharacter, or before the character a quantifier
+        applies to, as it may be matched zero times.
+        """
+        if cls.__has_top_level_alternative(regex):
+            return ''
+
+        for position, character in enumerate(regex):
+            if character in '*?{':
+                return regex[:max(position - 1, 0)]
+            if character in cls.__REGEX_METACHARACTERS or regex.startswith('.*', position):
+                return regex[:position]
+        return regex
+
+    @classmethod
+    def __has_top_level_alternative(cls, regex):
+        return any(character == '|'
+                   for _, character in cls.__iterate_top_level_characters(regex))
+
+    @classmethod
+    def __split_directory_segments(cls, regex):
+        # Slashes inside character classes, such as [^/], or groups don't separate directories.
+        segments = []
+        segment_start = 0
+        for position, character in cls.__iterate_top_level_characters(regex):
+            if character == '/':
+                segments.append(regex[segment_start:position])
+                segment_start = position + 1
+        segments.append(regex[segment_start:])
+        return segments
+
+    @classmethod
+    def __iterate_top_level_characters(cls, regex):
+        """Yields the (position, character) pairs outside escapes, character classes and groups."""
+        depth = 0
+        position = 0
+        while position < len(regex):
+            character = regex[position]
+            if character == '\\':
+                position += 1
+            elif character == '[':
+                position = cls.__find_class_end(regex, position) or len(regex)
+            elif character in '()':
+                depth += 1 if character == '(' else -1
+            elif depth == 0:
+                yield position, character
+            position += 1
+
+    @classmethod
+    def __find_class_end(cls, regex, class_start):
+        """Returns the position of the bracket closing a character class, or None."""
+        position = class_start + 1
+        if regex.startswith('^', position):
+            position += 1
+        # A bracket right after the opening one is a member of the class.
+        if regex.startswith(']', position):
+            position += 1
+        while position < len(regex):
+            if regex[position] == '\\':
+                position += 1
+            elif regex[position] == ']':
+                return position
+            position += 1
+        return None
+
+    @classmethod
+    def __can_match_slash(cls, regex):
+        """
+        Tells whether regex may match a slash. Only the constructs known not to match
+        one are accepted, anything else is assumed to.
+        """
+        position = 0
+        while position < len(regex):
+            character = regex[position]
+            if character == '\\':
+                escaped = regex[position + 1:position + 2]
+                if escaped == '/' or (escaped.isalnum() and escaped not in 'dws'):
+                    return True
+                position += 1
+            elif character == '[':
+                class_end = cls.__find_class_end(regex, position)
+                if class_end is None or cls.__class_can_match_slash(regex[position + 1:class_end]):
+                    return True
+                position = class_end
+            elif character in './':
+                return True
+            position += 1
+        return False
+
+    @classmethod
+    def __class_can_match_slash(cls, class_body):
+        negated = class_body.startswith('^')
+        members = class_body[1:] if negated else class_body
+        has_slash = False
+        position = 0
+        while position < len(members):
+            character = members[position]
+            if character == '\\':
+                escaped = members[position + 1:position + 2]
+                # Ranges from escapes and escaped code points, such as \x2f, are not decoded.
+                starts_range = members[position + 2:position + 3] == '-' \
+                    and position + 3 < len(members)
+                if (escaped.isalnum() and escaped not in 'dwsDWS') or starts_range:
+                    return True
+                has_slash = has_slash or escaped in ('/', 'D', 'W', 'S')
+                position += 2
+            elif members[position + 1:position + 2] == '-' and position + 2 < len(members):
+                range_end = members[position + 2]
+                if range_end == '\\':
+                    return True
+                has_slash = has_slash or character <= '/' <= range_end
+                position += 3
+            else:
+                has_slash = has_slash or character == '/'
+                position += 1
+        return has_slash != negated
+
+    @classmethod
+    def merge_bucket_prefixes(cls, pattern_prefix, bucket_prefix):
+        # Both prefixes must hold for a bucket to be considered, so the most specific one
+        # is used. None means no bucket can satisfy both of them.
+        bucket_prefix = bucket_prefix or ''
+        if pattern_prefix.startswith(bucket_prefix):
+            return pattern_prefix
+        if bucket_prefix.startswith(pattern_prefix):
+            return bucket_prefix
+        return None
+
+    @classmethod
+    def convert_regex_to_match_glob(cls, file_regex):
+        """
+        Translates a file regex into a GCS matchGlob matching at least the same blobs,
+        or returns None when it can't be translated or wouldn't filter anything beyond
+        the listing prefix. The listed blobs are still matched against the file regex,
+        so a broader glob only lets a few more blobs through.
+        """
+        glob_parts = []
+        position = 0
+        while position < len(file_regex):
+            if file_regex.startswith(cls.__SEGMENT_WILDCARD, position):
+                glob_parts.append('*')
+                position += len(cls.__SEGMENT_WILDCARD)
+            elif file_regex.startswith('.*', position):
+                glob_parts.append('**')
+                position += 2
+            elif file_regex[position] == '.':
+                # A regex dot also matches /, which only ** does in a glob.
+                glob_parts.append('**')
+                position += 1
+            elif re.match(cls.__GLOB_LITERAL_REGEX, file_regex[position]):
+                glob_parts.append(file_regex[position])
+                position += 1
+            else:
+                return None
+
+        # Any wildcards next to a ** are covered by it.
+        match_glob = re.sub(r'\*{2,}', '**', ''.join(glob_parts))
+        if match_glob.endswith('**') and '*' not in match_glob[:-2]:
+            return None
+        return match_glob
+
+    @classmethod
+    def is_literal_regex(cls, file_regex):
+        # Dots are taken literally, as they are mostly file extensions.
+        return len(file_regex) > 0 and not any(
+            character in cls.__REGEX_METACHARACTERS for character in file_regex)
+
+    @classmethod
+    def convert_str_to_usable_regex(cls, plain_str, segment_wildcards=False):
+        if segment_wildcards:
+            # `**` crosses directories, while `*` matches within a single one.
+            return '.*'.join(
+                segment.replace('*', cls.__SEGMENT_WILDCARD) for segment in plain_str.split('**'))
         return plain_str.replace('*', '.*')
 
     @classmethod
-    def parse_gcs_file_patterns(cls, gcs_file_patterns):
+    def parse_gcs_file_patterns(cls, gcs_file_patterns, segment_wildcards=False):
         parsed_gcs_patterns = []
         for gcs_file_pattern in gcs_file_patterns:
             re_match = re.match(cls.__FILE_PATTERN_REGEX, gcs_file_pattern)
@@ -109,6 +438,6 @@ class StorageFilter:
                     'bucket_name':
                     cls.convert_str_to_usable_regex(bucket_name),
                     'file_regex':
-                    cls.convert_str_to_usable_regex(gcs_file_pattern)
+                    cls.convert_str_to_usable_regex(gcs_file_pattern, segment_wildcards)
                 })
         return parsed_gcs_patterns
@@ -0,0 +1,149 @@
+import contextvars
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .gcs_storage_stats_backend import append_dataframes
+"""
+ The Scan Planner gets the files information of several Fileset Entries at
+ once, so a bucket referenced by many Entries is listed a single time.
+
+ The parsed file patterns of all Entries are first indexed by bucket, mapping
+ each bucket to the (Entry, file_regex) matchers referencing it. Every bucket
+ is then listed once, and each blob is routed to the files information of all
+ Entries whose file_regex matches it. An Entry with overlapping file patterns,
+ such as gs://b/logs/* and gs://b/logs/2024*, gets each blob once.
+
+ The literal buckets of all Entries are resolved concurrently, in the
+ background while the buckets matched by wildcards are listed. Buckets are
+ cached by the storage filter until its cache is cleared, including the ones
+ not found, so a bucket is resolved once however many Entries reference it.
+
+ Buckets are scanned in the order the Entries first reference them, and the
+ files information of each Entry is handed over as soon as the last bucket it
+ references has been scanned. Only the Entries still waiting on a bucket to be
+ scanned are held in memory at once, rather than every Entry of the run.
+"""
+
+
+class StorageScanPlanner:
+
+    def __init__(self, storage_filter, max_rows_in_memory=None):
+        self.__storage_filter = storage_filter
+        self.__max_rows_in_memory = max_rows_in_memory
+
+    def create_filtered_data_for_entries(self, parsed_gcs_patterns_by_entry, bucket_prefix=None):
+        """
+        Returns a (dataframe, filtered_buckets_stats) pair for each list of
+        parsed gcs patterns, in the same order.
+        """
+        filtered_data = [None] * len(parsed_gcs_patterns_by_entry)
+        for entry_index, dataframe, filtered_buckets_stats in \
+                self.iterate_filtered_data_for_entries(parsed_gcs_patterns_by_entry,
+                                                       bucket_prefix):
+            filtered_data[entry_index] = (dataframe, filtered_buckets_stats)
+        return filtered_data
+
+    def iterate_filtered_data_for_entries(self, parsed_gcs_patterns_by_entry, bucket_prefix=None):
+        """
+        Yields an (entry index, dataframe, filtered_buckets_stats) tuple for each
+        list of parsed gcs patterns, once the last bucket it references has been
+        scanned. The yielded files information is no longer referenced by the
+        planner, so it's freed once the caller is done with it.
+        """
+        literal_bucket_names = [
+            parsed_gcs_pattern['bucket_name']
+            for parsed_gcs_patterns in parsed_gcs_patterns_by_entry
+            for parsed_gcs_pattern in parsed_gcs_patterns
+            if '*' not in parsed_gcs_pattern['bucket_name']
+        ]
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            literal_buckets = executor.submit(contextvars.copy_context().run,
+                                              self.__storage_filter.get_buckets,
+                                              literal_bucket_names) \
+                if literal_bucket_names else None
+            matchers_by_bucket, listed_buckets = self.__index_matchers_by_bucket(
+                parsed_gcs_patterns_by_entry, bucket_prefix)
+            if literal_buckets:
+                listed_buckets = {**literal_buckets.result(), **listed_buckets}
+
+        logging.info(f'{len(matchers_by_bucket)} Buckets will be scanned for'
+                     f' {len(parsed_gcs_patterns_by_entry)} Entries...')
+        dataframes = [None] * len(parsed_gcs_patterns_by_entry)
+        filtered_buckets_stats = [[] for _ in parsed_gcs_patterns_by_entry]
+        pending_buckets = [0] * len(parsed_gcs_patterns_by_entry)
+        for matchers in matchers_by_bucket.values():
+            for entry_index in {entry_index for entry_index, _ in matchers}:
+                pending_buckets[entry_index] += 1
+
+        # Entries referencing no bucket, such as the ones without valid file patterns,
+        # are already complete.
+        for entry_index, entry_pending_buckets in enumerate(pending_buckets):
+            if not entry_pending_buckets:
+                yield entry_index, None, filtered_buckets_stats[entry_index]
+
+        for bucket_name, matchers in matchers_by_bucket.items():
+            bucket = listed_buckets.get(bucket_name)
+            # The file regexes of each Entry are grouped, so their matches are merged.
+            file_regex_groups = {}
+            for entry_index, file_regex in matchers:
+                file_regex_groups.setdefault(entry_index, []).append(file_regex)
+            entry_indexes = list(file_regex_groups)
+
+            if bucket:
+                self.__scan_bucket(bucket_name, bucket, file_regex_groups, dataframes,
+                                   filtered_buckets_stats)
+            else:
+                for entry_index in entry_indexes:
+                    filtered_buckets_stats[entry_index].append({
+                        'bucket_name': bucket_name,
+                        'files': 0,
+                        'bucket_not_found': True
+                    })
+
+            for entry_index in entry_indexes:
+                pending_buckets[entry_index] -= 1
+                if not pending_buckets[entry_index]:
+                    dataframe, dataframes[entry_index] = dataframes[entry_index], None
+                    yield entry_index, dataframe, filtered_buckets_stats[entry_index]
+
+    def __scan_bucket(self, bucket_name, bucket, file_regex_groups, dataframes,
+                      filtered_buckets_stats):
+        logging.info(f'[BUCKET: {bucket_name}]')
+        logging.info(f'Get Files information for {len(file_regex_groups)} Entries'
+                     f' from Cloud Storage...')
+        filtered_data = self.__storage_filter.create_filtered_data_for_file_regex_groups(
+            bucket, list(file_regex_groups.values()))
+
+        for entry_index, (dataframe, files) in zip(file_regex_groups, filtered_data):
+            dataframes[entry_index] = append_dataframes(dataframes[entry_index], dataframe,
+                                                        self.__max_rows_in_memory)
+            filtered_buckets_stats[entry_index].append({
+                'bucket_name': bucket_name,
+                'files': files
+            })
+
+    def __index_matchers_by_bucket(self, parsed_gcs_patterns_by_entry, bucket_prefix):
+        matchers_by_bucket = {}
+        # Buckets matched by a wildcard are already retrieved by the listing.
+        listed_buckets = {}
+        for entry_index, parsed_gcs_patterns in enumerate(parsed_gcs_patterns_by_entry):
+            for parsed_gcs_pattern in parsed_gcs_patterns:
+                bucket_name = parsed_gcs_pattern['bucket_name']
+                if '*' in bucket_name:
+                    buckets = self.__storage_filter.list_buckets_for_bucket_pattern(
+                        bucket_name, bucket_prefix)
+                    listed_buckets.update((bucket.name, bucket) for bucket in buckets)
+                    bucket_names = [bucket.name for bucket in buckets]
+                else:
+                    bucket_names = [bucket_name]
+
+                matcher = (entry_index, parsed_gcs_pattern['file_regex'])
+                # Matchers are kept in a dict, so repeated ones are scanned once.
+                for name in bucket_names:
+                    matchers_by_bucket.setdefault(name, {})[matcher] = None
+
+        return {
+            bucket_name: list(matchers)
+            for bucket_name, matchers in matchers_by_bucket.items()
+        }, listed_buckets
@@ -0,0 +1,488 @@
+import logging
+import os
+import sqlite3
+import tempfile
+import weakref
+
+from array import array
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+"""
+ Stats backends hold the files information retrieved from Cloud Storage and
+ compute the raw aggregates used by the GCStorageStatsSummarizer.
+
+ Each backend works on its own data structure, created from rows of:
+   [name, public_url, size, time_created, time_updated]
+
+ Timestamps may be RFC 3339 strings, as returned by the GCS JSON API, or
+ datetimes. They are parsed in bulk and stored as int64 columns of
+ microseconds since the epoch, so min/max and per-day bucketing work on
+ integers.
+
+  `arrow`: Apache Arrow tables, requires the optional pyarrow dependency.
+  `pandas`: pandas DataFrames, requires the optional pandas dependency.
+  `python`: plain Python columns, with no third party dependencies.
+
+ The arrow backend builds a record batch per listing chunk, column by column,
+ and appending chunks only references their batches. Timestamps are parsed
+ and the aggregates computed by Arrow compute kernels, without building any
+ Python object per file.
+
+ When a memory ceiling is set, the files information exceeding it is spilled
+ to a temporary SQLite database, and the aggregates are computed by SQLite
+ with bounded memory.
+
+ All backends produce the same aggregates; values with the same count are
+ ordered by first appearance.
+"""
+
+COLUMNS = ['name', 'public_url', 'size', 'time_created', 'time_updated']
+
+US_PER_SECOND = 1000000
+US_PER_DAY = 86400 * US_PER_SECOND
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_EPOCH_ORDINAL = _EPOCH.toordinal()
+
+
+class BlobsColumns:
+    """Columnar container used by the python stats backend."""
+
+    def __init__(self):
+        self.name = []
+        self.public_url = []
+        self.size = array('q')
+        self.time_created = array('q')
+        self.time_updated = array('q')
+
+    def __len__(self):
+        return len(self.name)
+
+    def extend(self, other):
+        self.name.extend(other.name)
+        self.public_url.extend(other.public_url)
+        self.size.extend(other.size)
+        self.time_created.extend(other.time_created)
+        self.time_updated.extend(other.time_updated)
+
+
+class SpilledBlobs:
+    """Blobs columns stored in a temporary SQLite database instead of memory."""
+
+    def __init__(self):
+        file_descriptor, self.path = tempfile.mkstemp(prefix='fileset_enricher_',
+                                                      suffix='.sqlite')
+        os.close(file_descriptor)
+
+        self.__connection = sqlite3.connect(self.path, check_same_thread=False)
+        # The database is scratch space, so durability is traded for write speed.
+        self.__connection.executescript("""
+            PRAGMA journal_mode = OFF;
+            PRAGMA synchronous = OFF;
+            PRAGMA temp_store = FILE;
+            CREATE TABLE blobs (name TEXT, public_url TEXT, size INTEGER,
+                                time_created INTEGER, time_updated INTEGER,
+                                created_day INTEGER, updated_day INTEGER, file_type TEXT);
+        """)
+        self.__count = 0
+        self.__finalizer = weakref.finalize(self, self.__remove, self.__connection, self.path)
+
+    def __len__(self):
+        return self.__count
+
+    def extend(self, other):
+        self.__connection.executemany(
+            'INSERT INTO blobs VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            ((name, public_url, size, time_created, time_updated, time_created // US_PER_DAY,
+              time_updated // US_PER_DAY, get_file_type(name))
+             for name, public_url, size, time_created, time_updated in iterate_rows(other)))
+        self.__connection.commit()
+        self.__count += len(other)
+
+    def execute(self, sql):
+        return self.__connection.execute(sql)
+
+    def close(self):
+        self.__finalizer()
+
+    @staticmethod
+    def __remove(connection, path):
+        connection.close()
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class PandasStatsBackend:
+    name = 'pandas'
+
+    @classmethod
+    def create_dataframe(cls, rows):
+        import pandas as pd
+
+        # Building the DataFrame column by column avoids inferring types row by row.
+        dataframe = pd.DataFrame(
+            {column: [row[i] for row in rows] for i, column in enumerate(COLUMNS)},
+            columns=COLUMNS)
+        for column in ['time_created', 'time_updated']:
+            dataframe[column] = cls.__parse_timestamps(dataframe[column])
+        return dataframe
+
+    @classmethod
+    def append(cls, dataframe, other_dataframe):
+        import pandas as pd
+
+        return pd.concat([dataframe, other_dataframe])
+
+    @classmethod
+    def summarize(cls, dataframe):
+        size = dataframe['size']
+        time_created = cls.__parse_timestamps(dataframe['time_created'])
+        time_updated = cls.__parse_timestamps(dataframe['time_updated'])
+        return {
+            'count': len(dataframe),
+            'min_size': size.min(),
+            'max_size': size.max(),
+            'avg_size': size.mean(),
+            'total_size': size.sum(),
+            'min_created': cls.__to_timestamp(time_created.min()),
+            'max_created': cls.__to_timestamp(time_created.max()),
+            'min_updated': cls.__to_timestamp(time_updated.min()),
+            'max_updated': cls.__to_timestamp(time_updated.max()),
+            'created_files_by_day': cls.__count_days(time_created),
+            'updated_files_by_day': cls.__count_days(time_updated),
+            'files_by_type': cls.__count_values(dataframe['name'].apply(get_file_type))
+        }
+
+    @classmethod
+    def __parse_timestamps(cls, series):
+        import pandas as pd
+
+        if len(series) == 0 or pd.api.types.is_integer_dtype(series):
+            return series.astype('int64')
+        # to_datetime parses ISO 8601 strings with a vectorized fast path.
+        return pd.Series(pd.to_datetime(series, utc=True).values.astype('int64') // 1000,
+                         index=series.index)
+
+    @classmethod
+    def __to_timestamp(cls, epoch_us):
+        import pandas as pd
+
+        return pd.Timestamp(int(epoch_us), unit='us', tz='UTC')
+
+    @classmethod
+    def __count_days(cls, series):
+        return [(epoch_day_to_str(day), count)
+                for day, count in cls.__count_values(series // US_PER_DAY)]
+
+    @classmethod
+    def __count_values(cls, series):
+        # A stable sort over the unsorted counts keeps the first appearance order
+        # for values with the same count.
+        value_counts = series.value_counts(sort=False)
+        value_counts = value_counts.sort_values(ascending=False, kind='mergesort')
+        return list(value_counts.items())
+
+
+class ArrowStatsBackend:
+    name = 'arrow'
+
+    @classmethod
+    def create_dataframe(cls, rows):
+        import pyarrow as pa
+
+        batch = pa.RecordBatch.from_arrays([
+            pa.array([row[0] for row in rows], pa.string()),
+            pa.array([row[1] for row in rows], pa.string()),
+            pa.array([row[2] for row in rows], pa.int64()),
+            cls.__parse_timestamps([row[3] for row in rows]),
+            cls.__parse_timestamps([row[4] for row in rows])
+        ], names=COLUMNS)
+        return pa.Table.from_batches([batch])
+
+    @classmethod
+    def append(cls, table, other_table):
+        import pyarrow as pa
+
+        # The batches of both tables are referenced by the result, not copied.
+        return pa.concat_tables([table, other_table])
+
+    @classmethod
+    def summarize(cls, table):
+        import pyarrow.compute as pc
+
+        size = table['size']
+        size_min_max = pc.min_max(size)
+        total_size = pc.sum(size).as_py()
+        created_min_max = pc.min_max(table['time_created'])
+        updated_min_max = pc.min_max(table['time_updated'])
+        file_types = pc.fill_null(
+            pc.struct_field(pc.extract_regex(table['name'], r'\.(?P<file_type>[^.]*)$'), [0]),
+            'unknown_file_type')
+        return {
+            'count': table.num_rows,
+            'min_size': size_min_max['min'].as_py(),
+            'max_size': size_min_max['max'].as_py(),
+            'avg_size': total_size / table.num_rows,
+            'total_size': total_size,
+            'min_created': epoch_us_to_datetime(created_min_max['min'].as_py()),
+            'max_created': epoch_us_to_datetime(created_min_max['max'].as_py()),
+            'min_updated': epoch_us_to_datetime(updated_min_max['min'].as_py()),
+            'max_updated': epoch_us_to_datetime(updated_min_max['max'].as_py()),
+            'created_files_by_day': cls.__count_days(table['time_created']),
+            'updated_files_by_day': cls.__count_days(table['time_updated']),
+            'files_by_type': cls.__count_values(file_types)
+        }
+
+    @classmethod
+    def __parse_timestamps(cls, timestamps):
+        import pyarrow as pa
+
+        try:
+            # The cast parses the RFC 3339 strings, including their offsets, in bulk.
+            return pa.array(timestamps, pa.string()).cast(pa.timestamp('us', tz='UTC')).cast(
+                pa.int64())
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # Datetimes, such as the ones of blobs loaded by the client, are converted in Python.
+            return pa.array(parse_timestamps_to_epoch_us(timestamps), pa.int64())
+
+    @classmethod
+    def __count_days(cls, epoch_us_column):
+        import pyarrow.compute as pc
+
+        return [(epoch_day_to_str(day), count)
+                for day, count in cls.__count_values(pc.divide(epoch_us_column, US_PER_DAY))]
+
+    @classmethod
+    def __count_values(cls, column):
+        import pyarrow.compute as pc
+
+        # Values are counted in first appearance order, and the stable sort keeps it
+        # for values with the same count.
+        value_counts = pc.value_counts(column)
+        counts = zip(value_counts.field('values').to_pylist(),
+                     value_counts.field('counts').to_pylist())
+        return sorted(counts, key=lambda value_count: -value_count[1])
+
+
+class PythonStatsBackend:
+    name = 'python'
+
+    @classmethod
+    def create_dataframe(cls, rows):
+        columns = BlobsColumns()
+        columns.name = [row[0] for row in rows]
+        columns.public_url = [row[1] for row in rows]
+        columns.size = array('q', [row[2] for row in rows])
+        columns.time_created = parse_timestamps_to_epoch_us([row[3] for row in rows])
+        columns.time_updated = parse_timestamps_to_epoch_us([row[4] for row in rows])
+        return columns
+
+    @classmethod
+    def append(cls, columns, other_columns):
+        columns.extend(other_columns)
+        return columns
+
+    @classmethod
+    def summarize(cls, columns):
+        size = columns.size
+        total_size = sum(size)
+        return {
+            'count': len(columns),
+            'min_size': min(size),
+            'max_size': max(size),
+            'avg_size': total_size / len(size),
+            'total_size': total_size,
+            'min_created': epoch_us_to_datetime(min(columns.time_created)),
+            'max_created': epoch_us_to_datetime(max(columns.time_created)),
+            'min_updated': epoch_us_to_datetime(min(columns.time_updated)),
+            'max_updated': epoch_us_to_datetime(max(columns.time_updated)),
+            'created_files_by_day': cls.__count_days(columns.time_created),
+            'updated_files_by_day': cls.__count_days(columns.time_updated),
+            'files_by_type': cls.__count_values(map(get_file_type, columns.name))
+        }
+
+    @classmethod
+    def __count_days(cls, epoch_us_column):
+        return [(epoch_day_to_str(day), count) for day, count in cls.__count_values(
+            epoch_us // US_PER_DAY for epoch_us in epoch_us_column)]
+
+    @classmethod
+    def __count_values(cls, values):
+        # most_common keeps the first appearance order for values with the same count.
+        return Counter(values).most_common()
+
+
+class SQLiteStatsBackend:
+    name = 'sqlite'
+
+    @classmethod
+    def create_dataframe(cls, rows):
+        return spill_dataframe(PythonStatsBackend.create_dataframe(rows))
+
+    @classmethod
+    def append(cls, spilled_blobs, other_dataframe):
+        spilled_blobs.extend(other_dataframe)
+        if isinstance(other_dataframe, SpilledBlobs):
+            other_dataframe.close()
+        return spilled_blobs
+
+    @classmethod
+    def summarize(cls, spilled_blobs):
+        count, min_size, max_size, total_size, min_created, max_created, min_updated, \
+            max_updated = spilled_blobs.execute(
+                'SELECT COUNT(*), MIN(size), MAX(size), SUM(size), MIN(time_created),'
+                ' MAX(time_created), MIN(time_updated), MAX(time_updated) FROM blobs').fetchone()
+        return {
+            'count': count,
+            'min_size': min_size,
+            'max_size': max_size,
+            'avg_size': total_size / count,
+            'total_size': total_size,
+            'min_created': epoch_us_to_datetime(min_created),
+            'max_created': epoch_us_to_datetime(max_created),
+            'min_updated': epoch_us_to_datetime(min_updated),
+            'max_updated': epoch_us_to_datetime(max_updated),
+            'created_files_by_day': cls.__count_days(spilled_blobs, 'created_day'),
+            'updated_files_by_day': cls.__count_days(spilled_blobs, 'updated_day'),
+            'files_by_type': cls.__count_values(spilled_blobs, 'file_type')
+        }
+
+    @classmethod
+    def __count_days(cls, spilled_blobs, column):
+        return [(epoch_day_to_str(day), count)
+                for day, count in cls.__count_values(spilled_blobs, column)]
+
+    @classmethod
+    def __count_values(cls, spilled_blobs, column):
+        # Ordering by the first rowid keeps the first appearance order
+        # for values with the same count.
+        return [(value, count) for value, count, _ in spilled_blobs.execute(
+            f'SELECT {column}, COUNT(*) AS value_count, MIN(rowid) AS first_rowid FROM blobs'
+            f' GROUP BY {column} ORDER BY value_count DESC, first_rowid')]
+
+
+STATS_BACKENDS = {
+    backend.name: backend
+    for backend in [ArrowStatsBackend, PandasStatsBackend, PythonStatsBackend]
+}
+
+
+def parse_timestamps_to_epoch_us(timestamps):
+    """Parses RFC 3339 strings or datetimes into an int64 array of epoch microseconds."""
+    epoch_us_column = array('q')
+    epoch_days_by_date = {}
+    for timestamp in timestamps:
+        if isinstance(timestamp, str) and len(timestamp) >= 20 and timestamp[-1] == 'Z':
+            # Fast path for the UTC timestamps returned by the GCS JSON API,
+            # such as 2020-01-01T10:30:15.123Z. The date part repeats a lot across
+            # objects, so its conversion is cached.
+            date_part = timestamp[:10]
+            epoch_days = epoch_days_by_date.get(date_part)
+            if epoch_days is None:
+                epoch_days = date(int(date_part[:4]), int(date_part[5:7]),
+                                  int(date_part[8:10])).toordinal() - _EPOCH_ORDINAL
+                epoch_days_by_date[date_part] = epoch_days
+
+            epoch_us = (epoch_days * 86400 + int(timestamp[11:13]) * 3600 +
+                        int(timestamp[14:16]) * 60 + int(timestamp[17:19])) * US_PER_SECOND
+            if timestamp[19] == '.':
+                epoch_us += int(timestamp[20:-1].ljust(6, '0')[:6])
+            epoch_us_column.append(epoch_us)
+        else:
+            epoch_us_column.append(datetime_to_epoch_us(timestamp))
+    return epoch_us_column
+
+
+def datetime_to_epoch_us(timestamp):
+    if isinstance(timestamp, str):
+        timestamp = datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%S%z') \
+            if '.' not in timestamp else datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%S.%f%z')
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    delta = timestamp - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * US_PER_SECOND + delta.microseconds
+
+
+def epoch_us_to_datetime(epoch_us):
+    return _EPOCH + timedelta(microseconds=epoch_us)
+
+
+def epoch_day_to_str(epoch_day):
+    return date.fromordinal(_EPOCH_ORDINAL + int(epoch_day)).isoformat()
+
+
+def get_file_type(file_name):
+    file_type_at = file_name.rfind('.')
+    if file_type_at != -1:
+        return file_name[file_type_at + 1:]
+    else:
+        return 'unknown_file_type'
+
+
+def get_stats_backend(name=None):
+    """Returns the backend with the given name, by default pandas when it's installed."""
+    if name:
+        return STATS_BACKENDS[name]
+
+    try:
+        import pandas  # noqa: F401
+        return PandasStatsBackend
+    except ImportError:
+        return PythonStatsBackend
+
+
+def get_stats_backend_for(dataframe):
+    if isinstance(dataframe, BlobsColumns):
+        return PythonStatsBackend
+    if isinstance(dataframe, SpilledBlobs):
+        return SQLiteStatsBackend
+    if is_arrow_table(dataframe):
+        return ArrowStatsBackend
+    return PandasStatsBackend
+
+
+def is_arrow_table(dataframe):
+    # Checked by module, so pyarrow is not imported for the other backends.
+    return type(dataframe).__module__.startswith('pyarrow')
+
+
+def iterate_rows(dataframe):
+    """Iterates the [name, public_url, size, time_created, time_updated] rows of any backend."""
+    if isinstance(dataframe, SpilledBlobs):
+        return dataframe.execute(f'SELECT {", ".join(COLUMNS)} FROM blobs ORDER BY rowid')
+    if isinstance(dataframe, BlobsColumns):
+        return zip(*[getattr(dataframe, column) for column in COLUMNS])
+    if is_arrow_table(dataframe):
+        return zip(*[dataframe[column].to_pylist() for column in COLUMNS])
+    return zip(*[dataframe[column].tolist() for column in COLUMNS])
+
+
+def spill_dataframe(dataframe):
+    spilled_blobs = SpilledBlobs()
+    spilled_blobs.extend(dataframe)
+    return spilled_blobs
+
+
+def append_dataframes(dataframe, other_dataframe, max_rows_in_memory=None):
+    """
+    Appends other_dataframe to dataframe, any of them may be None.
+    Once the result holds more than max_rows_in_memory rows, it's spilled to disk.
+    """
+    if dataframe is None:
+        dataframe = other_dataframe
+    elif other_dataframe is not None:
+        if isinstance(other_dataframe, SpilledBlobs) and \
+                not isinstance(dataframe, SpilledBlobs):
+            dataframe = spill_dataframe(dataframe)
+        dataframe = get_stats_backend_for(dataframe).append(dataframe, other_dataframe)
+
+    if max_rows_in_memory and dataframe is not None and \
+            not isinstance(dataframe, SpilledBlobs) and len(dataframe) > max_rows_in_memory:
+        logging.info(f'Spilling {len(dataframe)} files information to disk...')
+        dataframe = spill_dataframe(dataframe)
+    return dataframe
+
+
+def release_dataframe(dataframe):
+    if isinstance(dataframe, SpilledBlobs):
+        dataframe.close()
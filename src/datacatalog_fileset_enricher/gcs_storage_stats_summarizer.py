@@ -1,3 +1,6 @@
+from .gcs_storage_stats_backend import get_stats_backend_for
+
+
 class GCStorageStatsSummarizer:
 
     @classmethod
@@ -6,25 +9,24 @@ class GCStorageStatsSummarizer:
 
         buckets_found, files_by_bucket = cls.__process_bucket_stats(filtered_buckets_stats)
 
-        if dataframe is not None:
-            size = dataframe['size']
-            time_created = dataframe['time_created']
-            time_updated = dataframe['time_updated']
+        # If we don't have files, then we don't have stats about the files
+        if dataframe is not None and len(dataframe) > 0:
+            files_stats = get_stats_backend_for(dataframe).summarize(dataframe)
             stats = {
-                'count': len(dataframe),
-                'min_size': cls.__convert_to_mb(size.min()),
-                'max_size': cls.__convert_to_mb(size.max()),
-                'avg_size': cls.__convert_to_mb(size.mean()),
-                'total_size': cls.__convert_to_mb(size.sum()),
-                'min_created': time_created.min(),
-                'max_created': time_created.max(),
-                'min_updated': time_updated.min(),
-                'max_updated': time_updated.max(),
-                'created_files_by_day': cls.__get_daily_stats(time_created, 'time_created'),
-                'updated_files_by_day': cls.__get_daily_stats(time_updated, 'time_updated'),
+                'count': files_stats['count'],
+                'min_size': cls.__convert_to_mb(files_stats['min_size']),
+                'max_size': cls.__convert_to_mb(files_stats['max_size']),
+                'avg_size': cls.__convert_to_mb(files_stats['avg_size']),
+                'total_size': cls.__convert_to_mb(files_stats['total_size']),
+                'min_created': files_stats['min_created'],
+                'max_created': files_stats['max_created'],
+                'min_updated': files_stats['min_updated'],
+                'max_updated': files_stats['max_updated'],
+                'created_files_by_day': cls.__format_counts(files_stats['created_files_by_day']),
+                'updated_files_by_day': cls.__format_counts(files_stats['updated_files_by_day']),
                 'prefix': cls.__get_prefix(file_patterns),
                 'files_by_bucket': files_by_bucket,
-                'files_by_type': cls.__get_files_by_type(dataframe),
+                'files_by_type': cls.__format_counts(files_stats['files_by_type']),
                 'buckets_found': buckets_found,
                 'execution_time': execution_time,
                 'bucket_prefix': bucket_prefix
@@ -46,20 +48,10 @@ class GCStorageStatsSummarizer:
         return float(f'{(size_bytes / 1000 / 1000):.{round_cases}f}')
 
     @classmethod
-    def __get_daily_stats(cls, series, timestamp_column):
-        time_created_same_day = series.apply(lambda timestamp: timestamp._date_repr).to_frame()
+    def __format_counts(cls, value_counts):
         value = ''
-        for day, count in time_created_same_day[timestamp_column].value_counts().iteritems():
-            value += f'{day} [count: {count}], '
-        return value[:-2]
-
-    @classmethod
-    def __get_files_by_type(cls, dataframe):
-        series = dataframe['name']
-        files_types = series.apply(cls.__extract_file_type).to_frame()
-        value = ''
-        for file_type, count in files_types['name'].value_counts().iteritems():
-            value += f'{file_type} [count: {count}], '
+        for value_key, count in value_counts:
+            value += f'{value_key} [count: {count}], '
         return value[:-2]
 
     @classmethod
@@ -69,14 +61,6 @@ class GCStorageStatsSummarizer:
             value += f'{file_pattern}, '
         return value[:-2]
 
-    @classmethod
-    def __extract_file_type(cls, file_name):
-        file_type_at = file_name.rfind('.')
-        if file_type_at != -1:
-            return file_name[file_type_at + 1:]
-        else:
-            return 'unknown_file_type'
-
     @classmethod
     def __process_bucket_stats(cls, filtered_buckets_stats):
         processed_bucket_stats_dict = {}
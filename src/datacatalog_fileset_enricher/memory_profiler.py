@@ -0,0 +1,136 @@
+import contextlib
+import contextvars
+import gc
+import threading
+import tracemalloc
+
+_current_profile = contextvars.ContextVar('memory_profile', default=None)
+# tracemalloc.reset_peak is only available from Python 3.9.
+_can_reset_peak = hasattr(tracemalloc, 'reset_peak')
+
+
+def profile_phase(phase_name):
+    """Measures a phase of the Entry profiled in the current context, if any."""
+    memory_profile = _current_profile.get()
+    return memory_profile.phase(phase_name) if memory_profile else contextlib.nullcontext()
+
+
+class EntryMemoryProfile:
+    """
+    Peak memory allocated by each phase of an Entry enrichment, on top of the
+    memory allocated when the phase started. Phases are only measured while
+    tracemalloc is tracing.
+
+    Phases may be nested, such as building the files information while listing
+    them, and run several times, keeping their highest peak.
+
+    Before Python 3.9 the traced peak can't be reset, so it's only attributed to
+    the phases in progress when it grew since the last phase started or ended.
+    Otherwise the memory in use at that point is used, a lower bound.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.peaks = {}
+        self.retained = {}
+        self.matched_objects = 0
+        # Peaks reached by the phases in progress, as the traced peak is reset by nested ones.
+        self.__open_peaks = []
+        self.__last_peak = 0
+
+    @property
+    def peak(self):
+        return max(self.peaks.values(), default=0)
+
+    @contextlib.contextmanager
+    def phase(self, phase_name):
+        if not tracemalloc.is_tracing():
+            yield
+            return
+
+        self.__record_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        self.__open_peaks.append(baseline)
+        try:
+            yield
+        finally:
+            # The listed blobs are only freed by the garbage collector, as they are referenced
+            # by cycles, so it's run for the retained memory to only count live objects.
+            gc.collect()
+            self.__record_peak()
+            peak = self.__open_peaks.pop()
+            current = tracemalloc.get_traced_memory()[0]
+            self.peaks[phase_name] = max(self.peaks.get(phase_name, 0), peak - baseline)
+            # Memory still allocated by the phase when it ends, such as the files information.
+            self.retained[phase_name] = max(current - baseline, 0)
+
+    def __record_peak(self):
+        current, peak = tracemalloc.get_traced_memory()
+        if _can_reset_peak:
+            tracemalloc.reset_peak()
+        elif peak > self.__last_peak:
+            self.__last_peak = peak
+        else:
+            peak = current
+        self.__open_peaks = [max(open_peak, peak) for open_peak in self.__open_peaks]
+
+
+class MemoryProfiler:
+    """
+    Traces the memory allocated while enriching each Entry, so the Entries
+    driving the peak memory usage can be found. Allocations are traced process
+    wide, so the Entries must be enriched one at a time.
+    """
+
+    def __init__(self):
+        self.__profiles = []
+        self.__lock = threading.Lock()
+
+    @property
+    def profiles(self):
+        return list(self.__profiles)
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def stop(self):
+        tracemalloc.stop()
+
+    @contextlib.contextmanager
+    def profile(self, name):
+        entry_profile = EntryMemoryProfile(name)
+        if tracemalloc.is_tracing() and not _can_reset_peak:
+            # The traced peak is restarted from each Entry instead.
+            tracemalloc.clear_traces()
+        # Phases measured deeper in the call stack, such as building the files
+        # information, are attributed to this Entry.
+        token = _current_profile.set(entry_profile)
+        try:
+            yield entry_profile
+        finally:
+            _current_profile.reset(token)
+            with self.__lock:
+                self.__profiles.append(entry_profile)
+
+    def write_report(self, report_file, top=None):
+        """Writes the profiled Entries ranked by their peak memory, heaviest first."""
+        profiles = sorted(self.__profiles, key=lambda profile: profile.peak, reverse=True)
+        report_file.write(f'{"Peak MB":>10} {"Listing MB":>10} {"DataFrame MB":>12}'
+                          f' {"Files MB":>10} {"Stats MB":>10} {"Tag MB":>10} {"Objects":>10}'
+                          f' {"MB/M objects":>12}  Entry\n')
+        for profile in profiles[:top]:
+            peak_per_million = self.__to_mb(profile.peak) * 1e6 / profile.matched_objects \
+                if profile.matched_objects else 0
+            report_file.write(
+                f'{self.__to_mb(profile.peak):10.1f}'
+                f' {self.__to_mb(profile.peaks.get("listing", 0)):10.1f}'
+                f' {self.__to_mb(profile.peaks.get("dataframe", 0)):12.1f}'
+                f' {self.__to_mb(profile.retained.get("listing", 0)):10.1f}'
+                f' {self.__to_mb(profile.peaks.get("stats", 0)):10.1f}'
+                f' {self.__to_mb(profile.peaks.get("tag", 0)):10.1f}'
+                f' {profile.matched_objects:10d} {peak_per_million:12.1f}  {profile.name}\n')
+
+    @classmethod
+    def __to_mb(cls, size):
+        return size / 2**20
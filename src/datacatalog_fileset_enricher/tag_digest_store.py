@@ -0,0 +1,79 @@
+import sqlite3
+import threading
+import time
+
+from datetime import datetime
+
+
+class TagDigestStore:
+    """
+    Local store with the digest of the last Tag written to each Entry, so Tags
+    whose stats didn't change since then are neither read nor written again.
+    A digest is trusted for max_staleness seconds at most, when provided.
+
+    The last enrichment of each Entry is also recorded, whether its Tag was
+    written or skipped, so the Entries with up to date Tags aren't scheduled as
+    the stalest ones, and their Tags don't need to be read to schedule them.
+    """
+
+    def __init__(self, path, max_staleness=None):
+        self.__max_staleness = max_staleness
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(path, check_same_thread=False)
+        self.__connection.execute('CREATE TABLE IF NOT EXISTS tag_digests ('
+                                  ' entry_name TEXT, template TEXT, digest TEXT, written_at REAL,'
+                                  ' PRIMARY KEY (entry_name, template))')
+        self.__connection.execute('CREATE TABLE IF NOT EXISTS last_enrichments ('
+                                  ' entry_name TEXT, template TEXT, enriched_at REAL, files REAL,'
+                                  ' PRIMARY KEY (entry_name, template))')
+        self.__connection.commit()
+
+    def is_up_to_date(self, entry_name, template, digest):
+        with self.__lock:
+            row = self.__connection.execute(
+                'SELECT digest, written_at FROM tag_digests'
+                ' WHERE entry_name = ? AND template = ?', (entry_name, template)).fetchone()
+
+        if not row or row[0] != digest:
+            return False
+        return not self.__max_staleness or time.time() - row[1] < self.__max_staleness
+
+    def save(self, entry_name, template, digest):
+        with self.__lock:
+            self.__connection.execute('INSERT OR REPLACE INTO tag_digests VALUES (?, ?, ?, ?)',
+                                      (entry_name, template, digest, time.time()))
+            self.__connection.commit()
+
+    def save_enrichment(self, entry_name, template, files):
+        with self.__lock:
+            self.__connection.execute(
+                'INSERT OR REPLACE INTO last_enrichments VALUES (?, ?, ?, ?)',
+                (entry_name, template, time.time(), files))
+            self.__connection.commit()
+
+    def get_last_enrichments(self, entry_names, template):
+        """
+        Returns a dict mapping the recorded Entries to their last enrichment, an
+        (enriched_at, files) pair with enriched_at as a naive UTC datetime, as
+        the execution_time of Tags is read.
+        """
+        with self.__lock:
+            rows = self.__connection.execute(
+                'SELECT entry_name, enriched_at, files FROM last_enrichments'
+                ' WHERE template = ?', (template, )).fetchall()
+
+        entry_names = set(entry_names)
+        return {
+            entry_name: (datetime.utcfromtimestamp(enriched_at), files)
+            for entry_name, enriched_at, files in rows if entry_name in entry_names
+        }
+
+    def clear(self):
+        with self.__lock:
+            self.__connection.execute('DELETE FROM tag_digests')
+            self.__connection.execute('DELETE FROM last_enrichments')
+            self.__connection.commit()
+
+    def close(self):
+        with self.__lock:
+            self.__connection.close()
@@ -0,0 +1,109 @@
+import io
+import threading
+
+from unittest import TestCase
+
+from datacatalog_fileset_enricher.api_call_counter import ApiCallCounter
+from datacatalog_fileset_enricher.bounded_executor import prefetch
+
+
+class ApiCallCounterTestCase(TestCase):
+
+    def test_record_should_count_calls_for_the_run_and_the_current_entry(self):
+        api_call_counter = ApiCallCounter()
+
+        api_call_counter.record('storage.list_buckets', 1, 2, 100)
+        with api_call_counter.entry('entry_1'):
+            api_call_counter.record('storage.get_bucket')
+            api_call_counter.record('storage.get_bucket', 0, 0, 50)
+
+        self.assertEqual({
+            'storage.list_buckets': {
+                'calls': 1,
+                'pages': 2,
+                'bytes': 100
+            },
+            'storage.get_bucket': {
+                'calls': 1,
+                'pages': 0,
+                'bytes': 50
+            }
+        }, api_call_counter.totals)
+        self.assertEqual(['entry_1'], api_call_counter.entries)
+        self.assertEqual(['storage.get_bucket'],
+                         list(api_call_counter.get_entry_totals('entry_1')))
+
+    def test_record_in_prefetched_iterable_should_count_calls_for_the_caller_entry(self):
+        api_call_counter = ApiCallCounter()
+
+        def list_pages():
+            for page in range(3):
+                api_call_counter.record('storage.list_blobs', 0, 1)
+                yield page
+
+        with api_call_counter.entry('entry_1'):
+            self.assertEqual([0, 1, 2], list(prefetch(list_pages())))
+        thread = threading.Thread(target=api_call_counter.record, args=('storage.get_bucket', ))
+        thread.start()
+        thread.join()
+
+        self.assertEqual(3, api_call_counter.get_entry_totals('entry_1')['storage.list_blobs']
+                         ['pages'])
+        self.assertNotIn('storage.get_bucket', api_call_counter.get_entry_totals('entry_1'))
+        self.assertEqual(1, api_call_counter.totals['storage.get_bucket']['calls'])
+
+    def test_count_http_response_should_count_bytes_for_the_tracked_method(self):
+        api_call_counter = ApiCallCounter()
+        response = MockedObject()
+        response.content = b'{"items": []}'
+        response.request = MockedObject()
+        response.request.body = b'{}'
+
+        api_call_counter.count_http_response(response)
+        with api_call_counter.track('storage.list_blobs'):
+            api_call_counter.count_http_response(response)
+
+        self.assertEqual({'storage.list_blobs': {
+            'calls': 0,
+            'pages': 0,
+            'bytes': 15
+        }}, api_call_counter.totals)
+
+    def test_assert_within_budget_should_raise_when_a_method_exceeds_its_budget(self):
+        api_call_counter = ApiCallCounter()
+        with api_call_counter.entry('entry_1'):
+            api_call_counter.record('storage.get_bucket')
+        api_call_counter.record('storage.get_bucket')
+
+        api_call_counter.assert_within_budget({
+            'storage.get_bucket': 1,
+            'storage.list_blobs': 0
+        }, 'entry_1')
+        with self.assertRaisesRegex(AssertionError, 'storage.get_bucket: 2 calls, budget 1'):
+            api_call_counter.assert_within_budget({'storage.get_bucket': 1})
+
+    def test_write_report_should_rank_entries_by_calls(self):
+        api_call_counter = ApiCallCounter()
+        with api_call_counter.entry('entry_1'):
+            api_call_counter.record('datacatalog.get_entry')
+        with api_call_counter.entry('entry_2'):
+            api_call_counter.record('datacatalog.get_entry')
+            api_call_counter.record('storage.list_blobs', 1, 4, 2**20)
+
+        report = io.StringIO()
+        api_call_counter.write_report(report)
+
+        lines = report.getvalue().splitlines()
+        self.assertEqual('         1          4       1.00  storage.list_blobs', lines[2])
+        self.assertTrue(lines[5].endswith(
+            'entry_2 (datacatalog.get_entry: 1, storage.list_blobs: 1)'))
+        self.assertTrue(lines[6].endswith('entry_1 (datacatalog.get_entry: 1)'))
+
+
+class MockedObject(object):
+
+    def __setitem__(self, key, value):
+        self.__dict__[key] = value
+
+    def __getitem__(self, key):
+        return self.__dict__[key]
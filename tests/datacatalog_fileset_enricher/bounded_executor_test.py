@@ -0,0 +1,95 @@
+import threading
+
+from unittest import TestCase
+
+from datacatalog_fileset_enricher.bounded_executor import BoundedExecutor, ProgressTracker, \
+    prefetch
+
+
+class BoundedExecutorTestCase(TestCase):
+
+    def test_submit_should_block_when_too_many_tasks_are_pending(self):
+        released = threading.Event()
+        submitted = []
+
+        executor = BoundedExecutor(max_workers=1, max_pending=2)
+        executor.submit(released.wait, 5)
+        executor.submit(released.wait, 5)
+
+        # A third task must wait for a pending slot.
+        submitter = threading.Thread(
+            target=lambda: submitted.append(executor.submit(lambda: 'done')))
+        submitter.start()
+        submitter.join(0.2)
+        self.assertEqual([], submitted)
+
+        released.set()
+        submitter.join(5)
+        executor.shutdown()
+
+        self.assertEqual('done', submitted[0].result())
+
+    def test_context_manager_should_wait_for_all_tasks(self):
+        tracker = ProgressTracker('Tasks done', log_every=2)
+
+        with BoundedExecutor(max_workers=4) as executor:
+            for _ in range(10):
+                executor.submit(tracker.increment)
+
+        self.assertEqual(10, tracker.count)
+
+    def test_submit_error_should_release_pending_slot(self):
+        executor = BoundedExecutor(max_workers=1, max_pending=1)
+        executor.shutdown()
+
+        self.assertRaises(RuntimeError, executor.submit, lambda: None)
+        self.assertRaises(RuntimeError, executor.submit, lambda: None)
+
+
+class PrefetchTestCase(TestCase):
+
+    def test_prefetch_should_produce_items_ahead_of_the_consumer(self):
+        produced = []
+        first_item_consumed = threading.Event()
+
+        def produce():
+            for item in range(5):
+                produced.append(item)
+                yield item
+
+        items = prefetch(produce(), depth=2)
+        self.assertEqual(0, next(items))
+        first_item_consumed.set()
+        # The producer fills the queue with the next items while the first one is consumed.
+        for _ in range(50):
+            if len(produced) >= 3:
+                break
+            threading.Event().wait(0.01)
+        self.assertGreaterEqual(len(produced), 3)
+
+        self.assertEqual([1, 2, 3, 4], list(items))
+
+    def test_prefetch_should_raise_producer_errors_to_the_consumer(self):
+
+        def produce():
+            yield 'page'
+            raise ValueError('listing failed')
+
+        items = prefetch(produce())
+        self.assertEqual('page', next(items))
+        self.assertRaises(ValueError, next, items)
+
+    def test_prefetch_closed_early_should_stop_the_producer(self):
+        produced = []
+
+        def produce():
+            for item in range(1000):
+                produced.append(item)
+                yield item
+
+        items = prefetch(produce(), depth=1)
+        next(items)
+        items.close()
+        threading.Event().wait(0.3)
+
+        self.assertLess(len(produced), 10)
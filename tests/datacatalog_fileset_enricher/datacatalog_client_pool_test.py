@@ -0,0 +1,57 @@
+from concurrent import futures
+from unittest import TestCase
+
+import grpc
+
+from google.cloud.datacatalog_v1.proto import datacatalog_pb2_grpc, datacatalog_pb2
+
+from datacatalog_fileset_enricher.datacatalog_client_pool import DataCatalogClientPool
+from datacatalog_fileset_enricher.datacatalog_helper import DataCatalogHelper
+
+
+class DataCatalogClientPoolTestCase(TestCase):
+
+    def test_get_client_should_rotate_over_the_pool_clients(self):
+        pool = DataCatalogClientPool(3, address='localhost:1', insecure=True)
+
+        clients = [pool.get_client() for _ in range(6)]
+        pool.close()
+
+        self.assertEqual(3, pool.size)
+        self.assertEqual(3, len(set(map(id, clients))))
+        self.assertEqual(clients[:3], clients[3:])
+        self.assertEqual(3, len(set(id(client.transport.channel) for client in clients)))
+
+    def test_datacatalog_helper_should_spread_calls_over_the_pool_connections(self):
+        servicer = FakeDataCatalogServicer()
+        server = grpc.server(futures.ThreadPoolExecutor(max_workers=4))
+        datacatalog_pb2_grpc.add_DataCatalogServicer_to_server(servicer, server)
+        port = server.add_insecure_port('localhost:0')
+        server.start()
+
+        pool = DataCatalogClientPool(3, address=f'localhost:{port}', insecure=True)
+        datacatalog_helper = DataCatalogHelper('test_project', pool)
+        try:
+            entries = [
+                datacatalog_helper.get_entry('us-central1', 'entry_group_id', 'entry_id')
+                for _ in range(6)
+            ]
+        finally:
+            pool.close()
+            server.stop(None)
+
+        self.assertEqual(
+            'projects/test_project/locations/us-central1/entryGroups/entry_group_id/'
+            'entries/entry_id', entries[0].name)
+        # Each channel has its own connection, seen by the server as a different peer.
+        self.assertEqual(3, len(set(servicer.peers)))
+
+
+class FakeDataCatalogServicer(datacatalog_pb2_grpc.DataCatalogServicer):
+
+    def __init__(self):
+        self.peers = []
+
+    def GetEntry(self, request, context):
+        self.peers.append(context.peer())
+        return datacatalog_pb2.Entry(name=request.name)
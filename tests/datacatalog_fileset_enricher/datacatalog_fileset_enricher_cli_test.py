@@ -1,12 +1,41 @@
+import io
+import subprocess
+import sys
+import tempfile
+
 from unittest import TestCase
 from unittest import mock
 
 from datacatalog_fileset_enricher import datacatalog_fileset_enricher_cli
+from datacatalog_fileset_enricher.enrichment_scheduler import EnrichmentScheduler
+from datacatalog_fileset_enricher.tag_digest_store import TagDigestStore
 
 
 class TagManagerCLITest(TestCase):
     __PATCHED_FILE_ENRICHER_PROCESSOR = 'datacatalog_fileset_enricher' \
                                          '.datacatalog_fileset_enricher.DatacatalogFilesetEnricher'
+    __PATCHED_FILE_ENRICHER_SERVICE = 'datacatalog_fileset_enricher' \
+                                      '.datacatalog_fileset_enricher_service' \
+                                      '.DatacatalogFilesetEnricherService'
+    __PATCHED_MULTI_PROJECT_ENRICHER = 'datacatalog_fileset_enricher' \
+                                       '.datacatalog_fileset_enricher_multi_project' \
+                                       '.MultiProjectFilesetEnricher'
+
+    def test_import_should_not_load_heavy_dependencies(self):
+        result = subprocess.run([
+            sys.executable, '-X', 'importtime', '-c',
+            'import datacatalog_fileset_enricher.datacatalog_fileset_enricher_cli'
+        ],
+                                stderr=subprocess.PIPE,
+                                universal_newlines=True,
+                                check=True)
+
+        imported_modules = [line.split('|')[-1].strip() for line in result.stderr.splitlines()]
+
+        self.assertIn('datacatalog_fileset_enricher.datacatalog_fileset_enricher_cli',
+                      imported_modules)
+        for heavy_module in ['pandas', 'google.cloud.storage', 'google.cloud.datacatalog_v1']:
+            self.assertNotIn(heavy_module, imported_modules)
 
     def test_parse_args_invalid_subcommand_should_raise_system_exit(self):
         self.assertRaises(
@@ -29,6 +58,57 @@ class TagManagerCLITest(TestCase):
             ['--project-id=test-project', 'enrich-gcs-filesets'])
         run.assert_called_once()
 
+    @mock.patch(f'{__PATCHED_FILE_ENRICHER_PROCESSOR}.__init__', lambda self, *args: None)
+    @mock.patch(f'{__PATCHED_FILE_ENRICHER_PROCESSOR}.run')
+    def test_run_with_memory_profile_should_write_report(self, run):
+        with tempfile.NamedTemporaryFile(mode='r', suffix='.txt') as report_file:
+            datacatalog_fileset_enricher_cli.DatacatalogFilesetEnricherCLI.run([
+                '--project-id=test-project', 'enrich-gcs-filesets', '--memory-profile',
+                report_file.name
+            ])
+
+            run.assert_called_once()
+            self.assertIn('Peak MB', report_file.read())
+
+    @mock.patch(f'{__PATCHED_FILE_ENRICHER_PROCESSOR}.__init__')
+    @mock.patch(f'{__PATCHED_FILE_ENRICHER_PROCESSOR}.run')
+    def test_run_with_api_calls_report_should_write_report(self, run, enricher_init):
+        enricher_init.return_value = None
+
+        def count_api_calls(*args):
+            api_call_counter = enricher_init.call_args[0][-1]
+            api_call_counter.record('storage.list_blobs', 1, 3)
+
+        run.side_effect = count_api_calls
+
+        with tempfile.NamedTemporaryFile(mode='r', suffix='.txt') as report_file:
+            datacatalog_fileset_enricher_cli.DatacatalogFilesetEnricherCLI.run([
+                '--project-id=test-project', 'enrich-gcs-filesets', '--api-calls-report',
+                report_file.name
+            ])
+
+            run.assert_called_once()
+            report = report_file.read()
+            self.assertIn('Calls', report)
+            self.assertIn('storage.list_blobs', report)
+
+    @mock.patch('datacatalog_fileset_enricher.gcs_blob_name_matcher.BlobNameMatcher.close')
+    @mock.patch(f'{__PATCHED_FILE_ENRICHER_PROCESSOR}.__init__', lambda self, *args: None)
+    @mock.patch(f'{__PATCHED_FILE_ENRICHER_PROCESSOR}.run')
+    def test_run_with_failed_enrichment_should_close_the_name_matcher(self, run, close):
+        run.side_effect = Exception('enrichment failed')
+
+        self.assertRaises(
+            Exception, datacatalog_fileset_enricher_cli.DatacatalogFilesetEnricherCLI.run,
+            ['--project-id=test-project', 'enrich-gcs-filesets', '--matching-processes=2'])
+
+        close.assert_called_once()
+
+    def test_parse_args_memory_profile_with_multiple_projects_should_raise_system_exit(self):
+        self.assertRaises(
+            SystemExit, datacatalog_fileset_enricher_cli.DatacatalogFilesetEnricherCLI._parse_args,
+            ['--project-ids=project-1,project-2', 'enrich-gcs-filesets', '--memory-profile=m.txt'])
+
     @mock.patch(f'{__PATCHED_FILE_ENRICHER_PROCESSOR}.__init__', lambda self, *args: None)
     @mock.patch(f'{__PATCHED_FILE_ENRICHER_PROCESSOR}.run')
     def test_run_with_args_and_tag_fields_should_not_raise_exception(self, run):
@@ -36,6 +116,170 @@ class TagManagerCLITest(TestCase):
             ['--project-id=test-project', 'enrich-gcs-filesets', '--tag-fields=field1,field2'])
         run.assert_called_once()
 
+    @mock.patch(f'{__PATCHED_FILE_ENRICHER_PROCESSOR}.__init__', lambda self, *args: None)
+    @mock.patch(f'{__PATCHED_FILE_ENRICHER_PROCESSOR}.run')
+    def test_run_with_time_budget_should_pass_a_scheduler(self, run):
+        datacatalog_fileset_enricher_cli.DatacatalogFilesetEnricherCLI.run([
+            '--project-id=test-project', 'enrich-gcs-filesets', '--time-budget=14400',
+            '--size-cost'
+        ])
+
+        scheduler = run.call_args[0][5]
+        self.assertIsInstance(scheduler, EnrichmentScheduler)
+        self.assertGreater(scheduler.time_left, 14000)
+
+    def test_parse_args_size_cost_without_time_budget_should_raise_system_exit(self):
+        self.assertRaises(
+            SystemExit, datacatalog_fileset_enricher_cli.DatacatalogFilesetEnricherCLI._parse_args,
+            ['--project-id=test-project', 'enrich-gcs-filesets', '--size-cost'])
+
+    def test_parse_args_size_cost_with_multiple_projects_should_raise_system_exit(self):
+        self.assertRaises(
+            SystemExit, datacatalog_fileset_enricher_cli.DatacatalogFilesetEnricherCLI._parse_args,
+            [
+                '--project-ids=project-1,project-2', 'enrich-gcs-filesets', '--time-budget=60',
+                '--size-cost'
+            ])
+
+    @mock.patch('sys.stdin', io.StringIO('us-central1/g/e\n'))
+    def test_parse_args_size_cost_with_entries_file_should_raise_system_exit(self):
+        self.assertRaises(
+            SystemExit, datacatalog_fileset_enricher_cli.DatacatalogFilesetEnricherCLI._parse_args,
+            [
+                '--project-id=project-1', 'enrich-gcs-filesets', '--entries-file=-',
+                '--time-budget=60', '--size-cost'
+            ])
+
+    @mock.patch(f'{__PATCHED_MULTI_PROJECT_ENRICHER}.__init__')
+    @mock.patch(f'{__PATCHED_MULTI_PROJECT_ENRICHER}.run')
+    def test_run_with_project_ids_should_enrich_all_projects(self, run, multi_project_init):
+        multi_project_init.return_value = None
+
+        datacatalog_fileset_enricher_cli.DatacatalogFilesetEnricherCLI.run(
+            ['--project-ids=project-1, project-2', 'enrich-gcs-filesets', '--workers=4'])
+
+        multi_project_init.assert_called_once_with(['project-1', 'project-2'], 4, 2, None, None,
+                                                   1, None, False, None, 1, None, None)
+        run.assert_called_once_with(None, None, None, None, None)
+
+    @mock.patch(f'{__PATCHED_MULTI_PROJECT_ENRICHER}.__init__')
+    @mock.patch(f'{__PATCHED_MULTI_PROJECT_ENRICHER}.run')
+    def test_run_with_project_ids_file_should_enrich_all_projects(self, run, multi_project_init):
+        multi_project_init.return_value = None
+
+        with tempfile.NamedTemporaryFile('w', suffix='.txt') as project_ids_file:
+            project_ids_file.write('project-1\n\nproject-2\n')
+            project_ids_file.flush()
+            datacatalog_fileset_enricher_cli.DatacatalogFilesetEnricherCLI.run(
+                [f'--project-ids-file={project_ids_file.name}', 'enrich-gcs-filesets'])
+
+        self.assertEqual(['project-1', 'project-2'], multi_project_init.call_args[0][0])
+        run.assert_called_once()
+
+    @mock.patch(f'{__PATCHED_MULTI_PROJECT_ENRICHER}.__init__')
+    @mock.patch(f'{__PATCHED_MULTI_PROJECT_ENRICHER}.run')
+    def test_run_with_entries_file_should_enrich_the_listed_entries_once(
+            self, run, multi_project_init):
+        multi_project_init.return_value = None
+
+        with tempfile.NamedTemporaryFile('w', suffix='.txt') as entries_file:
+            entries_file.write('projects/project-2/locations/us-central1/entryGroups/g/entries/e\n'
+                               '# Entries of project-1\n'
+                               'us-central1/g/e\n'
+                               '\n'
+                               'us-central1/g/e_2\n'
+                               'projects/project-1/locations/us-central1/entryGroups/g/'
+                               'entries/e\n')
+            entries_file.flush()
+            datacatalog_fileset_enricher_cli.DatacatalogFilesetEnricherCLI.run([
+                '--project-id=project-1', 'enrich-gcs-filesets',
+                f'--entries-file={entries_file.name}'
+            ])
+
+        self.assertEqual(['project-2', 'project-1'], multi_project_init.call_args[0][0])
+        self.assertEqual(
+            {
+                'project-1': [('us-central1', 'g', 'e'), ('us-central1', 'g', 'e_2')],
+                'project-2': [('us-central1', 'g', 'e')]
+            }, run.call_args[0][4])
+
+    @mock.patch(f'{__PATCHED_MULTI_PROJECT_ENRICHER}.__init__')
+    @mock.patch(f'{__PATCHED_MULTI_PROJECT_ENRICHER}.run')
+    @mock.patch('sys.stdin', io.StringIO('us-central1/g/e\n'))
+    def test_run_with_entries_from_stdin_should_enrich_them(self, run, multi_project_init):
+        multi_project_init.return_value = None
+
+        datacatalog_fileset_enricher_cli.DatacatalogFilesetEnricherCLI.run(
+            ['--project-id=project-1', 'enrich-gcs-filesets', '--entries-file=-', '--workers=16'])
+
+        self.assertEqual([['project-1'], 16], list(multi_project_init.call_args[0][:2]))
+        self.assertEqual({'project-1': [('us-central1', 'g', 'e')]}, run.call_args[0][4])
+
+    def test_parse_args_entries_file_with_entry_id_should_raise_system_exit(self):
+        self.assertRaises(
+            SystemExit, datacatalog_fileset_enricher_cli.DatacatalogFilesetEnricherCLI._parse_args,
+            [
+                '--project-id=project-1', 'enrich-gcs-filesets', '--entries-file=-',
+                '--entry-group-id=g', '--entry-id=e'
+            ])
+
+    @mock.patch('sys.stdin', io.StringIO('us-central1/e\n'))
+    def test_parse_args_entries_file_with_invalid_entry_name_should_raise_system_exit(self):
+        self.assertRaises(
+            SystemExit, datacatalog_fileset_enricher_cli.DatacatalogFilesetEnricherCLI._parse_args,
+            ['--project-id=project-1', 'enrich-gcs-filesets', '--entries-file=-'])
+
+    @mock.patch(f'{__PATCHED_FILE_ENRICHER_PROCESSOR}.__init__', lambda self, *args: None)
+    @mock.patch(f'{__PATCHED_FILE_ENRICHER_PROCESSOR}.clean_up_all')
+    def test_clean_up_all_should_clear_the_tag_digest_store(self, clean_up_all):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            digest_store_path = f'{temp_dir}/digests.db'
+            tag_digest_store = TagDigestStore(digest_store_path)
+            tag_digest_store.save('entry', 'template', 'digest')
+
+            datacatalog_fileset_enricher_cli.DatacatalogFilesetEnricherCLI.run([
+                '--project-id=test-project', 'clean-up-all',
+                f'--tag-digest-store={digest_store_path}'
+            ])
+
+            self.assertFalse(tag_digest_store.is_up_to_date('entry', 'template', 'digest'))
+            tag_digest_store.close()
+        clean_up_all.assert_called_once()
+
+    @mock.patch(f'{__PATCHED_FILE_ENRICHER_PROCESSOR}.__init__', lambda self, *args: None)
+    @mock.patch(f'{__PATCHED_FILE_ENRICHER_PROCESSOR}.run')
+    def test_run_with_failed_enrichment_should_close_the_tag_digest_store(self, run):
+        run.side_effect = Exception('enrichment failed')
+
+        with tempfile.TemporaryDirectory() as temp_dir, \
+                mock.patch.object(TagDigestStore, 'close') as close:
+            self.assertRaises(
+                Exception, datacatalog_fileset_enricher_cli.DatacatalogFilesetEnricherCLI.run, [
+                    '--project-id=test-project', 'enrich-gcs-filesets',
+                    f'--tag-digest-store={temp_dir}/digests.db'
+                ])
+
+        close.assert_called_once()
+
+    @mock.patch(f'{__PATCHED_MULTI_PROJECT_ENRICHER}.__init__', lambda self, *args: None)
+    @mock.patch(f'{__PATCHED_MULTI_PROJECT_ENRICHER}.run')
+    def test_run_with_project_ids_should_close_the_tag_digest_store(self, run):
+        with tempfile.TemporaryDirectory() as temp_dir, \
+                mock.patch.object(TagDigestStore, 'close') as close:
+            datacatalog_fileset_enricher_cli.DatacatalogFilesetEnricherCLI.run([
+                '--project-ids=project-1,project-2', 'enrich-gcs-filesets',
+                f'--tag-digest-store={temp_dir}/digests.db'
+            ])
+
+        run.assert_called_once()
+        close.assert_called_once()
+
+    def test_run_service_with_project_ids_should_fail(self):
+        with mock.patch('sys.stderr'):
+            self.assertRaises(SystemExit,
+                              datacatalog_fileset_enricher_cli.DatacatalogFilesetEnricherCLI.run,
+                              ['--project-ids=project-1,project-2', 'run-service'])
+
     @mock.patch(f'{__PATCHED_FILE_ENRICHER_PROCESSOR}.__init__', lambda self, *args: None)
     @mock.patch(f'{__PATCHED_FILE_ENRICHER_PROCESSOR}.clean_up_fileset_template_and_tags')
     def test_clen_up_fileset_templates_and_tag_with_args_should_not_raise_exception(
@@ -43,3 +287,22 @@ class TagManagerCLITest(TestCase):
         datacatalog_fileset_enricher_cli.DatacatalogFilesetEnricherCLI.run(
             ['--project-id=test-project', 'clean-up-templates-and-tags'])
         clean_up_fileset_template_and_tags.assert_called_once()
+
+    @mock.patch(f'{__PATCHED_FILE_ENRICHER_PROCESSOR}.__init__', lambda self, *args: None)
+    @mock.patch(f'{__PATCHED_FILE_ENRICHER_PROCESSOR}.clean_up_all')
+    def test_clean_up_all_with_dry_run_should_pass_args(self, clean_up_all):
+        datacatalog_fileset_enricher_cli.DatacatalogFilesetEnricherCLI.run(
+            ['--project-id=test-project', 'clean-up-all', '--dry-run', '--workers=16'])
+        clean_up_all.assert_called_once_with(True, 16)
+
+    @mock.patch(f'{__PATCHED_FILE_ENRICHER_SERVICE}.__init__', lambda self, *args: None)
+    @mock.patch(f'{__PATCHED_FILE_ENRICHER_SERVICE}.shutdown')
+    @mock.patch(f'{__PATCHED_FILE_ENRICHER_SERVICE}.serve')
+    def test_run_service_should_serve_until_interrupted(self, serve, shutdown):
+        serve.side_effect = KeyboardInterrupt()
+
+        datacatalog_fileset_enricher_cli.DatacatalogFilesetEnricherCLI.run(
+            ['--project-id=test-project', 'run-service', '--port=9090', '--sweep-interval=3600'])
+
+        serve.assert_called_once_with('localhost', 9090)
+        shutdown.assert_called_once()
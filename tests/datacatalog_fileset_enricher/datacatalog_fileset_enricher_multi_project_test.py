@@ -0,0 +1,188 @@
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from datacatalog_fileset_enricher.datacatalog_fileset_enricher_multi_project import \
+    MultiProjectFilesetEnricher
+from datacatalog_fileset_enricher.enrichment_scheduler import EnrichmentScheduler
+
+
+@patch('google.auth.default', lambda scopes: ('credentials', None))
+@patch('google.cloud.datacatalog_v1.DataCatalogClient.__init__', lambda self, **kargs: None)
+@patch('datacatalog_fileset_enricher.gcs_storage_filter.StorageFilter.__init__',
+       lambda self, *args: None)
+class MultiProjectFilesetEnricherTestCase(TestCase):
+    __PATCHED_ENRICHER = 'datacatalog_fileset_enricher.datacatalog_fileset_enricher.' \
+                         'DatacatalogFilesetEnricher'
+
+    @patch(f'{__PATCHED_ENRICHER}.enrich_datacatalog_fileset_entry')
+    @patch(f'{__PATCHED_ENRICHER}.get_fileset_entries')
+    def test_run_should_enrich_entries_from_all_projects(self, get_fileset_entries,
+                                                         enrich_datacatalog_fileset_entry):
+        get_fileset_entries.return_value = [('us-central1', 'entry_group_id', 'entry_id'),
+                                            ('us-central1', 'entry_group_id', 'entry_id_2')]
+
+        results = MultiProjectFilesetEnricher(['project_1', 'project_2',
+                                               'project_1']).run(['files'])
+
+        self.assertEqual({
+            'project_1': {
+                'enriched': 2,
+                'failed': 0
+            },
+            'project_2': {
+                'enriched': 2,
+                'failed': 0
+            }
+        }, results)
+        self.assertEqual(2, get_fileset_entries.call_count)
+        enrich_datacatalog_fileset_entry.assert_any_call('us-central1', 'entry_group_id',
+                                                         'entry_id_2', ['files'], None, None)
+
+    @patch(f'{__PATCHED_ENRICHER}.enrich_datacatalog_fileset_entry')
+    @patch(f'{__PATCHED_ENRICHER}.get_fileset_entries')
+    def test_run_given_entries_should_not_search_them(self, get_fileset_entries,
+                                                      enrich_datacatalog_fileset_entry):
+        entry = ('us-central1', 'entry_group_id', 'entry_id')
+
+        results = MultiProjectFilesetEnricher(['project_1', 'project_2']).run(
+            entries_by_project={'project_1': [entry, entry]})
+
+        get_fileset_entries.assert_not_called()
+        enrich_datacatalog_fileset_entry.assert_called_once_with(*entry, None, None, None)
+        self.assertEqual({'enriched': 1, 'failed': 0}, results['project_1'])
+        self.assertEqual({'enriched': 0, 'failed': 0}, results['project_2'])
+
+    @patch(f'{__PATCHED_ENRICHER}.enrich_datacatalog_fileset_entry')
+    @patch(f'{__PATCHED_ENRICHER}.get_fileset_entries')
+    def test_run_should_limit_concurrent_entries_per_project(self, get_fileset_entries,
+                                                             enrich_datacatalog_fileset_entry):
+        get_fileset_entries.return_value = [('us-central1', 'entry_group_id', f'entry_id_{i}')
+                                            for i in range(10)]
+        lock = threading.Lock()
+        running = {'current': 0, 'max': 0}
+
+        def enrich(*args):
+            with lock:
+                running['current'] += 1
+                running['max'] = max(running['max'], running['current'])
+            time.sleep(0.01)
+            with lock:
+                running['current'] -= 1
+
+        enrich_datacatalog_fileset_entry.side_effect = enrich
+
+        results = MultiProjectFilesetEnricher(['project_1'], workers=8,
+                                              workers_per_project=2).run()
+
+        self.assertEqual(10, results['project_1']['enriched'])
+        self.assertEqual(2, running['max'])
+
+    @patch(f'{__PATCHED_ENRICHER}.enrich_datacatalog_fileset_entry')
+    def test_run_should_limit_entries_handed_to_the_workers_across_projects(
+            self, enrich_datacatalog_fileset_entry):
+        entries = [('us-central1', 'entry_group_id', f'entry_id_{i}') for i in range(4)]
+        lock = threading.Lock()
+        # Entries submitted and not finished yet, whether running or queued.
+        submitted = {'current': 0, 'max': 0}
+        submit = ThreadPoolExecutor.submit
+
+        def count_submit(executor, *args):
+            with lock:
+                submitted['current'] += 1
+                submitted['max'] = max(submitted['max'], submitted['current'])
+            return submit(executor, *args)
+
+        def enrich(*args):
+            time.sleep(0.01)
+            with lock:
+                submitted['current'] -= 1
+
+        enrich_datacatalog_fileset_entry.side_effect = enrich
+
+        with patch.object(ThreadPoolExecutor, 'submit', count_submit):
+            results = MultiProjectFilesetEnricher(
+                ['project_1', 'project_2', 'project_3'], workers=2,
+                workers_per_project=2).run(entries_by_project={
+                    'project_1': entries,
+                    'project_2': entries,
+                    'project_3': entries
+                })
+
+        self.assertEqual([4, 4, 4], [
+            project_results['enriched'] for project_results in results.values()
+        ])
+        self.assertEqual(2, submitted['max'])
+
+    @patch(f'{__PATCHED_ENRICHER}.enrich_datacatalog_fileset_entry')
+    @patch(f'{__PATCHED_ENRICHER}.get_last_enrichments')
+    @patch(f'{__PATCHED_ENRICHER}.get_fileset_entries')
+    def test_run_with_expired_scheduler_should_not_start_queued_entries(
+            self, get_fileset_entries, get_last_enrichments, enrich_datacatalog_fileset_entry):
+        get_fileset_entries.return_value = [('us-central1', 'entry_group_id', f'entry_id_{i}')
+                                            for i in range(3)]
+        get_last_enrichments.return_value = [None] * 3
+        expired = threading.Event()
+        scheduler = MagicMock()
+        scheduler.is_expired.side_effect = expired.is_set
+        scheduler.time_left = None
+        started_after_expiry = []
+
+        def enrich(*args):
+            started_after_expiry.append(expired.is_set())
+            # The first Entry spends the whole time budget.
+            expired.set()
+            time.sleep(0.05)
+
+        enrich_datacatalog_fileset_entry.side_effect = enrich
+
+        results = MultiProjectFilesetEnricher(['project_1', 'project_2', 'project_3'],
+                                              workers=1, workers_per_project=2).run(
+                                                  scheduler=scheduler)
+
+        self.assertEqual([False], started_after_expiry)
+        self.assertEqual(1, sum(project_results['enriched']
+                                for project_results in results.values()))
+
+    @patch(f'{__PATCHED_ENRICHER}.enrich_datacatalog_fileset_entry')
+    @patch(f'{__PATCHED_ENRICHER}.get_last_enrichments')
+    @patch(f'{__PATCHED_ENRICHER}.get_fileset_entries')
+    def test_run_with_scheduler_should_enrich_oldest_entries_until_the_deadline(
+            self, get_fileset_entries, get_last_enrichments, enrich_datacatalog_fileset_entry):
+        get_fileset_entries.return_value = [('us-central1', 'entry_group_id', f'entry_id_{i}')
+                                            for i in range(3)]
+        get_last_enrichments.return_value = [(datetime(2024, 1, 2), 1), None,
+                                             (datetime(2024, 1, 1), 1)]
+        enriched_entries = []
+
+        def enrich(location, entry_group_id, entry_id, *args):
+            enriched_entries.append(entry_id)
+            # The first Entry spends the whole time budget.
+            time.sleep(0.3)
+
+        enrich_datacatalog_fileset_entry.side_effect = enrich
+
+        results = MultiProjectFilesetEnricher(['project_1'], workers=1,
+                                              workers_per_project=1).run(
+                                                  scheduler=EnrichmentScheduler(0.2))
+
+        self.assertEqual(['entry_id_1'], enriched_entries)
+        self.assertEqual({'enriched': 1, 'failed': 0}, results['project_1'])
+
+    @patch(f'{__PATCHED_ENRICHER}.enrich_datacatalog_fileset_entry')
+    @patch(f'{__PATCHED_ENRICHER}.get_fileset_entries')
+    def test_run_errors_should_not_leak(self, get_fileset_entries,
+                                        enrich_datacatalog_fileset_entry):
+        get_fileset_entries.side_effect = [[('us-central1', 'entry_group_id', 'entry_id')],
+                                           Exception('error searching entries')]
+        enrich_datacatalog_fileset_entry.side_effect = Exception('error enriching entry')
+
+        results = MultiProjectFilesetEnricher(['project_1', 'project_2'], workers=1).run()
+
+        self.assertEqual({'enriched': 0, 'failed': 1}, results['project_1'])
+        self.assertEqual({'enriched': 0, 'failed': 0}, results['project_2'])
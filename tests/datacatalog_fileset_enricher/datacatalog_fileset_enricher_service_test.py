@@ -0,0 +1,159 @@
+import json
+import socket
+import threading
+
+from http.client import HTTPConnection
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from google.api_core import exceptions
+
+from datacatalog_fileset_enricher.datacatalog_fileset_enricher_service import \
+    DatacatalogFilesetEnricherService
+
+
+@patch('datacatalog_fileset_enricher.datacatalog_fileset_enricher.'
+       'DatacatalogFilesetEnricher.__init__', lambda self, *args: None)
+class DatacatalogFilesetEnricherServiceTestCase(TestCase):
+    __PATCHED_ENRICHER = 'datacatalog_fileset_enricher.datacatalog_fileset_enricher.' \
+                         'DatacatalogFilesetEnricher'
+
+    @patch(f'{__PATCHED_ENRICHER}.clear_cache', lambda self: None)
+    @patch(f'{__PATCHED_ENRICHER}.enrich_datacatalog_fileset_entry')
+    def test_enqueue_entry_should_enrich_the_entry(self, enrich_datacatalog_fileset_entry):
+        service = DatacatalogFilesetEnricherService('test_project', tag_fields=['files'])
+
+        service.enqueue_entry('entry_group_id', 'entry_id').result()
+        service.shutdown()
+
+        enrich_datacatalog_fileset_entry.assert_called_once_with('us-central1', 'entry_group_id',
+                                                                 'entry_id', ['files'], None,
+                                                                 None)
+        self.assertEqual(0, service.pending_entries)
+
+    @patch(f'{__PATCHED_ENRICHER}.clear_cache', lambda self: None)
+    @patch(f'{__PATCHED_ENRICHER}.enrich_datacatalog_fileset_entry')
+    def test_enqueue_pending_entry_should_not_enqueue_it_twice(self,
+                                                               enrich_datacatalog_fileset_entry):
+        worker_released = threading.Event()
+        enrich_datacatalog_fileset_entry.side_effect = lambda *args: worker_released.wait(5)
+
+        service = DatacatalogFilesetEnricherService('test_project', workers=1)
+
+        # The first entry keeps the only worker busy, so the next ones stay pending.
+        service.enqueue_entry('entry_group_id', 'busy_entry_id')
+        self.assertTrue(service.enqueue_entry('entry_group_id', 'entry_id'))
+        self.assertFalse(service.enqueue_entry('entry_group_id', 'entry_id'))
+
+        worker_released.set()
+        service.shutdown()
+
+        self.assertEqual(2, enrich_datacatalog_fileset_entry.call_count)
+
+    @patch(f'{__PATCHED_ENRICHER}.clear_cache', lambda self: None)
+    @patch(f'{__PATCHED_ENRICHER}.enrich_datacatalog_fileset_entry')
+    def test_enrich_entry_error_should_not_leak(self, enrich_datacatalog_fileset_entry):
+        enrich_datacatalog_fileset_entry.side_effect = Exception('error enriching entry')
+
+        service = DatacatalogFilesetEnricherService('test_project')
+        service.enqueue_entry('entry_group_id', 'entry_id').result()
+        service.shutdown()
+
+        enrich_datacatalog_fileset_entry.assert_called_once()
+
+    @patch(f'{__PATCHED_ENRICHER}.enrich_datacatalog_fileset_entry')
+    @patch(f'{__PATCHED_ENRICHER}.get_fileset_entries')
+    @patch(f'{__PATCHED_ENRICHER}.clear_cache')
+    def test_sweep_should_enqueue_all_fileset_entries(self, clear_cache, get_fileset_entries,
+                                                      enrich_datacatalog_fileset_entry):
+        get_fileset_entries.return_value = [('us-central1', 'entry_group_id', 'entry_id'),
+                                            ('us-east1', 'entry_group_id', 'entry_id_2')]
+
+        service = DatacatalogFilesetEnricherService('test_project')
+        service.sweep()
+        service.shutdown()
+
+        clear_cache.assert_called_once()
+        self.assertEqual(2, enrich_datacatalog_fileset_entry.call_count)
+        enrich_datacatalog_fileset_entry.assert_any_call('us-east1', 'entry_group_id',
+                                                         'entry_id_2', None, None, None)
+
+    @patch(f'{__PATCHED_ENRICHER}.enrich_datacatalog_fileset_entry')
+    @patch(f'{__PATCHED_ENRICHER}.get_fileset_entries')
+    @patch(f'{__PATCHED_ENRICHER}.clear_cache')
+    def test_serve_should_enqueue_entries_and_run_sweeps(self, clear_cache, get_fileset_entries,
+                                                         enrich_datacatalog_fileset_entry):
+        swept = threading.Event()
+        get_fileset_entries.side_effect = lambda: swept.set() or []
+
+        port = self.__get_free_port()
+        service = DatacatalogFilesetEnricherService('test_project', sweep_interval=60)
+        server_thread = threading.Thread(target=service.serve, args=('localhost', port))
+        server_thread.start()
+        self.assertTrue(swept.wait(5))
+
+        accepted = self.__request(port, 'POST', '/entries', {
+            'entry_group_id': 'entry_group_id',
+            'entry_id': 'entry_id'
+        })
+        invalid = self.__request(port, 'POST', '/entries', {'entry_id': 'entry_id'})
+        not_found = self.__request(port, 'POST', '/invalid', {})
+        health = self.__request(port, 'GET', '/health')
+        invalid_health = self.__request(port, 'GET', '/invalid')
+
+        service.shutdown()
+        server_thread.join(5)
+
+        self.assertEqual((202, {'enqueued': True}), accepted)
+        self.assertEqual(400, invalid[0])
+        self.assertEqual(404, not_found[0])
+        self.assertEqual(200, health[0])
+        self.assertEqual(404, invalid_health[0])
+        enrich_datacatalog_fileset_entry.assert_called_once()
+
+    @classmethod
+    def __get_free_port(cls):
+        with socket.socket() as free_socket:
+            free_socket.bind(('localhost', 0))
+            return free_socket.getsockname()[1]
+
+    @classmethod
+    def __request(cls, port, method, path, body=None):
+        connection = HTTPConnection('localhost', port, timeout=5)
+        connection.request(method, path, body=json.dumps(body) if body is not None else None)
+        response = connection.getresponse()
+        content = json.loads(response.read())
+        connection.close()
+        return response.status, content
+
+
+@patch('google.cloud.storage.Client.__init__', lambda self, **kargs: None)
+class DatacatalogFilesetEnricherServiceBucketsTestCase(TestCase):
+    __PATCHED_DATACATALOG_HELPER = 'datacatalog_fileset_enricher.datacatalog_helper.' \
+                                   'DataCatalogHelper'
+
+    @patch('datacatalog_fileset_enricher.gcs_storage_client_helper.StorageClientHelper.get_blobs')
+    @patch('google.cloud.storage.Client.get_bucket')
+    @patch(f'{__PATCHED_DATACATALOG_HELPER}.create_tag_from_stats')
+    @patch(f'{__PATCHED_DATACATALOG_HELPER}.get_entry')
+    def test_enqueue_entry_should_find_a_bucket_missing_on_a_previous_request(
+            self, get_entry, create_tag_from_stats, get_bucket, get_blobs):
+        entry = MagicMock()
+        entry.gcs_fileset_spec.file_patterns = ['gs://my_bucket/a.txt']
+        get_entry.return_value = entry
+        bucket = MagicMock()
+        bucket.name = 'my_bucket'
+        # The bucket is created between both requests.
+        get_bucket.side_effect = [exceptions.NotFound('bucket not found'), bucket]
+        get_blobs.return_value = []
+
+        service = DatacatalogFilesetEnricherService('test_project')
+        service.enqueue_entry('entry_group_id', 'entry_id').result()
+        service.enqueue_entry('entry_group_id', 'entry_id').result()
+        service.shutdown()
+
+        self.assertEqual(2, get_bucket.call_count)
+        self.assertEqual([0, 1], [
+            call[0][1]['buckets_found'] for call in create_tag_from_stats.call_args_list
+        ])
+        get_blobs.assert_called_once_with(bucket, ['a.txt'])
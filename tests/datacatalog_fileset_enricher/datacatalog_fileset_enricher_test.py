@@ -1,11 +1,14 @@
 import pandas as pd
 
+from datetime import datetime
 from unittest import TestCase
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
 from google.cloud import datacatalog_v1
 
 from datacatalog_fileset_enricher.datacatalog_fileset_enricher import DatacatalogFilesetEnricher
+from datacatalog_fileset_enricher.enrichment_scheduler import EnrichmentScheduler
+from datacatalog_fileset_enricher.memory_profiler import MemoryProfiler
 
 
 @patch('datacatalog_fileset_enricher.gcs_storage_filter.StorageFilter.__init__',
@@ -43,25 +46,28 @@ class DatacatalogFilesetEnricherTestCase(TestCase):
     @patch('datacatalog_fileset_enricher.gcs_storage_stats_summarizer.'
            'GCStorageStatsSummarizer.create_stats_from_dataframe')
     @patch('datacatalog_fileset_enricher.gcs_storage_filter.'
-           'StorageFilter.create_filtered_data_for_multiple_buckets')
+           'StorageFilter.create_filtered_data_for_file_regex_groups')
     @patch('datacatalog_fileset_enricher.gcs_storage_filter.'
-           'StorageFilter.create_filtered_data_for_single_bucket')
+           'StorageFilter.list_buckets_for_bucket_pattern')
+    @patch('datacatalog_fileset_enricher.gcs_storage_filter.StorageFilter.get_buckets')
     @patch('datacatalog_fileset_enricher.gcs_storage_filter.StorageFilter.parse_gcs_file_patterns')
     @patch('datacatalog_fileset_enricher.datacatalog_helper.DataCatalogHelper.get_entry')
     @patch('datacatalog_fileset_enricher.datacatalog_helper.'
            'DataCatalogHelper.get_manually_created_fileset_entries')
     def test_run_given_entry_group_id_and_entry_id_should_enrich_a_single_entry(
         self, get_manually_created_fileset_entries, get_entry, parse_gcs_file_patterns,
-        create_filtered_data_for_single_bucket, create_filtered_data_for_multiple_buckets,
+        get_buckets, list_buckets_for_bucket_pattern, create_filtered_data_for_file_regex_groups,
         create_stats_from_dataframe, create_tag_from_stats):  # noqa: E125
 
         get_entry.return_value = self.__make_fake_fileset_entry()
 
         parse_gcs_file_patterns.return_value = [{'bucket_name': 'my_bucket', 'file_regex': '.*'}]
 
-        dataframe = pd.DataFrame()
-        filtered_buckets_stats = {}
-        create_filtered_data_for_single_bucket.return_value = (dataframe, filtered_buckets_stats)
+        bucket = MockedObject()
+        bucket.name = 'my_bucket'
+        get_buckets.return_value = {'my_bucket': bucket}
+
+        create_filtered_data_for_file_regex_groups.return_value = [(pd.DataFrame(), 0)]
 
         stats = {}
         create_stats_from_dataframe.return_value = stats
@@ -72,8 +78,9 @@ class DatacatalogFilesetEnricherTestCase(TestCase):
         get_manually_created_fileset_entries.assert_not_called()
         get_entry.assert_called_once()
         parse_gcs_file_patterns.assert_called_once()
-        create_filtered_data_for_single_bucket.assert_called_once()
-        create_filtered_data_for_multiple_buckets.assert_not_called()
+        get_buckets.assert_called_once_with(['my_bucket'])
+        list_buckets_for_bucket_pattern.assert_not_called()
+        create_filtered_data_for_file_regex_groups.assert_called_once_with(bucket, [['.*']])
         create_stats_from_dataframe.assert_called_once()
         create_tag_from_stats.assert_called_once()
 
@@ -82,9 +89,8 @@ class DatacatalogFilesetEnricherTestCase(TestCase):
     @patch('datacatalog_fileset_enricher.gcs_storage_stats_summarizer.'
            'GCStorageStatsSummarizer.create_stats_from_dataframe')
     @patch('datacatalog_fileset_enricher.gcs_storage_filter.'
-           'StorageFilter.create_filtered_data_for_multiple_buckets')
-    @patch('datacatalog_fileset_enricher.gcs_storage_filter.'
-           'StorageFilter.create_filtered_data_for_single_bucket')
+           'StorageFilter.create_filtered_data_for_file_regex_groups')
+    @patch('datacatalog_fileset_enricher.gcs_storage_filter.StorageFilter.get_buckets')
     @patch('datacatalog_fileset_enricher.gcs_storage_filter.'
            'StorageFilter.parse_gcs_file_patterns')
     @patch('datacatalog_fileset_enricher.datacatalog_helper.' 'DataCatalogHelper.get_entry')
@@ -92,8 +98,8 @@ class DatacatalogFilesetEnricherTestCase(TestCase):
            'DataCatalogHelper.get_manually_created_fileset_entries')
     def test_run_given_entry_group_id_and_entry_id_and_multiple_gcs_patterns_should_enrich_a_single_entry(  # noqa: E501
         self, get_manually_created_fileset_entries, get_entry, parse_gcs_file_patterns,
-        create_filtered_data_for_single_bucket, create_filtered_data_for_multiple_buckets,
-        create_stats_from_dataframe, create_tag_from_stats):  # noqa: E125
+        get_buckets, create_filtered_data_for_file_regex_groups, create_stats_from_dataframe,
+        create_tag_from_stats):  # noqa: E125
 
         entry = self.__make_fake_fileset_entry()
 
@@ -109,9 +115,12 @@ class DatacatalogFilesetEnricherTestCase(TestCase):
             'file_regex': '.*csv'
         }]
 
-        dataframe = pd.DataFrame()
-        filtered_buckets_stats = {}
-        create_filtered_data_for_single_bucket.return_value = (dataframe, filtered_buckets_stats)
+        bucket = MockedObject()
+        bucket.name = 'my_bucket'
+        get_buckets.return_value = {'my_bucket': bucket}
+
+        dataframe = pd.DataFrame({'name': ['a.csv', 'b.txt']})
+        create_filtered_data_for_file_regex_groups.return_value = [(dataframe, 2)]
 
         stats = {}
         create_stats_from_dataframe.return_value = stats
@@ -122,9 +131,15 @@ class DatacatalogFilesetEnricherTestCase(TestCase):
         get_manually_created_fileset_entries.assert_not_called()
         get_entry.assert_called_once()
         parse_gcs_file_patterns.assert_called_once()
-        self.assertEqual(2, create_filtered_data_for_single_bucket.call_count)
-        create_filtered_data_for_multiple_buckets.assert_not_called()
+        get_buckets.assert_called_once_with(['my_bucket', 'my_bucket'])
+        # Both patterns are matched on a single listing, and their blobs merged.
+        create_filtered_data_for_file_regex_groups.assert_called_once_with(
+            bucket, [['.*', '.*csv']])
         create_stats_from_dataframe.assert_called_once()
+        self.assertEqual([{
+            'bucket_name': 'my_bucket',
+            'files': 2
+        }], create_stats_from_dataframe.call_args[0][2])
         create_tag_from_stats.assert_called_once()
 
     @patch(
@@ -132,26 +147,30 @@ class DatacatalogFilesetEnricherTestCase(TestCase):
     @patch('datacatalog_fileset_enricher.gcs_storage_stats_summarizer.'
            'GCStorageStatsSummarizer.create_stats_from_dataframe')
     @patch('datacatalog_fileset_enricher.gcs_storage_filter.'
-           'StorageFilter.create_filtered_data_for_multiple_buckets')
+           'StorageFilter.create_filtered_data_for_file_regex_groups')
     @patch('datacatalog_fileset_enricher.gcs_storage_filter.'
-           'StorageFilter.create_filtered_data_for_single_bucket')
+           'StorageFilter.list_buckets_for_bucket_pattern')
+    @patch('datacatalog_fileset_enricher.gcs_storage_filter.StorageFilter.get_buckets')
     @patch('datacatalog_fileset_enricher.gcs_storage_filter.StorageFilter.parse_gcs_file_patterns')
     @patch('datacatalog_fileset_enricher.datacatalog_helper.DataCatalogHelper.get_entry')
     @patch('datacatalog_fileset_enricher.datacatalog_helper.'
            'DataCatalogHelper.get_manually_created_fileset_entries')
     def test_run_given_bucket_with_wildcard_should_call_retrieve_multiple_buckets(
         self, get_manually_created_fileset_entries, get_entry, parse_gcs_file_patterns,
-        create_filtered_data_for_single_bucket, create_filtered_data_for_multiple_buckets,
+        get_buckets, list_buckets_for_bucket_pattern, create_filtered_data_for_file_regex_groups,
         create_stats_from_dataframe, create_tag_from_stats):  # noqa: E125
 
         get_entry.return_value = self.__make_fake_fileset_entry()
 
         parse_gcs_file_patterns.return_value = [{'bucket_name': 'my_bucket*', 'file_regex': '.*'}]
 
-        dataframe = pd.DataFrame()
-        filtered_buckets_stats = {}
-        create_filtered_data_for_multiple_buckets.return_value = (dataframe,
-                                                                  filtered_buckets_stats)
+        bucket = MockedObject()
+        bucket.name = 'my_bucket'
+        bucket_2 = MockedObject()
+        bucket_2.name = 'my_bucket_2'
+        list_buckets_for_bucket_pattern.return_value = [bucket, bucket_2]
+
+        create_filtered_data_for_file_regex_groups.return_value = [(pd.DataFrame(), 0)]
 
         stats = {}
         create_stats_from_dataframe.return_value = stats
@@ -162,8 +181,9 @@ class DatacatalogFilesetEnricherTestCase(TestCase):
         get_manually_created_fileset_entries.assert_not_called()
         get_entry.assert_called_once()
         parse_gcs_file_patterns.assert_called_once()
-        create_filtered_data_for_single_bucket.assert_not_called()
-        create_filtered_data_for_multiple_buckets.assert_called_once()
+        get_buckets.assert_not_called()
+        list_buckets_for_bucket_pattern.assert_called_once_with('my_bucket*', None)
+        self.assertEqual(2, create_filtered_data_for_file_regex_groups.call_count)
         create_stats_from_dataframe.assert_called_once()
         create_tag_from_stats.assert_called_once()
 
@@ -172,16 +192,16 @@ class DatacatalogFilesetEnricherTestCase(TestCase):
     @patch('datacatalog_fileset_enricher.gcs_storage_stats_summarizer.'
            'GCStorageStatsSummarizer.create_stats_from_dataframe')
     @patch('datacatalog_fileset_enricher.gcs_storage_filter.'
-           'StorageFilter.create_filtered_data_for_multiple_buckets')
+           'StorageFilter.create_filtered_data_for_file_regex_groups')
     @patch('datacatalog_fileset_enricher.gcs_storage_filter.'
-           'StorageFilter.create_filtered_data_for_single_bucket')
+           'StorageFilter.list_buckets_for_bucket_pattern')
     @patch('datacatalog_fileset_enricher.gcs_storage_filter.StorageFilter.parse_gcs_file_patterns')
     @patch('datacatalog_fileset_enricher.datacatalog_helper.DataCatalogHelper.get_entry')
     @patch('datacatalog_fileset_enricher.datacatalog_helper.'
            'DataCatalogHelper.get_manually_created_fileset_entries')
     def test_run_given_bucket_with_wildcard_and_multiple_gcs_patterns_should_call_retrieve_multiple_buckets(  # noqa: E501
         self, get_manually_created_fileset_entries, get_entry, parse_gcs_file_patterns,
-        create_filtered_data_for_single_bucket, create_filtered_data_for_multiple_buckets,
+        list_buckets_for_bucket_pattern, create_filtered_data_for_file_regex_groups,
         create_stats_from_dataframe, create_tag_from_stats):  # noqa:E125
 
         entry = self.__make_fake_fileset_entry()
@@ -198,10 +218,11 @@ class DatacatalogFilesetEnricherTestCase(TestCase):
             'file_regex': '.*csv'
         }]
 
-        dataframe = pd.DataFrame()
-        filtered_buckets_stats = {}
-        create_filtered_data_for_multiple_buckets.return_value = (dataframe,
-                                                                  filtered_buckets_stats)
+        bucket = MockedObject()
+        bucket.name = 'my_bucket'
+        list_buckets_for_bucket_pattern.return_value = [bucket]
+
+        create_filtered_data_for_file_regex_groups.return_value = [(pd.DataFrame(), 0)]
 
         stats = {}
         create_stats_from_dataframe.return_value = stats
@@ -212,8 +233,10 @@ class DatacatalogFilesetEnricherTestCase(TestCase):
         get_manually_created_fileset_entries.assert_not_called()
         get_entry.assert_called_once()
         parse_gcs_file_patterns.assert_called_once()
-        create_filtered_data_for_single_bucket.assert_not_called()
-        self.assertEqual(2, create_filtered_data_for_multiple_buckets.call_count)
+        self.assertEqual(2, list_buckets_for_bucket_pattern.call_count)
+        # The bucket matched by both patterns is listed once.
+        create_filtered_data_for_file_regex_groups.assert_called_once_with(
+            bucket, [['.*', '.*csv']])
         create_stats_from_dataframe.assert_called_once()
         create_tag_from_stats.assert_called_once()
 
@@ -222,44 +245,215 @@ class DatacatalogFilesetEnricherTestCase(TestCase):
     @patch('datacatalog_fileset_enricher.gcs_storage_stats_summarizer.'
            'GCStorageStatsSummarizer.create_stats_from_dataframe')
     @patch('datacatalog_fileset_enricher.gcs_storage_filter.'
-           'StorageFilter.create_filtered_data_for_multiple_buckets')
+           'StorageFilter.create_filtered_data_for_file_regex_groups')
     @patch('datacatalog_fileset_enricher.gcs_storage_filter.'
-           'StorageFilter.create_filtered_data_for_single_bucket')
-    @patch('datacatalog_fileset_enricher.gcs_storage_filter.StorageFilter.parse_gcs_file_patterns')
+           'StorageFilter.list_buckets_for_bucket_pattern')
+    @patch('datacatalog_fileset_enricher.gcs_storage_filter.StorageFilter.get_buckets')
     @patch('datacatalog_fileset_enricher.datacatalog_helper.DataCatalogHelper.get_entry')
     @patch('datacatalog_fileset_enricher.datacatalog_helper.'
            'DataCatalogHelper.get_manually_created_fileset_entries')
-    def test_run_given_no_entry_group_id_and_entry_id_should_enrich_multiple_entries(
-        self, get_manually_created_fileset_entries, get_entry, parse_gcs_file_patterns,
-        create_filtered_data_for_single_bucket, create_filtered_data_for_multiple_buckets,
+    def test_run_given_no_entry_group_id_and_entry_id_should_list_each_bucket_once(
+        self, get_manually_created_fileset_entries, get_entry, get_buckets,
+        list_buckets_for_bucket_pattern, create_filtered_data_for_file_regex_groups,
         create_stats_from_dataframe, create_tag_from_stats):  # noqa: E125
 
-        get_manually_created_fileset_entries.return_value = [('uscentral-1', 'entry_group_id',
-                                                              'entry_id')]
+        get_manually_created_fileset_entries.return_value = [
+            ('uscentral-1', 'entry_group_id', 'entry_id'),
+            ('uscentral-1', 'entry_group_id', 'entry_id_2'),
+        ]
 
-        get_entry.return_value = self.__make_fake_fileset_entry()
-
-        parse_gcs_file_patterns.return_value = [{'bucket_name': 'my_bucket*', 'file_regex': '.*'}]
+        entry = self.__make_fake_fileset_entry()
+        entry_2 = self.__make_fake_fileset_entry()
+        entry_2.gcs_fileset_spec.file_patterns[0] = 'gs://my_bucket*/a/*'
+        get_entry.side_effect = [entry, entry_2]
 
-        dataframe = pd.DataFrame()
-        filtered_buckets_stats = {}
-        create_filtered_data_for_multiple_buckets.return_value = (dataframe,
-                                                                  filtered_buckets_stats)
+        bucket = MockedObject()
+        bucket.name = 'my_bucket'
+        bucket_2 = MockedObject()
+        bucket_2.name = 'my_bucket_2'
+        list_buckets_for_bucket_pattern.return_value = [bucket, bucket_2]
+        # The literal bucket is resolved while the wildcard is being listed.
+        get_buckets.return_value = {'my_bucket': None}
 
-        stats = {}
-        create_stats_from_dataframe.return_value = stats
+        create_filtered_data_for_file_regex_groups.side_effect = \
+            lambda listed_bucket, file_regex_groups: [(None, 1) for _ in file_regex_groups]
 
         datacatalog_fileset_enricher = DatacatalogFilesetEnricher('test_project')
         datacatalog_fileset_enricher.run()
 
         get_manually_created_fileset_entries.assert_called_once()
-        get_entry.assert_called_once()
-        parse_gcs_file_patterns.assert_called_once()
-        create_filtered_data_for_single_bucket.assert_not_called()
-        create_filtered_data_for_multiple_buckets.assert_called_once()
+        self.assertEqual(2, get_entry.call_count)
+        get_buckets.assert_called_once_with(['my_bucket'])
+        self.assertEqual(2, create_filtered_data_for_file_regex_groups.call_count)
+        create_filtered_data_for_file_regex_groups.assert_any_call(bucket, [['.*'], ['a/.*']])
+        create_filtered_data_for_file_regex_groups.assert_any_call(bucket_2, [['a/.*']])
+        self.assertEqual(2, create_stats_from_dataframe.call_count)
+        self.assertEqual(2, create_tag_from_stats.call_count)
+
+        filtered_buckets_stats = create_stats_from_dataframe.call_args_list[1][0][2]
+        self.assertEqual([{
+            'bucket_name': 'my_bucket',
+            'files': 1
+        }, {
+            'bucket_name': 'my_bucket_2',
+            'files': 1
+        }], filtered_buckets_stats)
+
+    @patch('datacatalog_fileset_enricher.datacatalog_fileset_enricher.'
+           'DatacatalogFilesetEnricher.enrich_datacatalog_fileset_entry')
+    @patch(
+        'datacatalog_fileset_enricher.datacatalog_helper.DataCatalogHelper.get_last_enrichments')
+    @patch('datacatalog_fileset_enricher.datacatalog_helper.'
+           'DataCatalogHelper.get_manually_created_fileset_entries')
+    def test_run_with_scheduler_should_enrich_the_oldest_entries_first(
+        self, get_manually_created_fileset_entries, get_last_enrichments,
+        enrich_datacatalog_fileset_entry):  # noqa: E125
+
+        get_manually_created_fileset_entries.return_value = [
+            ('us-central1', 'entry_group_id', 'entry_id'),
+            ('us-central1', 'entry_group_id', 'entry_id_2'),
+            ('us-central1', 'entry_group_id', 'entry_id_3'),
+        ]
+        get_last_enrichments.return_value = [(datetime(2024, 1, 2), 10), None,
+                                             (datetime(2024, 1, 1), 10)]
+        enrich_datacatalog_fileset_entry.side_effect = [None, Exception('error'), None]
+
+        datacatalog_fileset_enricher = DatacatalogFilesetEnricher('test_project')
+        datacatalog_fileset_enricher.run(None, None, None, None, 'my_template',
+                                         EnrichmentScheduler())
+
+        get_last_enrichments.assert_called_once_with(
+            get_manually_created_fileset_entries.return_value, 'my_template')
+        # Errors enriching an Entry don't stop the run.
+        self.assertEqual(['entry_id_2', 'entry_id_3', 'entry_id'], [
+            call[0][2] for call in enrich_datacatalog_fileset_entry.call_args_list
+        ])
+        enrich_datacatalog_fileset_entry.assert_called_with('us-central1', 'entry_group_id',
+                                                            'entry_id', None, None,
+                                                            'my_template')
+
+    @patch(
+        'datacatalog_fileset_enricher.datacatalog_helper.DataCatalogHelper.create_tag_from_stats')
+    @patch('datacatalog_fileset_enricher.gcs_storage_stats_summarizer.'
+           'GCStorageStatsSummarizer.create_stats_from_dataframe')
+    @patch('datacatalog_fileset_enricher.gcs_storage_filter.'
+           'StorageFilter.create_filtered_data_for_file_regex_groups')
+    @patch('datacatalog_fileset_enricher.gcs_storage_filter.StorageFilter.get_buckets')
+    @patch('datacatalog_fileset_enricher.gcs_storage_filter.StorageFilter.parse_gcs_file_patterns')
+    @patch('datacatalog_fileset_enricher.datacatalog_helper.DataCatalogHelper.get_entry')
+    def test_run_given_literal_file_patterns_should_get_objects_grouped_by_bucket(
+        self, get_entry, parse_gcs_file_patterns, get_buckets,
+        create_filtered_data_for_file_regex_groups, create_stats_from_dataframe,
+        create_tag_from_stats):  # noqa: E125
+
+        get_entry.return_value = self.__make_fake_fileset_entry()
+
+        parse_gcs_file_patterns.return_value = [{
+            'bucket_name': 'my_bucket',
+            'file_regex': 'a.txt'
+        }, {
+            'bucket_name': 'my_bucket',
+            'file_regex': 'b.txt'
+        }, {
+            'bucket_name': 'my_bucket',
+            'file_regex': 'a.txt'
+        }, {
+            'bucket_name': 'my_other_bucket',
+            'file_regex': 'c.txt'
+        }]
+
+        get_buckets.side_effect = \
+            lambda bucket_names: {bucket_name: MockedObject() for bucket_name in bucket_names}
+        create_filtered_data_for_file_regex_groups.return_value = [(pd.DataFrame(), 0)]
+
+        datacatalog_fileset_enricher = DatacatalogFilesetEnricher('test_project')
+        datacatalog_fileset_enricher.run('entry_group_id', 'entry_id')
+
+        self.assertEqual(2, create_filtered_data_for_file_regex_groups.call_count)
+        self.assertEqual([[['a.txt', 'b.txt']], [['c.txt']]], [
+            call[0][1] for call in create_filtered_data_for_file_regex_groups.call_args_list
+        ])
         create_stats_from_dataframe.assert_called_once()
         create_tag_from_stats.assert_called_once()
 
+    @patch(
+        'datacatalog_fileset_enricher.datacatalog_helper.DataCatalogHelper.create_tag_from_stats')
+    @patch('datacatalog_fileset_enricher.gcs_storage_filter.'
+           'StorageFilter.create_filtered_data_for_file_regex_groups')
+    @patch('datacatalog_fileset_enricher.gcs_storage_filter.StorageFilter.get_buckets')
+    @patch('datacatalog_fileset_enricher.gcs_storage_filter.StorageFilter.parse_gcs_file_patterns')
+    @patch('datacatalog_fileset_enricher.datacatalog_helper.DataCatalogHelper.get_entry')
+    def test_run_with_memory_profiler_should_profile_entry_phases(
+        self, get_entry, parse_gcs_file_patterns, get_buckets,
+        create_filtered_data_for_file_regex_groups, create_tag_from_stats):  # noqa: E125
+
+        get_entry.return_value = self.__make_fake_fileset_entry()
+        parse_gcs_file_patterns.return_value = [{'bucket_name': 'my_bucket', 'file_regex': '.*'}]
+        get_buckets.return_value = {'my_bucket': MockedObject()}
+        create_filtered_data_for_file_regex_groups.return_value = [(pd.DataFrame({
+            'name': ['a.csv'],
+            'public_url': ['https://a.csv'],
+            'size': [100],
+            'time_created': [pd.Timestamp.utcnow()],
+            'time_updated': [pd.Timestamp.utcnow()],
+        }), 1)]
+
+        memory_profiler = MemoryProfiler()
+        memory_profiler.start()
+        try:
+            datacatalog_fileset_enricher = DatacatalogFilesetEnricher(
+                'test_project', None, None, None, None, None, False, None, memory_profiler)
+            datacatalog_fileset_enricher.run('entry_group_id', 'entry_id')
+        finally:
+            memory_profiler.stop()
+
+        memory_profile = memory_profiler.profiles[0]
+        self.assertEqual('us-central1/entry_group_id/entry_id', memory_profile.name)
+        self.assertEqual(1, memory_profile.matched_objects)
+        self.assertEqual({'listing', 'stats', 'tag'}, set(memory_profile.peaks))
+        create_tag_from_stats.assert_called_once()
+
+    @patch(
+        'datacatalog_fileset_enricher.datacatalog_helper.DataCatalogHelper.create_tag_from_stats')
+    @patch('datacatalog_fileset_enricher.gcs_storage_filter.'
+           'StorageFilter.create_filtered_data_for_file_regex_groups')
+    @patch('datacatalog_fileset_enricher.gcs_storage_filter.StorageFilter.get_buckets')
+    @patch('datacatalog_fileset_enricher.gcs_storage_filter.StorageFilter.parse_gcs_file_patterns')
+    @patch('datacatalog_fileset_enricher.datacatalog_helper.DataCatalogHelper.get_entry')
+    @patch('datacatalog_fileset_enricher.datacatalog_helper.'
+           'DataCatalogHelper.get_manually_created_fileset_entries')
+    def test_run_with_memory_profiler_should_profile_each_entry_listing(
+        self, get_manually_created_fileset_entries, get_entry, parse_gcs_file_patterns,
+        get_buckets, create_filtered_data_for_file_regex_groups,
+        create_tag_from_stats):  # noqa: E125
+
+        get_manually_created_fileset_entries.return_value = [
+            ('us-central1', 'entry_group_id', 'entry_id'),
+            ('us-central1', 'entry_group_id', 'entry_id_2'),
+        ]
+        get_entry.return_value = self.__make_fake_fileset_entry()
+        parse_gcs_file_patterns.return_value = [{'bucket_name': 'my_bucket', 'file_regex': '.*'}]
+        get_buckets.return_value = {'my_bucket': MockedObject()}
+        create_filtered_data_for_file_regex_groups.return_value = [(None, 0)]
+
+        memory_profiler = MemoryProfiler()
+        memory_profiler.start()
+        try:
+            datacatalog_fileset_enricher = DatacatalogFilesetEnricher(
+                'test_project', None, None, None, None, None, False, None, memory_profiler)
+            datacatalog_fileset_enricher.run()
+        finally:
+            memory_profiler.stop()
+
+        # The shared bucket is listed for each Entry, so each one gets its listing peak.
+        self.assertEqual(
+            ['us-central1/entry_group_id/entry_id', 'us-central1/entry_group_id/entry_id_2'],
+            [memory_profile.name for memory_profile in memory_profiler.profiles])
+        self.assertTrue(
+            all('listing' in memory_profile.peaks for memory_profile in memory_profiler.profiles))
+        self.assertEqual(2, create_filtered_data_for_file_regex_groups.call_count)
+        self.assertEqual(2, create_tag_from_stats.call_count)
+
     @classmethod
     def __make_fake_fileset_entry(cls):
         entry = datacatalog_v1.types.Entry()
@@ -269,3 +463,78 @@ class DatacatalogFilesetEnricherTestCase(TestCase):
         entry.type = datacatalog_v1.enums.EntryType.FILESET
 
         return entry
+
+
+@patch('google.cloud.storage.Client.__init__', lambda self, **kargs: None)
+@patch('google.cloud.datacatalog_v1.DataCatalogClient.__init__', lambda self, *args: None)
+class DatacatalogFilesetEnricherApiCallsTestCase(TestCase):
+    __ENTRY_NAME = 'projects/test_project/locations/us-central1/entryGroups/entry_group_id' \
+                   '/entries/entry_id'
+
+    @patch('google.cloud.datacatalog_v1.DataCatalogClient.create_tag')
+    @patch('google.cloud.datacatalog_v1.DataCatalogClient.list_tags')
+    @patch('google.cloud.datacatalog_v1.DataCatalogClient.get_tag_template')
+    @patch('google.cloud.datacatalog_v1.DataCatalogClient.get_entry')
+    @patch('google.cloud.storage.Client.list_blobs')
+    @patch('google.cloud.storage.Client.get_bucket')
+    def test_enrich_single_bucket_entry_should_stay_within_its_api_call_budget(
+        self, get_bucket, list_blobs, get_entry, get_tag_template, list_tags,
+        create_tag):  # noqa: E125
+
+        entry = datacatalog_v1.types.Entry()
+        entry.name = self.__ENTRY_NAME
+        entry.gcs_fileset_spec.file_patterns.append('gs://my_bucket/*')
+        get_entry.return_value = entry
+        list_tags.return_value = []
+        create_tag.return_value = MagicMock()
+
+        bucket = MockedObject()
+        bucket.name = 'my_bucket'
+        get_bucket.return_value = bucket
+
+        results_iterator = MockedObject()
+        results_iterator.pages = [[self.__make_blob('a.csv')], [self.__make_blob('b.csv')]]
+        results_iterator.next_page_token = None
+        results_iterator.extra_params = {}
+        list_blobs.return_value = results_iterator
+
+        datacatalog_fileset_enricher = DatacatalogFilesetEnricher('test_project')
+        datacatalog_fileset_enricher.run('entry_group_id', 'entry_id')
+
+        api_call_counter = datacatalog_fileset_enricher.api_call_counter
+        budget = {
+            'storage.get_bucket': 1,
+            'storage.list_blobs': 1,
+            'datacatalog.get_entry': 1,
+            'datacatalog.get_tag_template': 1,
+            'datacatalog.list_tags': 1,
+            'datacatalog.create_tag': 1
+        }
+        api_call_counter.assert_within_budget(budget, self.__ENTRY_NAME)
+        self.assertEqual(set(budget), set(api_call_counter.get_entry_totals(self.__ENTRY_NAME)))
+        # The pages are listed in the background, and still counted for the Entry.
+        self.assertEqual(2, api_call_counter.get_entry_totals(
+            self.__ENTRY_NAME)['storage.list_blobs']['pages'])
+        self.assertGreater(api_call_counter.totals['datacatalog.get_entry']['bytes'], 0)
+        create_tag.assert_called_once()
+
+    @classmethod
+    def __make_blob(cls, name):
+        blob = MockedObject()
+        blob.name = name
+        blob.public_url = f'https://{name}'
+        blob.size = 100
+        blob._properties = {
+            'timeCreated': '2020-01-01T10:30:15.123Z',
+            'updated': '2020-01-02T10:30:15.123Z'
+        }
+        return blob
+
+
+class MockedObject(object):
+
+    def __setitem__(self, key, value):
+        self.__dict__[key] = value
+
+    def __getitem__(self, key):
+        return self.__dict__[key]
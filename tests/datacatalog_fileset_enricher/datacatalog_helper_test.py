@@ -1,5 +1,6 @@
+from datetime import datetime
 from unittest import TestCase
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
 import pandas as pd
 
@@ -7,7 +8,9 @@ from google.cloud import datacatalog_v1
 from google.api_core.exceptions import PermissionDenied
 from google.protobuf.json_format import MessageToDict
 
+from datacatalog_fileset_enricher.api_call_counter import ApiCallCounter
 from datacatalog_fileset_enricher.datacatalog_helper import DataCatalogHelper
+from datacatalog_fileset_enricher.tag_digest_store import TagDigestStore
 
 
 @patch('google.cloud.datacatalog_v1.DataCatalogClient.__init__', lambda self, *args: None)
@@ -44,6 +47,95 @@ class DatacatalogHelperTestCase(TestCase):
 
         get_entry.assert_called_once()
 
+    @patch('google.cloud.datacatalog_v1.DataCatalogClient.list_tags')
+    @patch('google.cloud.datacatalog_v1.DataCatalogClient.get_entry')
+    def test_api_calls_should_be_counted_with_their_message_bytes(self, get_entry, list_tags):
+        entry = datacatalog_v1.types.Entry()
+        entry.name = 'projects/test_project/locations/uscentral-1/entryGroups/g/entries/e'
+        get_entry.return_value = entry
+        tags = MagicMock()
+        tags.__iter__.return_value = iter([self.__make_fake_tag(), self.__make_fake_tag()])
+        tags.page_number = 2
+        list_tags.return_value = tags
+
+        api_call_counter = ApiCallCounter()
+        datacatalog_helper = DataCatalogHelper('test_project', None, None, api_call_counter)
+        with api_call_counter.entry(entry.name):
+            datacatalog_helper.get_entry('uscentral-1', 'g', 'e')
+            datacatalog_helper.get_last_enrichments([('uscentral-1', 'g', 'e')])
+
+        self.assertEqual({'calls': 1, 'pages': 0, 'bytes': entry.ByteSize()},
+                         api_call_counter.totals['datacatalog.get_entry'])
+        self.assertEqual({
+            'calls': 1,
+            'pages': 2,
+            'bytes': self.__make_fake_tag().ByteSize() * 2
+        }, api_call_counter.totals['datacatalog.list_tags'])
+        # The Tags are read by a worker thread, so they are only counted for the run.
+        self.assertEqual(['datacatalog.get_entry'],
+                         list(api_call_counter.get_entry_totals(entry.name)))
+
+    @patch('google.cloud.datacatalog_v1.DataCatalogClient.list_tags')
+    def test_get_last_enrichments_should_read_the_fileset_enricher_tags(self, list_tags):
+        datacatalog_helper = DataCatalogHelper('test_project')
+        template = datacatalog_helper.get_tag_template_name()
+
+        enricher_tag = datacatalog_v1.types.Tag()
+        enricher_tag.template = template
+        enricher_tag.fields['execution_time'].timestamp_value.FromJsonString(
+            '2024-01-02T03:00:00Z')
+        enricher_tag.fields['files'].double_value = 42
+        no_files_tag = datacatalog_v1.types.Tag()
+        no_files_tag.template = template
+        no_files_tag.fields['execution_time'].timestamp_value.FromJsonString(
+            '2024-01-01T00:00:00Z')
+
+        tags_by_entry = {
+            'entry_1': [self.__make_fake_tag(), enricher_tag],
+            'entry_2': [self.__make_fake_tag()],
+            'entry_3': [no_files_tag],
+        }
+
+        def fake_list_tags(parent, retry):
+            if parent.endswith('entry_4'):
+                raise PermissionDenied('Permission denied')
+            return tags_by_entry[parent.split('/')[-1]]
+
+        list_tags.side_effect = fake_list_tags
+
+        last_enrichments = datacatalog_helper.get_last_enrichments([
+            ('us-central1', 'entry_group', 'entry_1'),
+            ('us-central1', 'entry_group', 'entry_2'),
+            ('us-central1', 'entry_group', 'entry_3'),
+            ('us-central1', 'entry_group', 'entry_4'),
+        ])
+
+        self.assertEqual([(datetime(2024, 1, 2, 3), 42), None, (datetime(2024, 1, 1), None), None],
+                         last_enrichments)
+        self.assertEqual(4, list_tags.call_count)
+
+    @patch('time.time', lambda: 1704164400)
+    @patch('google.cloud.datacatalog_v1.DataCatalogClient.list_tags')
+    def test_get_last_enrichments_with_digest_store_should_only_read_unrecorded_entries(
+            self, list_tags):
+        tag_digest_store = TagDigestStore(':memory:')
+        datacatalog_helper = DataCatalogHelper('test_project', None, tag_digest_store)
+        template = datacatalog_helper.get_tag_template_name()
+        tag_digest_store.save_enrichment(
+            'projects/test_project/locations/us-central1/entryGroups/entry_group/entries/entry_1',
+            template, 42)
+
+        list_tags.return_value = []
+
+        last_enrichments = datacatalog_helper.get_last_enrichments([
+            ('us-central1', 'entry_group', 'entry_1'),
+            ('us-central1', 'entry_group', 'entry_2'),
+        ])
+
+        self.assertEqual([(datetime(2024, 1, 2, 3), 42), None], last_enrichments)
+        list_tags.assert_called_once()
+        self.assertIn('entries/entry_2', str(list_tags.call_args))
+
     @patch('google.cloud.datacatalog_v1.DataCatalogClient.search_catalog')
     def test_get_manually_created_fileset_entries_should_return_successfully(self, search_catalog):
         datacatalog_helper = DataCatalogHelper('test_project')
@@ -375,6 +467,56 @@ class DatacatalogHelperTestCase(TestCase):
         list_tags.assert_called_once()
         create_tag.assert_called_once()
 
+    @patch('google.cloud.datacatalog_v1.DataCatalogClient.get_tag_template')
+    @patch('google.cloud.datacatalog_v1.DataCatalogClient.create_tag')
+    @patch('google.cloud.datacatalog_v1.DataCatalogClient.list_tags')
+    def test_create_tag_from_stats_with_unchanged_digest_should_skip_tags_sync(
+        self, list_tags, create_tag, get_tag_template):  # noqa
+
+        list_tags.return_value = []
+        datacatalog_helper = DataCatalogHelper('test_project', None, TagDigestStore(':memory:'))
+        entry = MockedObject()
+        entry.name = 'fileset_entry'
+        stats = self.__create_full_stats_obj()
+
+        datacatalog_helper.create_tag_from_stats(entry, stats)
+        # Only the execution time changes, so the Tags are neither read nor written.
+        datacatalog_helper.create_tag_from_stats(
+            entry, dict(stats, execution_time=pd.Timestamp('2030-01-01', tz='UTC')))
+
+        list_tags.assert_called_once()
+        create_tag.assert_called_once()
+
+        datacatalog_helper.create_tag_from_stats(entry, dict(stats, count=11))
+
+        self.assertEqual(2, list_tags.call_count)
+        self.assertEqual(2, create_tag.call_count)
+
+    @patch('time.time')
+    @patch('google.cloud.datacatalog_v1.DataCatalogClient.get_tag_template')
+    @patch('google.cloud.datacatalog_v1.DataCatalogClient.create_tag')
+    @patch('google.cloud.datacatalog_v1.DataCatalogClient.list_tags')
+    def test_create_tag_from_stats_with_unchanged_digest_should_record_the_enrichment(
+        self, list_tags, create_tag, get_tag_template, current_time):  # noqa
+
+        list_tags.return_value = []
+        tag_digest_store = TagDigestStore(':memory:')
+        datacatalog_helper = DataCatalogHelper('test_project', None, tag_digest_store)
+        template = datacatalog_helper.get_tag_template_name()
+        entry = MockedObject()
+        entry.name = 'fileset_entry'
+        stats = self.__create_full_stats_obj()
+
+        current_time.return_value = 1704067200
+        datacatalog_helper.create_tag_from_stats(entry, stats)
+        current_time.return_value = 1704164400
+        datacatalog_helper.create_tag_from_stats(entry, stats)
+
+        # The second Tag is skipped, but the Entry still counts as enriched by it.
+        create_tag.assert_called_once()
+        self.assertEqual({'fileset_entry': (datetime(2024, 1, 2, 3), 10)},
+                         tag_digest_store.get_last_enrichments(['fileset_entry'], template))
+
     @patch('google.cloud.datacatalog_v1.DataCatalogClient.search_catalog')
     @patch('google.cloud.datacatalog_v1.DataCatalogClient.delete_entry')
     @patch('google.cloud.datacatalog_v1.DataCatalogClient.delete_entry_group')
@@ -460,6 +602,61 @@ class DatacatalogHelperTestCase(TestCase):
         self.assertEqual(3, delete_entry.call_count)
         self.assertEqual(2, delete_entry_group.call_count)
 
+    @patch('google.cloud.datacatalog_v1.DataCatalogClient.search_catalog')
+    @patch('google.cloud.datacatalog_v1.DataCatalogClient.delete_entry')
+    @patch('google.cloud.datacatalog_v1.DataCatalogClient.delete_entry_group')
+    def test_delete_entries_and_entry_groups_should_retry_and_skip_system_entry_groups(
+        self, delete_entry_group, delete_entry, search_catalog):  # noqa
+
+        datacatalog_helper = DataCatalogHelper('test_project')
+        entry = MockedObject()
+        entry.relative_resource_name = 'entry_group/entries/entry_id'
+
+        system_entry = MockedObject()
+        system_entry.relative_resource_name = 'entry_groups/@bigquery/entries/entry_id'
+
+        system_entry_group_entry = MockedObject()
+        system_entry_group_entry.relative_resource_name = '@pubsub/entries/entry_id'
+
+        search_catalog.return_value = iter([entry, system_entry, system_entry_group_entry])
+
+        deleted_count = datacatalog_helper.delete_entries_and_entry_groups(workers=2)
+
+        self.assertEqual((1, 1), deleted_count)
+        delete_entry.assert_called_once()
+        self.assertIsNotNone(delete_entry.call_args[1]['retry'])
+        delete_entry_group.assert_called_once()
+        self.assertEqual('entry_group', delete_entry_group.call_args[0][0])
+
+    @patch('google.cloud.datacatalog_v1.DataCatalogClient.search_catalog')
+    @patch('google.cloud.datacatalog_v1.DataCatalogClient.delete_entry')
+    @patch('google.cloud.datacatalog_v1.DataCatalogClient.delete_entry_group')
+    def test_delete_entries_and_entry_groups_dry_run_should_not_delete_them(
+        self, delete_entry_group, delete_entry, search_catalog):  # noqa
+
+        datacatalog_helper = DataCatalogHelper('test_project')
+        entry = MockedObject()
+        entry.relative_resource_name = 'entry_group/entries/entry_id'
+
+        entry_2 = MockedObject()
+        entry_2.relative_resource_name = 'entry_group_2/entries/entry_id_2'
+
+        search_catalog.return_value = [entry, entry_2]
+
+        deleted_count = datacatalog_helper.delete_entries_and_entry_groups(dry_run=True)
+
+        self.assertEqual((2, 2), deleted_count)
+        delete_entry.assert_not_called()
+        delete_entry_group.assert_not_called()
+
+    @patch('google.cloud.datacatalog_v1.DataCatalogClient.delete_tag_template')
+    def test_delete_tag_template_dry_run_should_not_delete_it(self, delete_tag_template):
+        datacatalog_helper = DataCatalogHelper('test_project')
+
+        datacatalog_helper.delete_tag_template(dry_run=True)
+
+        delete_tag_template.assert_not_called()
+
     @patch('google.cloud.datacatalog_v1.DataCatalogClient.update_tag')
     @patch('google.cloud.datacatalog_v1.DataCatalogClient.create_tag')
     @patch('google.cloud.datacatalog_v1.DataCatalogClient.list_tags')
@@ -479,7 +676,28 @@ class DatacatalogHelperTestCase(TestCase):
         datacatalog_helper.synchronize_entry_tags(entry, [updated_tag])
 
         create_tag.assert_not_called()
-        update_tag.assert_called_once()
+        # The unchanged fields are sent too, so they are kept.
+        update_tag.assert_called_once_with(tag=updated_tag, update_mask=None)
+
+    @patch('google.cloud.datacatalog_v1.DataCatalogClient.update_tag')
+    @patch('google.cloud.datacatalog_v1.DataCatalogClient.list_tags')
+    def test_synchronize_entries_tags_with_removed_fields_should_update_all_fields(
+        self, list_tags, update_tag):  # noqa
+
+        updated_tag = self.__make_fake_tag()
+        del updated_tag.fields['test-enum-field']
+        current_tag = self.__make_fake_tag()
+        current_tag.fields['test-double-field'].double_value = 2
+
+        list_tags.return_value = [current_tag]
+
+        datacatalog_helper = DataCatalogHelper('test_project')
+        entry = MockedObject()
+        entry.name = 'fileset_entry'
+
+        datacatalog_helper.synchronize_entry_tags(entry, [updated_tag])
+
+        update_tag.assert_called_once_with(tag=updated_tag, update_mask=None)
 
     @patch('google.cloud.datacatalog_v1.DataCatalogClient.update_tag')
     @patch('google.cloud.datacatalog_v1.DataCatalogClient.create_tag')
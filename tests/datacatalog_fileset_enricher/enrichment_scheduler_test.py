@@ -0,0 +1,73 @@
+from datetime import datetime
+from unittest import TestCase
+from unittest.mock import patch
+
+from datacatalog_fileset_enricher.enrichment_scheduler import EnrichmentScheduler
+
+
+class EnrichmentSchedulerTestCase(TestCase):
+
+    def test_order_by_staleness_should_put_never_enriched_and_oldest_entries_first(self):
+        entries = ['entry_1', 'entry_2', 'entry_3', 'entry_4']
+        last_enrichments = [
+            (datetime(2024, 1, 3), 10),
+            None,
+            (datetime(2024, 1, 1), 20),
+            (datetime(2024, 1, 3), None),
+        ]
+
+        self.assertEqual([('entry_2', None), ('entry_3', 20), ('entry_1', 10), ('entry_4', None)],
+                         EnrichmentScheduler.order_by_staleness(entries, last_enrichments))
+
+    def test_schedule_without_time_budget_should_yield_all_entries(self):
+        scheduler = EnrichmentScheduler()
+
+        self.assertIsNone(scheduler.time_left)
+        self.assertEqual(['entry_2', 'entry_1'],
+                         list(scheduler.schedule(['entry_1', 'entry_2'],
+                                                 [(datetime(2024, 1, 2), 1), None])))
+
+    @patch('time.monotonic')
+    def test_schedule_should_stop_once_the_time_budget_is_spent(self, monotonic):
+        monotonic.return_value = 0
+        scheduler = EnrichmentScheduler(100)
+
+        scheduled_entries = scheduler.schedule(['entry_1', 'entry_2', 'entry_3'],
+                                               [None, None, None])
+        self.assertEqual('entry_1', next(scheduled_entries))
+        monotonic.return_value = 60
+        self.assertEqual('entry_2', next(scheduled_entries))
+        # The entry in flight when the deadline passes is finished, but no other is started.
+        monotonic.return_value = 120
+        self.assertEqual([], list(scheduled_entries))
+        self.assertEqual(0, scheduler.time_left)
+
+    @patch('time.monotonic')
+    def test_schedule_with_size_cost_should_defer_entries_not_finishing_in_time(self, monotonic):
+        monotonic.return_value = 0
+        scheduler = EnrichmentScheduler(100, size_cost=True)
+
+        entries = ['big', 'small', 'bigger', 'tiny']
+        last_enrichments = [
+            (datetime(2024, 1, 1), 1000),
+            (datetime(2024, 1, 2), 100),
+            (datetime(2024, 1, 3), 10000),
+            (datetime(2024, 1, 4), 10),
+        ]
+
+        enriched_entries = []
+        for entry in scheduler.schedule(entries, last_enrichments):
+            enriched_entries.append(entry)
+            # Enriching takes 0.05 seconds per file.
+            monotonic.return_value += last_enrichments[entries.index(entry)][1] * 0.05
+
+        self.assertEqual(['big', 'small', 'tiny'], enriched_entries)
+
+    @patch('time.monotonic')
+    def test_schedule_with_size_cost_should_never_defer_the_first_entry(self, monotonic):
+        monotonic.return_value = 0
+        scheduler = EnrichmentScheduler(10, size_cost=True)
+
+        scheduled_entries = scheduler.schedule(['huge'], [(datetime(2024, 1, 1), 1000000)])
+
+        self.assertEqual(['huge'], list(scheduled_entries))
@@ -0,0 +1,59 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+from datacatalog_fileset_enricher.gcs_blob_name_matcher import BlobNameMatcher, match_names
+
+
+class BlobNameMatcherTestCase(TestCase):
+
+    def test_match_names_should_return_matched_indexes_by_file_regex(self):
+        matches = match_names(['a/.*', '.*.csv'], ['a/1.csv', 'b/2.csv', 'a/3.txt', 'a'])
+        self.assertEqual([[0, 2], [0, 1]], matches)
+
+    def test_match_blobs_pages_in_main_process_should_match_each_page(self):
+        blobs_pages = [[MockedBlob('a/1.csv'), MockedBlob('b/2.csv')], [MockedBlob('a/3.txt')]]
+
+        name_matcher = BlobNameMatcher()
+        results = list(name_matcher.match_blobs_pages(['a/.*'], blobs_pages))
+
+        self.assertEqual(1, name_matcher.processes)
+        self.assertEqual([(blobs_pages[0], [[0]]), (blobs_pages[1], [[0]])], results)
+
+    @patch('os.cpu_count', lambda: 4)
+    def test_match_blobs_pages_with_processes_should_match_the_same_blobs(self):
+        blobs_pages = [[MockedBlob(f'folder_{i % 3}/file_{i}.csv') for i in range(page, page + 7)]
+                       for page in range(0, 70, 7)]
+
+        name_matcher = BlobNameMatcher(2)
+        try:
+            matched_names = [
+                blobs[blob_index].name
+                for blobs, matches in name_matcher.match_blobs_pages(['folder_1/.*'], blobs_pages)
+                for blob_index in matches[0]
+            ]
+        finally:
+            name_matcher.close()
+
+        self.assertEqual(2, name_matcher.processes)
+        self.assertEqual([f'folder_1/file_{i}.csv' for i in range(70) if i % 3 == 1],
+                         matched_names)
+
+    @patch('os.cpu_count', lambda: 1)
+    def test_match_blobs_pages_with_processes_on_a_single_core_should_match_in_main_process(
+            self):
+        blobs_pages = [[MockedBlob('a/1.csv'), MockedBlob('b/2.csv')]]
+
+        with BlobNameMatcher(4) as name_matcher:
+            results = list(name_matcher.match_blobs_pages(['a/.*'], blobs_pages))
+
+        self.assertEqual(1, name_matcher.processes)
+        self.assertEqual([(blobs_pages[0], [[0]])], results)
+
+
+class MockedBlob(object):
+
+    def __init__(self, name):
+        self.name = name
+
+    def __eq__(self, other):
+        return self.name == other.name
@@ -1,8 +1,16 @@
+import json
+import re
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest import TestCase
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
+from urllib.parse import urlparse
 
 from google.api_core import exceptions
+from google.auth.credentials import AnonymousCredentials
 
+from datacatalog_fileset_enricher.api_call_counter import ApiCallCounter
 from datacatalog_fileset_enricher.gcs_storage_client_helper import StorageClientHelper
 
 
@@ -10,23 +18,135 @@ from datacatalog_fileset_enricher.gcs_storage_client_helper import StorageClient
 class StorageClientHelperTestCase(TestCase):
 
     @patch('google.cloud.storage.Client.get_bucket')
-    def test_get_bucket_should_return_bucket(self, get_bucket):
+    def test_get_buckets_should_return_bucket(self, get_bucket):
 
         storage_client = StorageClientHelper('test_project')
-        bucket = storage_client.get_bucket('my_bucket')
+        bucket = storage_client.get_buckets(['my_bucket'])['my_bucket']
         self.assertIsNotNone(bucket)
         get_bucket.assert_called_once()
 
+    @patch('google.cloud.storage.Client.get_bucket', autospec=True)
+    def test_get_buckets_should_share_the_client_between_threads(self, get_bucket):
+        storage_client = StorageClientHelper('test_project', 'credentials')
+
+        storage_client.get_buckets(['my_bucket'])
+        thread = threading.Thread(target=storage_client.get_buckets, args=(['my_bucket_2'], ))
+        thread.start()
+        thread.join()
+
+        clients = [call[0][0] for call in get_bucket.call_args_list]
+        self.assertIs(clients[0], clients[1])
+
+    @patch('google.cloud.storage.Client.list_blobs', autospec=True)
+    def test_iterate_blobs_pages_with_prefetch_should_share_the_client(self, list_blobs):
+        list_blobs.return_value.pages = [['blob']]
+        storage_client = StorageClientHelper('test_project', 'credentials', 1)
+
+        # Each listing is prefetched by a new thread.
+        for prefix in ['a/', 'b/', 'c/', 'd/', 'e/']:
+            self.assertEqual([['blob']], list(storage_client.iterate_blobs_pages('bucket',
+                                                                                 prefix)))
+
+        clients = {id(call[0][0]) for call in list_blobs.call_args_list}
+        self.assertEqual(5, list_blobs.call_count)
+        self.assertEqual(1, len(clients))
+
     @patch('google.cloud.storage.Client.get_bucket')
-    def test_get_bucket_on_exception_should_not_leak_error(self, get_bucket):
+    def test_get_buckets_on_exception_should_not_leak_error(self, get_bucket):
 
         get_bucket.side_effect = exceptions.NotFound('error on retrieving bucket')
 
         storage_client = StorageClientHelper('test_project')
-        bucket = storage_client.get_bucket('my_bucket')
+        bucket = storage_client.get_buckets(['my_bucket'])['my_bucket']
         self.assertIsNone(bucket)
         get_bucket.assert_called_once()
 
+    @patch('google.cloud.storage.Client.get_bucket')
+    def test_get_buckets_should_cache_found_and_not_found_buckets(self, get_bucket):
+        bucket = MockedObject()
+
+        def get_existing_bucket(name):
+            if name != 'my_bucket':
+                raise exceptions.Forbidden('error on retrieving bucket')
+            return bucket
+
+        get_bucket.side_effect = get_existing_bucket
+
+        storage_client = StorageClientHelper('test_project')
+        for _ in range(2):
+            self.assertEqual({
+                'my_bucket': bucket,
+                'forbidden_bucket': None
+            }, storage_client.get_buckets(['my_bucket', 'forbidden_bucket']))
+
+        self.assertEqual(2, get_bucket.call_count)
+
+    @patch('google.cloud.storage.Client.get_bucket')
+    def test_clear_cache_should_request_buckets_again(self, get_bucket):
+        storage_client = StorageClientHelper('test_project')
+        storage_client.get_buckets(['my_bucket'])
+        storage_client.clear_cache()
+        storage_client.get_buckets(['my_bucket'])
+
+        self.assertEqual(2, get_bucket.call_count)
+
+    @patch('google.cloud.storage.Client.get_bucket')
+    def test_get_buckets_should_request_the_uncached_buckets_concurrently(self, get_bucket):
+        barrier = threading.Barrier(3, timeout=5)
+
+        def get_bucket_concurrently(name):
+            # Fails with a BrokenBarrierError unless the three buckets are requested at once.
+            barrier.wait()
+            if name == 'missing_bucket':
+                raise exceptions.NotFound('error on retrieving bucket')
+            bucket = MockedObject()
+            bucket.name = name
+            return bucket
+
+        get_bucket.side_effect = get_bucket_concurrently
+
+        storage_client = StorageClientHelper('test_project')
+        buckets = storage_client.get_buckets(
+            ['my_bucket', 'missing_bucket', 'my_bucket', 'my_bucket_2'])
+        cached_buckets = storage_client.get_buckets(['missing_bucket', 'my_bucket_2'])
+
+        self.assertEqual(['my_bucket', 'missing_bucket', 'my_bucket_2'], list(buckets))
+        self.assertEqual('my_bucket', buckets['my_bucket'].name)
+        self.assertIsNone(buckets['missing_bucket'])
+        self.assertEqual({
+            'missing_bucket': None,
+            'my_bucket_2': buckets['my_bucket_2']
+        }, cached_buckets)
+        self.assertEqual(3, get_bucket.call_count)
+
+    @patch('google.cloud.storage.Client.get_bucket')
+    def test_get_buckets_should_count_the_calls_for_the_caller_entry(self, get_bucket):
+        api_call_counter = ApiCallCounter()
+        storage_client = StorageClientHelper('test_project', None, 1, None, api_call_counter)
+
+        with api_call_counter.entry('entry_1'):
+            storage_client.get_buckets(['my_bucket', 'my_bucket_2', 'my_bucket'])
+            storage_client.get_buckets(['my_bucket'])
+
+        self.assertEqual({'calls': 2, 'pages': 0, 'bytes': 0},
+                         api_call_counter.get_entry_totals('entry_1')['storage.get_bucket'])
+        api_call_counter.assert_within_budget({'storage.get_bucket': 2})
+
+    @patch('google.cloud.storage.Client.get_bucket')
+    @patch('google.cloud.storage.Client.list_buckets')
+    def test_get_buckets_listed_before_should_not_request_them(self, list_buckets, get_bucket):
+        bucket = MockedObject()
+        bucket.name = 'my_bucket'
+        results_iterator = MockedObject()
+        results_iterator.pages = [[bucket]]
+        list_buckets.return_value = results_iterator
+
+        storage_client = StorageClientHelper('test_project')
+        storage_client.list_buckets('my_')
+
+        self.assertIs(bucket, storage_client.get_buckets(['my_bucket'])['my_bucket'])
+        get_bucket.assert_not_called()
+
     @patch('google.cloud.storage.Client.list_buckets')
     def test_list_buckets_should_return_buckets(self, list_buckets):
 
@@ -40,11 +160,31 @@ class StorageClientHelperTestCase(TestCase):
         self.assertIsNotNone(buckets)
         list_buckets.assert_called_once()
 
+    @patch('google.cloud.storage.Client.list_buckets')
+    def test_list_buckets_covered_by_cached_prefix_should_filter_locally(self, list_buckets):
+        bucket = MockedObject()
+        bucket.name = 'sales-eu-1'
+        bucket_2 = MockedObject()
+        bucket_2.name = 'sales-us-1'
+
+        results_iterator = MockedObject()
+        results_iterator.pages = [[bucket, bucket_2]]
+
+        list_buckets.return_value = results_iterator
+
+        storage_client = StorageClientHelper('test_project')
+        storage_client.list_buckets('sales')
+        buckets = storage_client.list_buckets('sales-eu')
+
+        self.assertEqual([bucket], buckets)
+        list_buckets.assert_called_once()
+
     @patch('google.cloud.storage.Client.list_blobs')
     def test_list_blobs_should_return_blobs(self, list_blobs):
 
         results_iterator = MockedObject()
         results_iterator.pages = [{}]
+        results_iterator.next_page_token = None
 
         list_blobs.return_value = results_iterator
 
@@ -53,6 +193,318 @@ class StorageClientHelperTestCase(TestCase):
         self.assertIsNotNone(buckets)
         list_blobs.assert_called_once()
 
+    @patch('google.cloud.storage.Client.list_blobs')
+    def test_iterate_blobs_pages_should_prefetch_pages_in_the_background(self, list_blobs):
+        listing_threads = []
+
+        def iterate_pages():
+            for page in range(3):
+                listing_threads.append(threading.current_thread())
+                yield [f'blob_{page}']
+
+        results_iterator = MockedObject()
+        results_iterator.pages = iterate_pages()
+        results_iterator.next_page_token = None
+        list_blobs.return_value = results_iterator
+
+        storage_client = StorageClientHelper('test_project', None, 2, 500)
+        blobs_pages = list(storage_client.iterate_blobs_pages('my_bucket', 'a/'))
+
+        self.assertEqual([['blob_0'], ['blob_1'], ['blob_2']], blobs_pages)
+        self.assertNotIn(threading.current_thread(), listing_threads)
+        list_blobs.assert_called_once_with('my_bucket', prefix='a/', page_size=500,
+                                           page_token=None)
+
+    @patch('google.cloud.storage.Client.list_blobs')
+    def test_iterate_blobs_pages_without_prefetch_should_list_in_the_calling_thread(
+            self, list_blobs):
+        listing_threads = []
+
+        def iterate_pages():
+            listing_threads.append(threading.current_thread())
+            yield ['blob_0']
+
+        results_iterator = MockedObject()
+        results_iterator.pages = iterate_pages()
+        results_iterator.next_page_token = None
+        list_blobs.return_value = results_iterator
+
+        storage_client = StorageClientHelper('test_project', None, 0)
+        blobs_pages = list(storage_client.iterate_blobs_pages('my_bucket'))
+
+        self.assertEqual([['blob_0']], blobs_pages)
+        self.assertEqual([threading.current_thread()], listing_threads)
+
+    @patch('time.sleep')
+    @patch('google.cloud.storage.Client.list_blobs')
+    def test_iterate_blobs_pages_on_transient_errors_should_resume_from_the_last_page(
+            self, list_blobs, sleep):
+        listing_pages = {None: ['blob_0'], 'token_1': ['blob_1'], 'token_2': ['blob_2']}
+        next_page_tokens = {None: 'token_1', 'token_1': 'token_2', 'token_2': None}
+        failures = {
+            'token_1': exceptions.ServiceUnavailable('503'),
+            'token_2': exceptions.InternalServerError('500')
+        }
+
+        def fake_list_blobs(bucket, prefix, page_size, page_token):
+            results_iterator = MockedObject()
+            results_iterator.extra_params = {}
+
+            def iterate_pages():
+                token = page_token
+                while True:
+                    # Each page but the first one fails once.
+                    if token in failures:
+                        raise failures.pop(token)
+                    results_iterator.next_page_token = next_page_tokens[token]
+                    yield listing_pages[token]
+                    token = next_page_tokens[token]
+                    if not token:
+                        return
+
+            results_iterator.pages = iterate_pages()
+            return results_iterator
+
+        list_blobs.side_effect = fake_list_blobs
+
+        storage_client = StorageClientHelper('test_project', None, 0)
+        blobs_pages = list(storage_client.iterate_blobs_pages('my_bucket', 'a/', 'a/**'))
+
+        self.assertEqual([['blob_0'], ['blob_1'], ['blob_2']], blobs_pages)
+        self.assertEqual([None, 'token_1', 'token_2'],
+                         [call[1]['page_token'] for call in list_blobs.call_args_list])
+        self.assertEqual([2.0, 2.0], [call[0][0] for call in sleep.call_args_list])
+
+    @patch('time.sleep')
+    @patch('google.cloud.storage.Client.list_blobs')
+    def test_iterate_blobs_pages_past_max_retries_should_raise_the_error(self, list_blobs, sleep):
+
+        def iterate_pages():
+            raise exceptions.ServiceUnavailable('503')
+            yield
+
+        def fake_list_blobs(bucket, prefix, page_size, page_token):
+            results_iterator = MockedObject()
+            results_iterator.pages = iterate_pages()
+            return results_iterator
+
+        list_blobs.side_effect = fake_list_blobs
+
+        storage_client = StorageClientHelper('test_project', None, 0)
+
+        self.assertRaises(exceptions.ServiceUnavailable, list,
+                          storage_client.iterate_blobs_pages('my_bucket'))
+        self.assertEqual(6, list_blobs.call_count)
+        self.assertEqual([2.0, 4.0, 8.0, 16.0, 32.0],
+                         [call[0][0] for call in sleep.call_args_list])
+
+    @patch('google.cloud.storage.Client.list_blobs')
+    def test_iterate_blobs_pages_on_non_transient_error_should_not_retry(self, list_blobs):
+
+        def iterate_pages():
+            raise exceptions.Forbidden('403')
+            yield
+
+        results_iterator = MockedObject()
+        results_iterator.pages = iterate_pages()
+        list_blobs.return_value = results_iterator
+
+        storage_client = StorageClientHelper('test_project', None, 0)
+
+        self.assertRaises(exceptions.Forbidden, list,
+                          storage_client.iterate_blobs_pages('my_bucket'))
+        list_blobs.assert_called_once()
+
+    @patch('google.cloud.storage.Client.list_blobs')
+    def test_list_blobs_with_match_glob_should_set_match_glob_query_parameter(self, list_blobs):
+        results_iterator = MockedObject()
+        results_iterator.pages = [[]]
+        results_iterator.next_page_token = None
+        results_iterator.extra_params = {'projection': 'noAcl'}
+
+        list_blobs.return_value = results_iterator
+
+        storage_client = StorageClientHelper('test_project')
+        storage_client.list_blobs('my_bucket', 'a/', 'a/**csv')
+
+        list_blobs.assert_called_once_with('my_bucket', prefix='a/', page_size=None,
+                                           page_token=None)
+        self.assertEqual({
+            'projection': 'noAcl',
+            'matchGlob': 'a/**csv'
+        }, results_iterator.extra_params)
+
+    @patch('google.cloud.storage.Client.list_blobs')
+    def test_list_prefixes_should_return_directories_under_prefix(self, list_blobs):
+        page = MockedObject()
+        page.prefixes = {'a/c/', 'a/b/'}
+        page_2 = MockedObject()
+        page_2.prefixes = {'a/d/'}
+
+        results_iterator = MockedObject()
+        results_iterator.pages = [page, page_2]
+
+        list_blobs.return_value = results_iterator
+
+        storage_client = StorageClientHelper('test_project')
+        prefixes = storage_client.list_prefixes('my_bucket', 'a/')
+
+        self.assertEqual(['a/b/', 'a/c/', 'a/d/'], prefixes)
+        list_blobs.assert_called_once_with('my_bucket', prefix='a/', delimiter='/')
+
+    def test_get_blobs_single_name_should_use_get_blob(self):
+        bucket = MagicMock()
+
+        storage_client = StorageClientHelper('test_project')
+        blobs = storage_client.get_blobs(bucket, ['a.txt'])
+
+        self.assertEqual(1, len(blobs))
+        bucket.get_blob.assert_called_once_with('a.txt')
+        bucket.blob.assert_not_called()
+
+    def test_get_blobs_single_missing_name_should_return_empty_list(self):
+        bucket = MagicMock()
+        bucket.get_blob.return_value = None
+
+        storage_client = StorageClientHelper('test_project')
+        blobs = storage_client.get_blobs(bucket, ['a.txt'])
+
+        self.assertEqual([], blobs)
+
+    def test_get_blobs_multiple_names_should_batch_requests(self):
+        bucket = MagicMock()
+
+        storage_client = StorageClientHelper('test_project')
+        blobs = storage_client.get_blobs(bucket, [f'file_{i}.txt' for i in range(150)])
+
+        self.assertEqual(150, len(blobs))
+        self.assertEqual(2, bucket.client.batch.call_count)
+        self.assertEqual(150, bucket.blob.call_count)
+        bucket.get_blob.assert_not_called()
+
+    def test_get_blobs_with_missing_names_should_return_found_blobs(self):
+
+        found_blob = MockedObject()
+        found_blob.generation = 1
+        found_blob.reload = lambda: None
+
+        missing_blob = MagicMock()
+        type(missing_blob).generation = property(lambda self: {}['generation'])
+
+        bucket = MagicMock()
+        bucket.blob.side_effect = [found_blob, missing_blob]
+        bucket.client.batch.return_value.__exit__.side_effect = exceptions.NotFound(
+            'missing object')
+
+        storage_client = StorageClientHelper('test_project')
+        blobs = storage_client.get_blobs(bucket, ['a.txt', 'b.txt'])
+
+        self.assertEqual([found_blob], blobs)
+
+    def test_get_blobs_with_forbidden_names_should_return_readable_blobs(self):
+
+        readable_blob = MockedObject()
+        readable_blob.generation = 1
+        readable_blob.reload = lambda: None
+
+        forbidden_blob = MagicMock()
+        type(forbidden_blob).generation = property(lambda self: {}['generation'])
+
+        bucket = MagicMock()
+        bucket.blob.side_effect = [readable_blob, forbidden_blob]
+        bucket.client.batch.return_value.__exit__.side_effect = exceptions.Forbidden(
+            'forbidden object')
+
+        storage_client = StorageClientHelper('test_project')
+        blobs = storage_client.get_blobs(bucket, ['a.txt', 'b.txt'])
+
+        self.assertEqual([readable_blob], blobs)
+
+
+class StorageClientHelperFakeServerTestCase(TestCase):
+
+    def setUp(self):
+        self.__server = FakeStorageServer('my_bucket', ['a.txt', 'b.txt'])
+        threading.Thread(target=self.__server.serve_forever, daemon=True).start()
+        emulator_host = patch.dict(
+            'os.environ',
+            {'STORAGE_EMULATOR_HOST': f'http://localhost:{self.__server.server_address[1]}'})
+        emulator_host.start()
+        self.addCleanup(emulator_host.stop)
+
+    def tearDown(self):
+        self.__server.shutdown()
+        self.__server.server_close()
+
+    def test_get_blobs_from_bucket_resolved_by_another_thread_should_batch_requests(self):
+        storage_client = StorageClientHelper('test_project', AnonymousCredentials())
+
+        # The bucket is resolved by a pool thread, with real storage clients.
+        bucket = storage_client.get_buckets(['my_bucket'])['my_bucket']
+        blobs = storage_client.get_blobs(bucket, ['a.txt', 'b.txt', 'c.txt'])
+
+        self.assertEqual(['a.txt', 'b.txt'], [blob.name for blob in blobs])
+        self.assertEqual([('GET', '/storage/v1/b/my_bucket'), ('POST', '/batch/storage/v1')],
+                         self.__server.requests)
+
+
+class FakeStorageServer(ThreadingHTTPServer):
+    """Local fake of the GCS JSON API bucket and object GETs, batched or not."""
+
+    def __init__(self, bucket_name, object_names):
+        super().__init__(('localhost', 0), FakeStorageHandler)
+        self.bucket_name = bucket_name
+        self.object_names = object_names
+        self.requests = []
+
+
+class FakeStorageHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        self.server.requests.append(('GET', path))
+        status, body = self.__get(path)
+        self.__send(status, 'application/json', json.dumps(body))
+
+    def do_POST(self):
+        self.server.requests.append(('POST', urlparse(self.path).path))
+        batch_body = self.rfile.read(int(self.headers['Content-Length'])).decode()
+        # Each batched request is answered by a part of the multipart response.
+        parts = []
+        for url in re.findall(r'^GET (\S+) HTTP/1.1', batch_body, re.MULTILINE):
+            status, body = self.__get(urlparse(url).path)
+            parts.append(f'--batch\r\nContent-Type: application/http\r\n\r\n'
+                         f'HTTP/1.1 {status} {"OK" if status == 200 else "Not Found"}\r\n'
+                         f'Content-Type: application/json\r\n\r\n{json.dumps(body)}\r\n')
+        self.__send(200, 'multipart/mixed; boundary=batch', ''.join(parts) + '--batch--\r\n')
+
+    def log_message(self, *args):
+        pass
+
+    def __get(self, path):
+        bucket_path = f'/storage/v1/b/{self.server.bucket_name}'
+        object_name = path[len(bucket_path) + 3:] if path.startswith(f'{bucket_path}/o/') \
+            else None
+        if path == bucket_path:
+            return 200, {'kind': 'storage#bucket', 'name': self.server.bucket_name}
+        if object_name in self.server.object_names:
+            return 200, {
+                'kind': 'storage#object',
+                'bucket': self.server.bucket_name,
+                'name': object_name,
+                'generation': '1',
+                'size': '10'
+            }
+        return 404, {'error': {'code': 404, 'message': 'Not Found'}}
+
+    def __send(self, status, content_type, body):
+        payload = body.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
 
 class MockedObject(object):
 
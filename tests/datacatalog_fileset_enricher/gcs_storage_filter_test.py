@@ -4,6 +4,8 @@ from unittest import TestCase
 from unittest.mock import patch
 
 from datacatalog_fileset_enricher.gcs_storage_filter import StorageFilter
+from datacatalog_fileset_enricher.gcs_storage_stats_backend import BlobsColumns, SpilledBlobs
+from datacatalog_fileset_enricher.memory_profiler import MemoryProfiler
 
 
 @patch('datacatalog_fileset_enricher.gcs_storage_client_helper.StorageClientHelper.__init__',
@@ -12,12 +14,8 @@ class StorageFilterTestCase(TestCase):
 
     @patch(
         'datacatalog_fileset_enricher.gcs_storage_client_helper.StorageClientHelper.list_buckets')
-    @patch('datacatalog_fileset_enricher.gcs_storage_client_helper.StorageClientHelper.list_blobs')
-    @patch('datacatalog_fileset_enricher.gcs_storage_client_helper.StorageClientHelper.get_bucket')
-    def test_create_filtered_data_for_multiple_buckets_with_a_matching_bucket_should_create_filtered_data(  # noqa: E501
-        self, get_bucket, list_blobs, list_buckets):  # noqa:E125
-        execution_time = pd.Timestamp.utcnow()
-
+    def test_list_buckets_for_bucket_pattern_should_return_the_matching_buckets(
+            self, list_buckets):
         bucket = MockedObject()
         bucket.name = 'my_bucket'
 
@@ -29,46 +27,45 @@ class StorageFilterTestCase(TestCase):
 
         list_buckets.return_value = [bucket, bucket_2, bucket_3]
 
-        blob = MockedObject()
-        blob.name = 'my_file'
-        blob.public_url = 'https://my_file'
-        blob.size = 100000
-        blob.time_created = execution_time
-        blob.updated = execution_time
+        storage_filter = StorageFilter('test_project')
+        buckets = storage_filter.list_buckets_for_bucket_pattern('my_bucket.*')
 
-        blob_2 = MockedObject()
-        blob_2.name = 'my_file_2'
-        blob_2.public_url = 'https://my_file_2'
-        blob_2.size = 50000
-        blob_2.time_created = execution_time
-        blob_2.updated = execution_time
+        self.assertEqual([bucket, bucket_2], buckets)
+        list_buckets.assert_called_once_with('my_bucket')
 
-        blobs = [blob, blob_2]
+    @patch(
+        'datacatalog_fileset_enricher.gcs_storage_client_helper.StorageClientHelper.list_buckets')
+    def test_list_buckets_for_bucket_pattern_should_list_buckets_by_pattern_prefix(
+        self, list_buckets):  # noqa:E125
 
-        list_blobs.return_value = blobs
+        list_buckets.return_value = []
 
         storage_filter = StorageFilter('test_project')
-        dataframe, filtered_buckets_stats = storage_filter.\
-            create_filtered_data_for_multiple_buckets(
-                'my_bucket.*', '.*')
+        storage_filter.list_buckets_for_bucket_pattern('sales-eu-.*')
+        storage_filter.list_buckets_for_bucket_pattern('sales-eu-.*', 'sales')
+        storage_filter.list_buckets_for_bucket_pattern('sales-.*', 'sales-eu')
+        storage_filter.list_buckets_for_bucket_pattern('.*-eu')
 
-        self.assertEqual(4, len(dataframe))
-
-        bucket_stats = filtered_buckets_stats[0]
-        self.assertEqual('my_bucket', bucket_stats['bucket_name'])
-        self.assertEqual(2, bucket_stats['files'])
-        self.assertEqual(None, bucket_stats.get('bucket_not_found'))
-
-        get_bucket.assert_not_called()
-        self.assertEqual(2, list_blobs.call_count)
-        list_buckets.assert_called_once()
+        self.assertEqual('sales-eu-', list_buckets.call_args_list[0][0][0])
+        self.assertEqual('sales-eu-', list_buckets.call_args_list[1][0][0])
+        self.assertEqual('sales-eu', list_buckets.call_args_list[2][0][0])
+        self.assertEqual(None, list_buckets.call_args_list[3][0][0])
 
     @patch(
         'datacatalog_fileset_enricher.gcs_storage_client_helper.StorageClientHelper.list_buckets')
-    @patch('datacatalog_fileset_enricher.gcs_storage_client_helper.StorageClientHelper.list_blobs')
-    @patch('datacatalog_fileset_enricher.gcs_storage_client_helper.StorageClientHelper.get_bucket')
-    def test_create_filtered_data_for_single_bucket_with_a_existent_bucket_should_create_filtered_data(  # noqa: E501
-        self, get_bucket, list_blobs, list_buckets):  # noqa:E125
+    def test_list_buckets_for_bucket_pattern_with_conflicting_prefix_should_not_list(
+        self, list_buckets):  # noqa:E125
+
+        storage_filter = StorageFilter('test_project')
+        buckets = storage_filter.list_buckets_for_bucket_pattern('sales-eu-.*', 'marketing')
+
+        self.assertEqual([], buckets)
+        list_buckets.assert_not_called()
+
+    @patch('datacatalog_fileset_enricher.gcs_storage_client_helper.StorageClientHelper.'
+           'iterate_blobs_pages')
+    def test_create_filtered_data_for_file_regex_groups_should_create_filtered_data(
+        self, iterate_blobs_pages):  # noqa:E125
 
         execution_time = pd.Timestamp.utcnow()
 
@@ -88,59 +85,431 @@ class StorageFilterTestCase(TestCase):
 
         blobs = [blob, blob_2]
 
-        list_blobs.return_value = blobs
+        iterate_blobs_pages.return_value = [blobs]
+
+        bucket = MockedObject()
+        bucket.name = 'my_bucket'
 
         storage_filter = StorageFilter('test_project')
-        dataframe, filtered_buckets_stats = storage_filter.create_filtered_data_for_single_bucket(
-            'my_bucket', '.*')
+        [(dataframe, files)] = storage_filter.create_filtered_data_for_file_regex_groups(
+            bucket, [['.*']])
 
         self.assertEqual(2, len(dataframe))
+        self.assertEqual(2, files)
 
         first_row = dataframe.loc[0]
 
         self.assertEqual(first_row['name'], blob.name)
         self.assertEqual(first_row['public_url'], blob.public_url)
-        self.assertEqual(first_row['time_created'], blob.time_created)
-        self.assertEqual(first_row['time_updated'], blob.updated)
+        # Timestamps are stored as microseconds since the epoch.
+        self.assertEqual(first_row['time_created'], blob.time_created.value // 1000)
+        self.assertEqual(first_row['time_updated'], blob.updated.value // 1000)
 
         second_row = dataframe.loc[1]
 
         self.assertEqual(second_row['name'], blob_2.name)
         self.assertEqual(second_row['public_url'], blob_2.public_url)
-        self.assertEqual(second_row['time_created'], blob_2.time_created)
-        self.assertEqual(second_row['time_updated'], blob_2.updated)
+        # Timestamps are stored as microseconds since the epoch.
+        self.assertEqual(second_row['time_created'], blob_2.time_created.value // 1000)
+        self.assertEqual(second_row['time_updated'], blob_2.updated.value // 1000)
 
-        bucket_stats = filtered_buckets_stats[0]
-        self.assertEqual('my_bucket', bucket_stats['bucket_name'])
-        self.assertEqual(2, bucket_stats['files'])
-        self.assertEqual(None, bucket_stats.get('bucket_not_found'))
+        iterate_blobs_pages.assert_called_once()
 
-        get_bucket.assert_called_once()
-        list_blobs.assert_called_once()
-        list_buckets.assert_not_called()
+    @patch('datacatalog_fileset_enricher.gcs_storage_client_helper.StorageClientHelper.get_blobs')
+    @patch('datacatalog_fileset_enricher.gcs_storage_client_helper.StorageClientHelper.list_blobs')
+    def test_create_filtered_data_for_file_regex_groups_given_literal_files_should_not_list_blobs(
+        self, list_blobs, get_blobs):  # noqa:E125
+
+        execution_time = pd.Timestamp.utcnow()
+
+        blob = MockedObject()
+        blob.name = 'a.txt'
+        blob.public_url = 'https://a.txt'
+        blob.size = 100000
+        blob.time_created = execution_time
+        blob.updated = execution_time
+
+        get_blobs.return_value = [blob]
+
+        bucket = MockedObject()
+        bucket.name = 'my_bucket'
+
+        storage_filter = StorageFilter('test_project')
+        [(dataframe, files)] = storage_filter.create_filtered_data_for_file_regex_groups(
+            bucket, [['a.txt', 'b.txt']])
+
+        self.assertEqual(1, len(dataframe))
+        self.assertEqual(1, files)
+        # All the objects are requested at once.
+        get_blobs.assert_called_once_with(bucket, ['a.txt', 'b.txt'])
+        list_blobs.assert_not_called()
+
+    @patch('datacatalog_fileset_enricher.gcs_storage_client_helper.StorageClientHelper.'
+           'iterate_blobs_pages')
+    def test_create_filtered_data_with_python_stats_backend_should_create_columns(
+        self, iterate_blobs_pages):  # noqa:E125
+
+        execution_time = pd.Timestamp.utcnow()
+
+        blob = MockedObject()
+        blob.name = 'my_file'
+        blob.public_url = 'https://my_file'
+        blob.size = 100000
+        blob.time_created = execution_time
+        blob.updated = execution_time
+
+        iterate_blobs_pages.return_value = [[blob]]
+
+        bucket = MockedObject()
+        bucket.name = 'my_bucket'
+
+        storage_filter = StorageFilter('test_project', 'python')
+        [(columns, _)] = storage_filter.create_filtered_data_for_file_regex_groups(
+            bucket, [['.*']])
+
+        self.assertIsInstance(columns, BlobsColumns)
+        self.assertEqual(['my_file'], columns.name)
+        self.assertEqual([100000], list(columns.size))
+
+    @patch('datacatalog_fileset_enricher.gcs_storage_client_helper.StorageClientHelper.'
+           'iterate_blobs_pages')
+    def test_create_filtered_data_past_max_rows_in_memory_should_spill_to_disk(
+        self, iterate_blobs_pages):  # noqa:E125
+
+        execution_time = pd.Timestamp.utcnow()
+
+        blobs = []
+        for file_name in ['a.csv', 'b.csv', 'c.txt', 'd.csv', 'e.txt']:
+            blob = MockedObject()
+            blob.name = file_name
+            blob.public_url = f'https://{file_name}'
+            blob.size = 100000
+            blob.time_created = execution_time
+            blob.updated = execution_time
+            blobs.append(blob)
+
+        iterate_blobs_pages.return_value = iter([blobs[:3], blobs[3:]])
+
+        bucket = MockedObject()
+        bucket.name = 'my_bucket'
+
+        storage_filter = StorageFilter('test_project', 'python', max_rows_in_memory=2)
+        [(spilled_blobs, files)] = storage_filter.create_filtered_data_for_file_regex_groups(
+            bucket, [['.*csv']])
+
+        self.assertIsInstance(spilled_blobs, SpilledBlobs)
+        self.assertEqual(3, len(spilled_blobs))
+        self.assertEqual(3, files)
+        spilled_blobs.close()
 
     @patch(
-        'datacatalog_fileset_enricher.gcs_storage_client_helper.StorageClientHelper.list_buckets')
+        'datacatalog_fileset_enricher.gcs_storage_client_helper.StorageClientHelper.list_prefixes')
+    def test_find_listing_prefixes_with_segment_wildcards_should_list_matching_directories(
+            self, list_prefixes):
+        directories = {
+            '': ['a/', 'z/'],
+            'a/': ['a/2020/', 'a/2021/', 'a/tmp/'],
+            'a/2020/b/': ['a/2020/b/x/'],
+            'a/2021/b/': ['a/2021/b/y/'],
+        }
+        list_prefixes.side_effect = lambda bucket, prefix: directories.get(prefix, [])
+
+        storage_filter = StorageFilter('test_project')
+        file_regex = storage_filter.convert_str_to_usable_regex('a/20*/b/*/part-*.parquet', True)
+        prefixes = storage_filter.find_listing_prefixes('my_bucket', file_regex)
+
+        self.assertEqual(['a/2020/b/x/part-', 'a/2021/b/y/part-'], prefixes)
+        self.assertEqual(3, list_prefixes.call_count)
+
+    @patch(
+        'datacatalog_fileset_enricher.gcs_storage_client_helper.StorageClientHelper.list_prefixes')
+    def test_find_listing_prefixes_with_wildcard_crossing_directories_should_use_literal_prefix(
+            self, list_prefixes):
+        storage_filter = StorageFilter('test_project')
+        prefixes = storage_filter.find_listing_prefixes('my_bucket', 'a/.*/b/.*.parquet')
+
+        self.assertEqual(['a/'], prefixes)
+        list_prefixes.assert_not_called()
+
+    @patch(
+        'datacatalog_fileset_enricher.gcs_storage_client_helper.StorageClientHelper.list_prefixes')
+    def test_find_listing_prefixes_with_regex_metacharacters_should_stop_the_prefix_before_them(
+            self, list_prefixes):
+        list_prefixes.side_effect = lambda bucket, prefix: {
+            'logs/': ['logs/day0/', 'logs/day4/', 'logs/dayx/']
+        }.get(prefix, [])
+
+        storage_filter = StorageFilter('test_project')
+
+        self.assertEqual(['logs/day'],
+                         storage_filter.find_listing_prefixes('my_bucket', 'logs/day[0-3].*.log'))
+        self.assertEqual(['logs/fil'],
+                         storage_filter.find_listing_prefixes('my_bucket', 'logs/file?.txt'))
+        self.assertEqual([''], storage_filter.find_listing_prefixes('my_bucket', 'a.csv|b/c.csv'))
+        list_prefixes.assert_not_called()
+        # Segments with metacharacters are matched against the listed directories.
+        self.assertEqual(['logs/day0/app'],
+                         storage_filter.find_listing_prefixes('my_bucket',
+                                                              'logs/day[0-3]/app.*'))
+
+    @patch(
+        'datacatalog_fileset_enricher.gcs_storage_client_helper.StorageClientHelper.list_prefixes')
+    def test_find_listing_prefixes_with_segments_matching_slashes_should_use_literal_prefix(
+            self, list_prefixes):
+        storage_filter = StorageFilter('test_project')
+
+        # Slashes inside groups don't separate directories.
+        self.assertEqual(['logs/'],
+                         storage_filter.find_listing_prefixes('my_bucket', 'logs/(a/b)/c.csv'))
+        # A negated class, unless it excludes the slash, may cross directories.
+        self.assertEqual(['logs/a'],
+                         storage_filter.find_listing_prefixes('my_bucket', 'logs/a[^x]b/c.csv'))
+        self.assertEqual(['logs/a'],
+                         storage_filter.find_listing_prefixes('my_bucket', 'logs/a\\D/c.csv'))
+        list_prefixes.assert_not_called()
+
+    @patch(
+        'datacatalog_fileset_enricher.gcs_storage_client_helper.StorageClientHelper.list_prefixes')
+    def test_find_listing_prefixes_with_segments_excluding_slashes_should_list_directories(
+            self, list_prefixes):
+        list_prefixes.side_effect = lambda bucket, prefix: {
+            'logs/': ['logs/ab/', 'logs/a1/', 'logs/ax/']
+        }.get(prefix, [])
+
+        storage_filter = StorageFilter('test_project')
+
+        self.assertEqual(['logs/ab/c', 'logs/ax/c'],
+                         storage_filter.find_listing_prefixes('my_bucket', 'logs/a[^/\\d]/c.*'))
+        self.assertEqual(['logs/a1/c'],
+                         storage_filter.find_listing_prefixes('my_bucket', 'logs/(a\\d)/c.*'))
+
+    def test_get_literal_prefix_should_stop_at_the_first_regex_metacharacter(self):
+        self.assertEqual('a/b.csv', StorageFilter.get_literal_prefix('a/b.csv'))
+        self.assertEqual('a/', StorageFilter.get_literal_prefix('a/[^/]*.csv'))
+        self.assertEqual('a/', StorageFilter.get_literal_prefix('a/(b|c).csv'))
+        self.assertEqual('a/b', StorageFilter.get_literal_prefix('a/b+.csv'))
+        self.assertEqual('a/', StorageFilter.get_literal_prefix('a/b{0,2}.csv'))
+        self.assertEqual('', StorageFilter.get_literal_prefix('a/(b)|c.csv'))
+        self.assertEqual('a/b', StorageFilter.get_literal_prefix('a/b[|].csv'))
+        self.assertEqual('a/b', StorageFilter.get_literal_prefix('a/b\\|c.csv'))
+
     @patch('datacatalog_fileset_enricher.gcs_storage_client_helper.StorageClientHelper.list_blobs')
-    @patch('datacatalog_fileset_enricher.gcs_storage_client_helper.StorageClientHelper.get_bucket')
-    def test_create_filtered_data_for_single_bucket_with_nonexistent_bucket_should_create_filtered_data(  # noqa: E501
-        self, get_bucket, list_blobs, list_buckets):  # noqa:E125
+    @patch(
+        'datacatalog_fileset_enricher.gcs_storage_client_helper.StorageClientHelper.list_prefixes')
+    def test_create_filtered_data_with_segment_wildcards_should_list_matching_directories_only(
+            self, list_prefixes, list_blobs):
+        execution_time = pd.Timestamp.utcnow()
+
+        bucket = MockedObject()
+        bucket.name = 'my_bucket'
+
+        list_prefixes.return_value = ['logs/eu/', 'logs/us/']
 
-        get_bucket.return_value = None
+        def list_blobs_by_prefix(listed_bucket, prefix, match_glob):
+            blob = MockedObject()
+            blob.name = f'{prefix}app.log'
+            blob.public_url = f'https://{prefix}app.log'
+            blob.size = 100
+            blob.time_created = execution_time
+            blob.updated = execution_time
+            return [blob]
+
+        list_blobs.side_effect = list_blobs_by_prefix
 
         storage_filter = StorageFilter('test_project')
-        dataframe, filtered_buckets_stats = storage_filter.create_filtered_data_for_single_bucket(
-            'my_bucket', '.*')
+        file_regex = storage_filter.convert_str_to_usable_regex('logs/*/*.log', True)
+        [(dataframe, _)] = storage_filter.create_filtered_data_for_file_regex_groups(
+            bucket, [[file_regex]])
 
-        self.assertEqual(None, dataframe)
+        self.assertEqual(['logs/eu/app.log', 'logs/us/app.log'], sorted(dataframe['name']))
+        list_prefixes.assert_called_once_with(bucket, 'logs/')
+        self.assertEqual({('logs/eu/', 'logs/*/**log'), ('logs/us/', 'logs/*/**log')},
+                         {call[0][1:] for call in list_blobs.call_args_list})
 
-        bucket_stats = filtered_buckets_stats[0]
-        self.assertEqual('my_bucket', bucket_stats['bucket_name'])
-        self.assertEqual(0, bucket_stats['files'])
-        self.assertEqual(True, bucket_stats['bucket_not_found'])
-        get_bucket.assert_called_once()
-        list_blobs.assert_not_called()
-        list_buckets.assert_not_called()
+    @patch('datacatalog_fileset_enricher.gcs_storage_client_helper.StorageClientHelper.list_blobs')
+    def test_create_filtered_data_for_file_regex_groups_should_route_blobs_from_a_single_listing(
+            self, list_blobs):
+        execution_time = pd.Timestamp.utcnow()
+
+        blobs = []
+        for name in ['a/1.csv', 'a/b/2.csv', 'a/b/3.txt']:
+            blob = MockedObject()
+            blob.name = name
+            blob.public_url = f'https://{name}'
+            blob.size = 100
+            blob.time_created = execution_time
+            blob.updated = execution_time
+            blobs.append(blob)
+
+        list_blobs.side_effect = lambda listed_bucket, prefix, match_glob: [
+            blob for blob in blobs if blob.name.startswith(prefix)
+        ]
+
+        bucket = MockedObject()
+        bucket.name = 'my_bucket'
+
+        storage_filter = StorageFilter('test_project')
+        filtered_data = storage_filter.create_filtered_data_for_file_regex_groups(
+            bucket, [['a/.*.csv'], ['a/b/.*'], ['c/.*']])
+
+        self.assertEqual(['a/1.csv', 'a/b/2.csv'], list(filtered_data[0][0]['name']))
+        self.assertEqual(['a/b/2.csv', 'a/b/3.txt'], list(filtered_data[1][0]['name']))
+        self.assertEqual((None, 0), filtered_data[2])
+        # A single glob can't cover several file regexes.
+        self.assertEqual({('a/', None), ('c/', None)},
+                         {call[0][1:] for call in list_blobs.call_args_list})
+
+    @patch('datacatalog_fileset_enricher.gcs_storage_client_helper.'
+           'StorageClientHelper.iterate_blobs_pages')
+    def test_create_filtered_data_for_file_regex_groups_should_take_overlapping_matches_once(
+            self, iterate_blobs_pages):
+        execution_time = pd.Timestamp.utcnow()
+
+        blobs = []
+        for name in ['logs/2023-12.log', 'logs/2024-01.log', 'logs/2024-02.log', 'tmp/1.log']:
+            blob = MockedObject()
+            blob.name = name
+            blob.public_url = f'https://{name}'
+            blob.size = 100
+            blob.time_created = execution_time
+            blob.updated = execution_time
+            blobs.append(blob)
+
+        # Overlapping matches are merged across pages too.
+        iterate_blobs_pages.side_effect = lambda listed_bucket, prefix, match_glob: [
+            [blob for blob in blobs[:2] if blob.name.startswith(prefix)],
+            [blob for blob in blobs[2:] if blob.name.startswith(prefix)],
+        ]
+
+        bucket = MockedObject()
+        bucket.name = 'my_bucket'
+
+        storage_filter = StorageFilter('test_project')
+        filtered_data = storage_filter.create_filtered_data_for_file_regex_groups(
+            bucket, [['logs/.*', 'logs/2024.*', 'logs/.*'], ['logs/2024.*']])
+
+        dataframe, files = filtered_data[0]
+        self.assertEqual(['logs/2023-12.log', 'logs/2024-01.log', 'logs/2024-02.log'],
+                         list(dataframe['name']))
+        self.assertEqual(3, files)
+        self.assertEqual(['logs/2024-01.log', 'logs/2024-02.log'],
+                         list(filtered_data[1][0]['name']))
+        # The covered prefix is not listed again.
+        iterate_blobs_pages.assert_called_once_with(bucket, 'logs/', None)
+
+    @patch('datacatalog_fileset_enricher.gcs_storage_client_helper.StorageClientHelper.get_blobs')
+    def test_create_filtered_data_for_file_regex_groups_given_literal_names_should_get_them_once(
+            self, get_blobs):
+        execution_time = pd.Timestamp.utcnow()
+
+        blob = MockedObject()
+        blob.name = 'a.txt'
+        blob.public_url = 'https://a.txt'
+        blob.size = 100
+        blob.time_created = execution_time
+        blob.updated = execution_time
+        get_blobs.return_value = [blob]
+
+        bucket = MockedObject()
+        bucket.name = 'my_bucket'
+
+        storage_filter = StorageFilter('test_project')
+        filtered_data = storage_filter.create_filtered_data_for_file_regex_groups(
+            bucket, [['a.txt', 'a.txt', 'b.txt'], ['b.txt']])
+
+        get_blobs.assert_called_once_with(bucket, ['a.txt', 'b.txt'])
+        self.assertEqual(['a.txt'], list(filtered_data[0][0]['name']))
+        self.assertEqual(1, filtered_data[0][1])
+        self.assertEqual((None, 0), filtered_data[1])
+
+    @patch('datacatalog_fileset_enricher.gcs_storage_client_helper.'
+           'StorageClientHelper.iterate_blobs_pages')
+    @patch('datacatalog_fileset_enricher.gcs_storage_client_helper.StorageClientHelper.get_blobs')
+    def test_create_filtered_data_for_file_regex_groups_given_regex_names_should_list_them(
+            self, get_blobs, iterate_blobs_pages):
+        execution_time = pd.Timestamp.utcnow()
+
+        blobs = []
+        for name in ['data1.csv', 'data2.csv', 'datax.csv', 'file.txt', 'fil.txt']:
+            blob = MockedObject()
+            blob.name = name
+            blob.public_url = f'https://{name}'
+            blob.size = 100
+            blob.time_created = execution_time
+            blob.updated = execution_time
+            blobs.append(blob)
+        iterate_blobs_pages.side_effect = lambda listed_bucket, prefix, match_glob: [blobs]
+
+        bucket = MockedObject()
+        bucket.name = 'my_bucket'
+
+        storage_filter = StorageFilter('test_project')
+        bracket_data = storage_filter.create_filtered_data_for_file_regex_groups(
+            bucket, [['data[0-9].csv']])
+        question_mark_data = storage_filter.create_filtered_data_for_file_regex_groups(
+            bucket, [['file?.txt']])
+
+        self.assertEqual(['data1.csv', 'data2.csv'], list(bracket_data[0][0]['name']))
+        self.assertEqual(['file.txt', 'fil.txt'], list(question_mark_data[0][0]['name']))
+        get_blobs.assert_not_called()
+
+    @patch('datacatalog_fileset_enricher.gcs_storage_client_helper.'
+           'StorageClientHelper.iterate_blobs_pages')
+    def test_create_filtered_data_while_profiling_should_record_the_dataframe_phase(
+            self, iterate_blobs_pages):
+        execution_time = pd.Timestamp.utcnow()
+
+        blob = MockedObject()
+        blob.name = 'a/1.csv'
+        blob.public_url = 'https://a/1.csv'
+        blob.size = 100
+        blob.time_created = execution_time
+        blob.updated = execution_time
+        iterate_blobs_pages.return_value = [[blob]]
+
+        bucket = MockedObject()
+        bucket.name = 'my_bucket'
+
+        storage_filter = StorageFilter('test_project')
+        memory_profiler = MemoryProfiler()
+        memory_profiler.start()
+        try:
+            with memory_profiler.profile('entry') as memory_profile:
+                storage_filter.create_filtered_data_for_file_regex_groups(bucket, [['a/.*']])
+        finally:
+            memory_profiler.stop()
+
+        self.assertEqual(['dataframe'], list(memory_profile.peaks))
+
+    def test_convert_str_to_usable_regex_with_segment_wildcards_should_not_cross_directories(
+            self):
+        self.assertEqual('a/.*/[^/]*.csv',
+                         StorageFilter.convert_str_to_usable_regex('a/**/*.csv', True))
+        self.assertEqual('a/.*.*/.*.csv', StorageFilter.convert_str_to_usable_regex('a/**/*.csv'))
+
+    def test_convert_regex_to_match_glob_should_match_at_least_the_same_blobs(self):
+        self.assertEqual('a/**csv', StorageFilter.convert_regex_to_match_glob('a/.*.csv'))
+        self.assertEqual('a/*/b/**',
+                         StorageFilter.convert_regex_to_match_glob('a/[^/]*/b/[^/]*.*'))
+        self.assertEqual('a/*', StorageFilter.convert_regex_to_match_glob('a/[^/]*'))
+
+    def test_convert_regex_to_match_glob_without_equivalent_glob_should_return_none(self):
+        # Nothing is filtered beyond the listing prefix.
+        self.assertIsNone(StorageFilter.convert_regex_to_match_glob('a/.*'))
+        # Regex syntax other than the converted wildcards.
+        self.assertIsNone(StorageFilter.convert_regex_to_match_glob('a/(b|c).*.csv'))
+        self.assertIsNone(StorageFilter.convert_regex_to_match_glob('a/b?.*.csv'))
+
+    def test_is_literal_regex_should_detect_wildcards(self):
+        self.assertTrue(StorageFilter.is_literal_regex('a/b.txt'))
+        self.assertFalse(StorageFilter.is_literal_regex('a/.*'))
+        self.assertFalse(StorageFilter.is_literal_regex(''))
+
+    def test_is_literal_regex_should_detect_regex_metacharacters(self):
+        self.assertFalse(StorageFilter.is_literal_regex('data[0-9].csv'))
+        self.assertFalse(StorageFilter.is_literal_regex('file?.txt'))
+        self.assertFalse(StorageFilter.is_literal_regex('(a|b).csv'))
+        self.assertFalse(StorageFilter.is_literal_regex('a+b.csv'))
 
     def test_parse_gcs_file_pattern_should_split_bucket_name_and_file_pattern(self):
         storage_filter = StorageFilter('test_project')
@@ -0,0 +1,160 @@
+import pandas as pd
+
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from datacatalog_fileset_enricher.gcs_storage_scan_planner import StorageScanPlanner
+
+
+class StorageScanPlannerTestCase(TestCase):
+
+    def test_create_filtered_data_for_entries_should_list_each_bucket_once(self):
+        storage_filter = MagicMock()
+        bucket = MockedObject()
+        bucket.name = 'my_bucket'
+        storage_filter.get_buckets.return_value = {'my_bucket': bucket}
+        storage_filter.create_filtered_data_for_file_regex_groups.return_value = [
+            (pd.DataFrame({'name': ['a/1', 'a/2', 'b/3']}), 3),
+            (pd.DataFrame({'name': ['a/1', 'a/2']}), 2),
+        ]
+
+        planner = StorageScanPlanner(storage_filter)
+        filtered_data = planner.create_filtered_data_for_entries([
+            [{'bucket_name': 'my_bucket', 'file_regex': 'a/.*'},
+             {'bucket_name': 'my_bucket', 'file_regex': 'b/.*'}],
+            [{'bucket_name': 'my_bucket', 'file_regex': 'a/.*'},
+             {'bucket_name': 'my_bucket', 'file_regex': 'a/.*'}],
+        ])
+
+        storage_filter.get_buckets.assert_called_once_with(['my_bucket'] * 4)
+        storage_filter.create_filtered_data_for_file_regex_groups.assert_called_once_with(
+            bucket, [['a/.*', 'b/.*'], ['a/.*']])
+
+        dataframe, filtered_buckets_stats = filtered_data[0]
+        self.assertEqual(['a/1', 'a/2', 'b/3'], list(dataframe['name']))
+        self.assertEqual([{'bucket_name': 'my_bucket', 'files': 3}], filtered_buckets_stats)
+
+        dataframe_2, filtered_buckets_stats_2 = filtered_data[1]
+        self.assertEqual(['a/1', 'a/2'], list(dataframe_2['name']))
+        self.assertEqual([{'bucket_name': 'my_bucket', 'files': 2}], filtered_buckets_stats_2)
+
+    def test_iterate_filtered_data_for_entries_should_yield_entries_once_their_buckets_are_scanned(
+            self):
+        storage_filter = MagicMock()
+        buckets = {}
+        for bucket_name in ['bucket_a', 'bucket_b']:
+            buckets[bucket_name] = MockedObject()
+            buckets[bucket_name].name = bucket_name
+        storage_filter.get_buckets.return_value = buckets
+        scanned_buckets = []
+
+        def scan_bucket(bucket, file_regex_groups):
+            scanned_buckets.append(bucket.name)
+            return [(pd.DataFrame({'name': [bucket.name]}), 1) for _ in file_regex_groups]
+
+        storage_filter.create_filtered_data_for_file_regex_groups.side_effect = scan_bucket
+
+        planner = StorageScanPlanner(storage_filter)
+        yielded_entries = []
+        for entry_index, dataframe, _ in planner.iterate_filtered_data_for_entries([
+            [{'bucket_name': 'bucket_a', 'file_regex': '.*'}],
+            [{'bucket_name': 'bucket_a', 'file_regex': '.*'},
+             {'bucket_name': 'bucket_b', 'file_regex': '.*'}],
+            [],
+        ]):
+            yielded_entries.append(
+                (entry_index, None if dataframe is None else list(dataframe['name']),
+                 list(scanned_buckets)))
+
+        self.assertEqual([
+            (2, None, []),
+            (0, ['bucket_a'], ['bucket_a']),
+            (1, ['bucket_a', 'bucket_b'], ['bucket_a', 'bucket_b']),
+        ], yielded_entries)
+
+    def test_create_filtered_data_for_entries_with_wildcard_bucket_should_reuse_listed_buckets(
+            self):
+        storage_filter = MagicMock()
+        bucket = MockedObject()
+        bucket.name = 'my_bucket_1'
+        storage_filter.list_buckets_for_bucket_pattern.return_value = [bucket]
+        storage_filter.create_filtered_data_for_file_regex_groups.return_value = [(None, 0)]
+
+        planner = StorageScanPlanner(storage_filter)
+        filtered_data = planner.create_filtered_data_for_entries(
+            [[{'bucket_name': 'my_bucket.*', 'file_regex': '.*'}]], 'my_')
+
+        storage_filter.list_buckets_for_bucket_pattern.assert_called_once_with(
+            'my_bucket.*', 'my_')
+        storage_filter.get_buckets.assert_not_called()
+        storage_filter.create_filtered_data_for_file_regex_groups.assert_called_once_with(
+            bucket, [['.*']])
+        self.assertEqual([(None, [{'bucket_name': 'my_bucket_1', 'files': 0}])], filtered_data)
+
+    def test_create_filtered_data_for_entries_with_nonexistent_bucket_should_flag_all_entries(
+            self):
+        storage_filter = MagicMock()
+        storage_filter.get_buckets.return_value = {'my_bucket': None}
+
+        planner = StorageScanPlanner(storage_filter)
+        filtered_data = planner.create_filtered_data_for_entries([
+            [{'bucket_name': 'my_bucket', 'file_regex': 'a.txt'}],
+            [{'bucket_name': 'my_bucket', 'file_regex': '.*'}],
+        ])
+
+        storage_filter.create_filtered_data_for_file_regex_groups.assert_not_called()
+        for dataframe, filtered_buckets_stats in filtered_data:
+            self.assertIsNone(dataframe)
+            self.assertEqual([{
+                'bucket_name': 'my_bucket',
+                'files': 0,
+                'bucket_not_found': True
+            }], filtered_buckets_stats)
+
+    def test_create_filtered_data_for_entries_should_resolve_literal_buckets_at_once(self):
+        storage_filter = MagicMock()
+        bucket = MockedObject()
+        bucket.name = 'my_bucket'
+        listed_bucket = MockedObject()
+        listed_bucket.name = 'logs_bucket'
+        storage_filter.get_buckets.return_value = {
+            'my_bucket': bucket,
+            'missing_bucket': None,
+            'logs_bucket': listed_bucket
+        }
+        storage_filter.list_buckets_for_bucket_pattern.return_value = [listed_bucket]
+        storage_filter.create_filtered_data_for_file_regex_groups.side_effect = \
+            lambda bucket, file_regex_groups: [(None, 0) for _ in file_regex_groups]
+
+        planner = StorageScanPlanner(storage_filter)
+        filtered_data = planner.create_filtered_data_for_entries([
+            [{'bucket_name': 'my_bucket', 'file_regex': '.*'},
+             {'bucket_name': 'logs_*', 'file_regex': '.*'}],
+            [{'bucket_name': 'missing_bucket', 'file_regex': '.*'},
+             {'bucket_name': 'logs_bucket', 'file_regex': 'a.txt'}],
+        ])
+
+        storage_filter.get_buckets.assert_called_once_with(
+            ['my_bucket', 'missing_bucket', 'logs_bucket'])
+        storage_filter.get_bucket.assert_not_called()
+        storage_filter.create_filtered_data_for_file_regex_groups.assert_any_call(
+            bucket, [['.*']])
+        storage_filter.create_filtered_data_for_file_regex_groups.assert_any_call(
+            listed_bucket, [['.*'], ['a.txt']])
+        self.assertEqual([{
+            'bucket_name': 'logs_bucket',
+            'files': 0
+        }, {
+            'bucket_name': 'missing_bucket',
+            'files': 0,
+            'bucket_not_found': True
+        }], filtered_data[1][1])
+
+
+class MockedObject(object):
+
+    def __setitem__(self, key, value):
+        self.__dict__[key] = value
+
+    def __getitem__(self, key):
+        return self.__dict__[key]
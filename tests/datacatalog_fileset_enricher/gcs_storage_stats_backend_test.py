@@ -0,0 +1,180 @@
+import os
+
+from datetime import datetime, timedelta, timezone
+from unittest import TestCase
+from unittest.mock import patch
+
+from datacatalog_fileset_enricher import gcs_storage_stats_backend
+from datacatalog_fileset_enricher.gcs_storage_stats_backend import ArrowStatsBackend, \
+    BlobsColumns, PandasStatsBackend, PythonStatsBackend, SpilledBlobs, SQLiteStatsBackend
+from datacatalog_fileset_enricher.gcs_storage_stats_summarizer import GCStorageStatsSummarizer
+
+
+class StatsBackendTestCase(TestCase):
+
+    def test_backends_should_create_identical_stats(self):
+        rows = self.__make_rows()
+        execution_time = datetime.now(timezone.utc)
+
+        pandas_stats = GCStorageStatsSummarizer.create_stats_from_dataframe(
+            PandasStatsBackend.create_dataframe(rows), ['gs://my_bucket/*'],
+            [{'bucket_name': 'my_bucket', 'files': len(rows)}], execution_time, None)
+        python_stats = GCStorageStatsSummarizer.create_stats_from_dataframe(
+            PythonStatsBackend.create_dataframe(rows), ['gs://my_bucket/*'],
+            [{'bucket_name': 'my_bucket', 'files': len(rows)}], execution_time, None)
+
+        arrow_stats = GCStorageStatsSummarizer.create_stats_from_dataframe(
+            ArrowStatsBackend.create_dataframe(rows), ['gs://my_bucket/*'],
+            [{'bucket_name': 'my_bucket', 'files': len(rows)}], execution_time, None)
+
+        self.assertEqual(pandas_stats, python_stats)
+        self.assertEqual(python_stats, arrow_stats)
+        for field in ['min_created', 'max_created', 'min_updated', 'max_updated']:
+            self.assertEqual(pandas_stats[field].isoformat(), python_stats[field].isoformat())
+            self.assertEqual(python_stats[field].isoformat(), arrow_stats[field].isoformat())
+
+    def test_spilled_blobs_should_create_identical_stats(self):
+        rows = self.__make_rows()
+
+        spilled_blobs = SQLiteStatsBackend.create_dataframe(rows)
+
+        self.assertEqual(PythonStatsBackend.summarize(PythonStatsBackend.create_dataframe(rows)),
+                         SQLiteStatsBackend.summarize(spilled_blobs))
+        spilled_blobs.close()
+
+    def test_append_dataframes_past_max_rows_in_memory_should_spill_to_disk(self):
+        rows = self.__make_rows()
+
+        dataframe = gcs_storage_stats_backend.append_dataframes(
+            None, PandasStatsBackend.create_dataframe(rows[:2]), max_rows_in_memory=3)
+        self.assertNotIsInstance(dataframe, SpilledBlobs)
+
+        dataframe = gcs_storage_stats_backend.append_dataframes(
+            dataframe, PandasStatsBackend.create_dataframe(rows[2:4]), max_rows_in_memory=3)
+        self.assertIsInstance(dataframe, SpilledBlobs)
+
+        dataframe = gcs_storage_stats_backend.append_dataframes(
+            dataframe, PythonStatsBackend.create_dataframe(rows[4:]), max_rows_in_memory=3)
+
+        self.assertEqual(len(rows), len(dataframe))
+        self.assertEqual([row[0] for row in rows],
+                         [row[0] for row in gcs_storage_stats_backend.iterate_rows(dataframe)])
+        self.assertEqual(PythonStatsBackend.summarize(PythonStatsBackend.create_dataframe(rows)),
+                         SQLiteStatsBackend.summarize(dataframe))
+
+        gcs_storage_stats_backend.release_dataframe(dataframe)
+        self.assertFalse(os.path.exists(dataframe.path))
+
+    def test_append_spilled_blobs_to_dataframe_should_keep_the_rows_order(self):
+        rows = self.__make_rows()
+        spilled_blobs = SQLiteStatsBackend.create_dataframe(rows[3:])
+
+        dataframe = gcs_storage_stats_backend.append_dataframes(
+            PythonStatsBackend.create_dataframe(rows[:3]), spilled_blobs)
+
+        self.assertIsInstance(dataframe, SpilledBlobs)
+        self.assertEqual([row[0] for row in rows],
+                         [row[0] for row in gcs_storage_stats_backend.iterate_rows(dataframe)])
+        self.assertFalse(os.path.exists(spilled_blobs.path))
+        dataframe.close()
+
+    def test_python_backend_should_append_columns(self):
+        rows = self.__make_rows()
+
+        columns = PythonStatsBackend.append(PythonStatsBackend.create_dataframe(rows[:3]),
+                                            PythonStatsBackend.create_dataframe(rows[3:]))
+
+        self.assertIsInstance(columns, BlobsColumns)
+        self.assertEqual(len(rows), len(columns))
+        self.assertEqual([row[0] for row in rows], columns.name)
+        self.assertEqual([row[2] for row in rows], list(columns.size))
+
+    def test_pandas_backend_should_append_dataframes(self):
+        rows = self.__make_rows()
+
+        dataframe = PandasStatsBackend.append(PandasStatsBackend.create_dataframe(rows[:3]),
+                                              PandasStatsBackend.create_dataframe(rows[3:]))
+
+        self.assertEqual(len(rows), len(dataframe))
+
+    def test_arrow_backend_should_append_record_batches(self):
+        rows = self.__make_rows()
+
+        table = ArrowStatsBackend.append(ArrowStatsBackend.create_dataframe(rows[:3]),
+                                         ArrowStatsBackend.create_dataframe(rows[3:]))
+
+        self.assertEqual(len(rows), len(table))
+        self.assertEqual(2, len(table.to_batches()))
+        self.assertEqual(ArrowStatsBackend, gcs_storage_stats_backend.get_stats_backend_for(table))
+        self.assertEqual([row[0] for row in rows],
+                         [row[0] for row in gcs_storage_stats_backend.iterate_rows(table)])
+
+    def test_append_arrow_tables_past_max_rows_in_memory_should_spill_to_disk(self):
+        rows = self.__make_rows()
+
+        dataframe = gcs_storage_stats_backend.append_dataframes(
+            ArrowStatsBackend.create_dataframe(rows[:3]),
+            ArrowStatsBackend.create_dataframe(rows[3:]), max_rows_in_memory=3)
+
+        self.assertIsInstance(dataframe, SpilledBlobs)
+        self.assertEqual(PythonStatsBackend.summarize(PythonStatsBackend.create_dataframe(rows)),
+                         SQLiteStatsBackend.summarize(dataframe))
+        dataframe.close()
+
+    def test_python_backend_should_count_values_by_first_appearance(self):
+        files_stats = PythonStatsBackend.summarize(PythonStatsBackend.create_dataframe(
+            self.__make_rows()))
+
+        self.assertEqual([('csv', 3), ('txt', 2), ('unknown_file_type', 1)],
+                         files_stats['files_by_type'])
+
+    def test_backends_should_parse_rfc3339_timestamps_into_epoch_columns(self):
+        rows = [['a.csv', 'https://a.csv', 10, '2020-01-01T10:30:15.123Z', '2020-01-02T00:00:00Z'],
+                ['b.csv', 'https://b.csv', 20, '2020-01-01T23:59:59.5Z', '2020-01-02T01:00:00Z']]
+
+        columns = PythonStatsBackend.create_dataframe(rows)
+        dataframe = PandasStatsBackend.create_dataframe(rows)
+        table = ArrowStatsBackend.create_dataframe(rows)
+
+        expected_created = [1577874615123000, 1577923199500000]
+        self.assertEqual(expected_created, list(columns.time_created))
+        self.assertEqual(expected_created, list(dataframe['time_created']))
+        self.assertEqual(expected_created, table['time_created'].to_pylist())
+        self.assertEqual(PythonStatsBackend.summarize(columns),
+                         PandasStatsBackend.summarize(dataframe))
+        self.assertEqual(PythonStatsBackend.summarize(columns),
+                         ArrowStatsBackend.summarize(table))
+        self.assertEqual([('2020-01-01', 2)],
+                         PythonStatsBackend.summarize(columns)['created_files_by_day'])
+
+    def test_parse_timestamps_to_epoch_us_should_support_offsets_and_datetimes(self):
+        epoch_us_column = gcs_storage_stats_backend.parse_timestamps_to_epoch_us([
+            '2020-01-01T12:30:15.123456+02:00', '2020-01-01T10:30:15+00:00',
+            datetime(2020, 1, 1, 10, 30, 15), '2020-01-01T10:30:15Z'
+        ])
+
+        self.assertEqual([1577874615123456, 1577874615000000, 1577874615000000,
+                          1577874615000000], list(epoch_us_column))
+        self.assertEqual(datetime(2020, 1, 1, 10, 30, 15, 123456, tzinfo=timezone.utc),
+                         gcs_storage_stats_backend.epoch_us_to_datetime(epoch_us_column[0]))
+
+    def test_get_stats_backend_should_resolve_backends(self):
+        self.assertEqual(PythonStatsBackend, gcs_storage_stats_backend.get_stats_backend('python'))
+        self.assertEqual(PandasStatsBackend, gcs_storage_stats_backend.get_stats_backend('pandas'))
+        self.assertEqual(ArrowStatsBackend, gcs_storage_stats_backend.get_stats_backend('arrow'))
+        self.assertEqual(PandasStatsBackend, gcs_storage_stats_backend.get_stats_backend())
+        self.assertEqual(PythonStatsBackend,
+                         gcs_storage_stats_backend.get_stats_backend_for(BlobsColumns()))
+
+    @patch.dict('sys.modules', {'pandas': None})
+    def test_get_stats_backend_without_pandas_should_fall_back_to_python(self):
+        self.assertEqual(PythonStatsBackend, gcs_storage_stats_backend.get_stats_backend())
+
+    @classmethod
+    def __make_rows(cls):
+        first_day = datetime(2020, 1, 1, 10, 30, 15, 123456, tzinfo=timezone.utc)
+        file_names = ['a.csv', 'b.txt', 'c.csv', 'd', 'e.txt', 'f.csv']
+        return [[
+            file_name, f'https://{file_name}', (i + 1) * 123457, first_day + timedelta(days=i % 2),
+            first_day + timedelta(days=i % 3, hours=i)
+        ] for i, file_name in enumerate(file_names)]
@@ -0,0 +1,104 @@
+import io
+
+from unittest import TestCase
+from unittest.mock import patch
+
+from datacatalog_fileset_enricher.memory_profiler import EntryMemoryProfile, MemoryProfiler, \
+    profile_phase
+
+
+class MemoryProfilerTestCase(TestCase):
+
+    def setUp(self):
+        self.__memory_profiler = MemoryProfiler()
+        self.__memory_profiler.start()
+
+    def tearDown(self):
+        self.__memory_profiler.stop()
+
+    def test_profile_should_record_peak_and_retained_memory_by_phase(self):
+        with self.__memory_profiler.profile('entry') as memory_profile:
+            with memory_profile.phase('listing'):
+                transient = bytearray(4 * 2**20)
+                del transient
+                retained = bytearray(2**20)
+            with memory_profile.phase('stats'):
+                pass
+
+        self.assertEqual([memory_profile], self.__memory_profiler.profiles)
+        self.assertGreater(memory_profile.peaks['listing'], 3 * 2**20)
+        self.assertGreater(memory_profile.retained['listing'], 2**19)
+        self.assertLess(memory_profile.retained['listing'], 2 * 2**20)
+        self.assertLess(memory_profile.peaks['stats'], 2**20)
+        self.assertEqual(memory_profile.peaks['listing'], memory_profile.peak)
+        self.assertIsNotNone(retained)
+
+    def test_nested_phases_should_keep_the_peak_of_the_enclosing_phase(self):
+        with self.__memory_profiler.profile('entry') as memory_profile:
+            with memory_profile.phase('listing'):
+                transient = bytearray(4 * 2**20)
+                del transient
+                # Repeated phases keep their highest peak.
+                for size in [2**20, 2**19]:
+                    with profile_phase('dataframe'):
+                        bytearray(size)
+
+        self.assertGreater(memory_profile.peaks['listing'], 3 * 2**20)
+        self.assertGreater(memory_profile.peaks['dataframe'], 2**19)
+        self.assertLess(memory_profile.peaks['dataframe'], 2 * 2**20)
+
+    @patch('datacatalog_fileset_enricher.memory_profiler._can_reset_peak', False)
+    def test_profile_without_reset_peak_should_trace_the_peak_of_each_entry(self):
+        with self.__memory_profiler.profile('heavy_entry') as heavy_profile:
+            with heavy_profile.phase('listing'):
+                bytearray(8 * 2**20)
+        with self.__memory_profiler.profile('entry') as memory_profile:
+            with memory_profile.phase('listing'):
+                transient = bytearray(4 * 2**20)
+                del transient
+                retained = bytearray(2**20)
+            with memory_profile.phase('stats'):
+                pass
+
+        self.assertGreater(heavy_profile.peaks['listing'], 7 * 2**20)
+        self.assertGreater(memory_profile.peaks['listing'], 3 * 2**20)
+        self.assertLess(memory_profile.peaks['listing'], 6 * 2**20)
+        self.assertGreater(memory_profile.retained['listing'], 2**19)
+        # The stats phase didn't raise the peak, so the memory in use when it ended is used.
+        self.assertLess(memory_profile.peaks['stats'], 2**20)
+        self.assertIsNotNone(retained)
+
+    def test_profile_phase_outside_a_profile_should_not_record_memory(self):
+        memory_profile = EntryMemoryProfile('entry')
+        with profile_phase('dataframe'):
+            bytearray(2**20)
+
+        self.assertEqual({}, memory_profile.peaks)
+
+    def test_write_report_should_rank_entries_by_peak(self):
+        with self.__memory_profiler.profile('light_entry') as memory_profile:
+            with memory_profile.phase('listing'):
+                bytearray(2**20)
+        with self.__memory_profiler.profile('heavy_entry') as memory_profile:
+            memory_profile.matched_objects = 1000
+            with memory_profile.phase('listing'):
+                bytearray(8 * 2**20)
+
+        report = io.StringIO()
+        self.__memory_profiler.write_report(report)
+
+        lines = report.getvalue().splitlines()
+        self.assertEqual(3, len(lines))
+        self.assertTrue(lines[1].endswith('heavy_entry'))
+        self.assertTrue(lines[2].endswith('light_entry'))
+        self.assertIn('1000', lines[1])
+
+    def test_phase_without_tracing_should_not_record_memory(self):
+        self.__memory_profiler.stop()
+
+        memory_profile = EntryMemoryProfile('entry')
+        with memory_profile.phase('listing'):
+            bytearray(2**20)
+
+        self.assertEqual({}, memory_profile.peaks)
+        self.assertEqual(0, memory_profile.peak)
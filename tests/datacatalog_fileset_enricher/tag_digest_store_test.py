@@ -0,0 +1,71 @@
+import os
+import tempfile
+
+from datetime import datetime
+from unittest import TestCase
+from unittest.mock import patch
+
+from datacatalog_fileset_enricher.tag_digest_store import TagDigestStore
+
+
+class TagDigestStoreTestCase(TestCase):
+
+    def test_is_up_to_date_should_match_the_saved_digest(self):
+        tag_digest_store = TagDigestStore(':memory:')
+
+        self.assertFalse(tag_digest_store.is_up_to_date('entry', 'template', 'digest'))
+
+        tag_digest_store.save('entry', 'template', 'digest')
+
+        self.assertTrue(tag_digest_store.is_up_to_date('entry', 'template', 'digest'))
+        self.assertFalse(tag_digest_store.is_up_to_date('entry', 'template', 'other_digest'))
+        self.assertFalse(tag_digest_store.is_up_to_date('entry', 'other_template', 'digest'))
+
+    @patch('time.time')
+    def test_is_up_to_date_past_max_staleness_should_be_false(self, current_time):
+        tag_digest_store = TagDigestStore(':memory:', max_staleness=3600)
+
+        current_time.return_value = 1000
+        tag_digest_store.save('entry', 'template', 'digest')
+
+        current_time.return_value = 4599
+        self.assertTrue(tag_digest_store.is_up_to_date('entry', 'template', 'digest'))
+        current_time.return_value = 4600
+        self.assertFalse(tag_digest_store.is_up_to_date('entry', 'template', 'digest'))
+
+    @patch('time.time')
+    def test_get_last_enrichments_should_return_the_recorded_entries(self, current_time):
+        tag_digest_store = TagDigestStore(':memory:')
+
+        current_time.return_value = 1000
+        tag_digest_store.save_enrichment('entry', 'template', 10)
+        tag_digest_store.save_enrichment('entry_2', 'template', None)
+        tag_digest_store.save_enrichment('entry_3', 'template', 30)
+        tag_digest_store.save_enrichment('entry', 'other_template', 40)
+        current_time.return_value = 2000
+        tag_digest_store.save_enrichment('entry_2', 'template', 20)
+
+        self.assertEqual(
+            {
+                'entry': (datetime(1970, 1, 1, 0, 16, 40), 10),
+                'entry_2': (datetime(1970, 1, 1, 0, 33, 20), 20)
+            }, tag_digest_store.get_last_enrichments(['entry', 'entry_2', 'entry_4'],
+                                                     'template'))
+
+        tag_digest_store.clear()
+        self.assertEqual({}, tag_digest_store.get_last_enrichments(['entry'], 'template'))
+
+    def test_digests_should_persist_until_cleared(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'digests.db')
+
+            tag_digest_store = TagDigestStore(path)
+            tag_digest_store.save('entry', 'template', 'digest')
+            tag_digest_store.close()
+
+            tag_digest_store = TagDigestStore(path)
+            self.assertTrue(tag_digest_store.is_up_to_date('entry', 'template', 'digest'))
+
+            tag_digest_store.clear()
+            self.assertFalse(tag_digest_store.is_up_to_date('entry', 'template', 'digest'))
+            tag_digest_store.close()